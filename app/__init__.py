@@ -0,0 +1,4 @@
+# Load .env once, before any module reads its settings from the environment
+from dotenv import load_dotenv
+
+load_dotenv()
@@ -0,0 +1,634 @@
+"""Cold storage for old expenses: one columnar segment file per month.
+
+Almost every request touches the last few months of expenses, so months older
+than ARCHIVE_HOT_MONTHS can be moved out of ``expenses`` and
+``expense_details`` into read-only files in ARCHIVE_DIR:
+
+    python -m app.archive run       # archive every month before the hot window
+    python -m app.archive status
+
+The tables then hold only the hot months, so their indexes stay small and
+inserts and recent-window queries cost the same however much history builds
+up. Reads that reach further back union the hot rows with the segments: the
+listings continue into the archive when the hot rows run out, and the balance
+sheet, reports, settlements, the ledger check and the rollup backfill merge
+the archived rows or totals with the hot ones.
+
+Segment layout: rows are sorted by (user_id, date, id), the order of the
+``ix_expenses_user_id_date_id`` index, so one user's month is a contiguous run
+found by binary search. The fixed-width columns (ids, amounts in cents, dates
+in microseconds, method codes) are stored raw and 8-byte aligned, and are read
+in place through ``mmap``; two permutations give date order and id order. The
+descriptions, the one variable-length column and most of a segment's bytes,
+are zlib-compressed and inflated on first use. Totals per user and per day are
+computed when a segment is written, so the ledger, settlements and rollups
+never read archived rows.
+
+``manifest.json`` lists the segments and ``boundary``, the end of the newest
+archived month. It is replaced atomically, and workers check it for changes
+every ARCHIVE_REFRESH_SECONDS. Hot queries add ``date >= boundary`` (see
+``Archive.hot``), so a month is read from exactly one place, even while the
+archiver deletes it from the tables after waiting for workers to notice the
+new manifest. Rows written later with a date before the boundary are ignored.
+
+Archiving is off unless ARCHIVE_DIR is set.
+"""
+import argparse
+import bisect
+import heapq
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from operator import itemgetter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, func, or_, select, text
+
+from app import database, models, schemas, sharding
+from app.money import from_cents, to_cents
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "")
+ARCHIVE_HOT_MONTHS = int(os.getenv("ARCHIVE_HOT_MONTHS", "3"))
+ARCHIVE_REFRESH_SECONDS = float(os.getenv("ARCHIVE_REFRESH_SECONDS", "1"))
+ARCHIVE_CHUNK_SIZE = 1000  # Rows deleted per transaction once a month is archived
+
+MAGIC = b"EXPSEG01"
+MANIFEST = "manifest.json"
+NULL = -(1 << 63)  # NULL in the integer columns; sorts before every real value
+EPOCH = datetime(1970, 1, 1)
+METHODS = [method.value for method in schemas.ExpenseMethod]
+
+
+def to_micros(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+class ArchivedDetail(NamedTuple):
+    user_id: Optional[int]
+    amount_owed: Optional[Decimal]
+    percentage: Optional[Decimal]
+    user: Optional[models.User] = None
+
+
+class ArchivedExpense(NamedTuple):
+    """An expense read from a segment; has the attributes the API schemas read from ``models.Expense``."""
+    id: int
+    user_id: Optional[int]
+    amount: Decimal
+    method: str
+    description: str
+    date: datetime
+    owner: Optional[models.User] = None
+    details: Tuple[ArchivedDetail, ...] = ()
+
+
+def _optional(value: int) -> Optional[int]:
+    return None if value == NULL else value
+
+
+def _optional_cents(value: int) -> Optional[Decimal]:
+    return None if value == NULL else from_cents(value)
+
+
+class Segment:
+    """One archived month, mapped read-only."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:8] != MAGIC:
+            raise ValueError(f"{path} is not an expense segment.")
+        header_size = int.from_bytes(self._map[8:16], "little")
+        self.meta = json.loads(self._map[16:16 + header_size])
+        data_start = -(-(16 + header_size) // 8) * 8
+
+        view = memoryview(self._map)
+        columns = {}
+        for name, (offset, size, code) in self.meta["columns"].items():
+            raw = view[data_start + offset:data_start + offset + size]
+            if code == "B" or sys.byteorder == self.meta["byteorder"]:
+                columns[name] = raw.cast(code)
+            else:
+                columns[name] = array(code, raw)
+                columns[name].byteswap()
+        self.size = len(self._map)
+        self.rows = self.meta["rows"]
+        self.start = datetime.fromisoformat(self.meta["start"])
+        self.end = datetime.fromisoformat(self.meta["end"])
+        self.ids = columns["id"]
+        self.user_ids = columns["user_id"]
+        self.amounts = columns["amount"]
+        self.dates = columns["date"]
+        self.methods = columns["method"]
+        self.description_offsets = columns["description_offsets"]
+        self.detail_starts = columns["detail_starts"]
+        self.by_date = columns["by_date"]
+        self.by_id = columns["by_id"]
+        self.detail_users = columns["detail_user_id"]
+        self.detail_amounts = columns["detail_amount_owed"]
+        self.detail_percentages = columns["detail_percentage"]
+        self._compressed = columns["descriptions"]
+        self._descriptions: Optional[bytes] = None
+
+    def description(self, i: int) -> str:
+        if self._descriptions is None:
+            self._descriptions = zlib.decompress(self._compressed)
+        return self._descriptions[self.description_offsets[i]:self.description_offsets[i + 1]].decode()
+
+    def row(self, i: int) -> tuple:
+        """Row ``i`` in the column order of ``crud.expense_rows_query``."""
+        return (self.ids[i], _optional(self.user_ids[i]), from_cents(self.amounts[i]), METHODS[self.methods[i]],
+                self.description(i), from_micros(self.dates[i]))
+
+    def expense(self, i: int, details: bool = False) -> ArchivedExpense:
+        if not details:
+            return ArchivedExpense(*self.row(i))
+        return ArchivedExpense(*self.row(i), details=tuple(
+            ArchivedDetail(_optional(self.detail_users[j]), _optional_cents(self.detail_amounts[j]),
+                           _optional_cents(self.detail_percentages[j]))
+            for j in range(self.detail_starts[i], self.detail_starts[i + 1])
+        ))
+
+    def user_range(self, user_id: Optional[int]) -> Tuple[int, int]:
+        key = NULL if user_id is None else user_id
+        start = bisect.bisect_left(self.user_ids, key)
+        return start, bisect.bisect_right(self.user_ids, key, start)
+
+    def find(self, expense_id: int) -> Optional[int]:
+        if not self.meta["min_id"] <= expense_id <= self.meta["max_id"]:
+            return None
+        ids, by_id = self.ids, self.by_id
+        k = bisect.bisect_left(range(self.rows), expense_id, key=lambda k: ids[by_id[k]])
+        return by_id[k] if k < self.rows and ids[by_id[k]] == expense_id else None
+
+
+def write_segment(path: str, start: datetime, end: datetime, expenses: List[tuple], details: Dict[int, List[tuple]]):
+    """Write one month to ``path``.
+
+    ``expenses`` holds ``(id, user_id, amount, method, description, date)`` rows
+    and ``details`` maps an expense id to its ``(user_id, amount_owed,
+    percentage)`` rows. The file is written beside ``path`` and moved into place.
+    """
+    from app.services import ledger_service, rollup_service
+
+    def sort_key(row):
+        return (NULL if row[1] is None else row[1], to_micros(row[5]), row[0])
+
+    expenses = sorted(expenses, key=sort_key)
+    columns = {name: array("q") for name in (
+        "id", "user_id", "amount", "date", "description_offsets", "detail_starts",
+        "detail_user_id", "detail_amount_owed", "detail_percentage",
+    )}
+    methods = array("B")
+    texts = []
+    text_size = 0
+    ledger = defaultdict(lambda: [0, 0])
+    balances = defaultdict(int)
+    rollups = rollup_service.new_rollups()
+
+    columns["description_offsets"].append(0)
+    columns["detail_starts"].append(0)
+    for expense_id, user_id, amount, method, description, created in expenses:
+        columns["id"].append(expense_id)
+        columns["user_id"].append(NULL if user_id is None else user_id)
+        columns["amount"].append(to_cents(amount))
+        columns["date"].append(to_micros(created))
+        methods.append(METHODS.index(method))
+        encoded = description.encode()
+        texts.append(encoded)
+        text_size += len(encoded)
+        columns["description_offsets"].append(text_size)
+
+        split = details.get(expense_id, [])
+        for participant_id, amount_owed, percentage in split:
+            columns["detail_user_id"].append(NULL if participant_id is None else participant_id)
+            columns["detail_amount_owed"].append(NULL if amount_owed is None else to_cents(amount_owed))
+            columns["detail_percentage"].append(NULL if percentage is None else to_cents(percentage))
+            if user_id is not None and participant_id is not None and amount_owed is not None and user_id != participant_id:
+                balances[user_id] += to_cents(amount_owed)
+                balances[participant_id] -= to_cents(amount_owed)
+        columns["detail_starts"].append(len(columns["detail_user_id"]))
+
+        split = [{"user_id": participant_id, "amount_owed": amount_owed} for participant_id, amount_owed, _ in split]
+        for ledger_user, (paid, owed) in ledger_service.expense_deltas(user_id, amount, split).items():
+            ledger[ledger_user][0] += to_cents(paid)
+            ledger[ledger_user][1] += to_cents(owed)
+        rollup_service.add_expense(rollups, ArchivedExpense(expense_id, user_id, amount, method, description, created),
+                                   split)
+
+    order = range(len(expenses))
+    columns["by_date"] = array("q", sorted(order, key=lambda i: (columns["date"][i], columns["id"][i])))
+    columns["by_id"] = array("q", sorted(order, key=columns["id"].__getitem__))
+
+    blobs = {name: column.tobytes() if sys.byteorder == "little" else _swapped(column) for name, column in columns.items()}
+    blobs["method"] = methods.tobytes()
+    blobs["descriptions"] = zlib.compress(b"".join(texts), 6)
+
+    layout = {}
+    offset = 0
+    for name, blob in blobs.items():
+        layout[name] = [offset, len(blob), "B" if name in ("method", "descriptions") else "q"]
+        offset += -(-len(blob) // 8) * 8
+    header = json.dumps({
+        "byteorder": "little",
+        "rows": len(expenses),
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "min_id": min(columns["id"], default=0),
+        "max_id": max(columns["id"], default=0),
+        "columns": layout,
+        "ledger": [[user_id, paid, owed] for user_id, (paid, owed) in ledger.items()],
+        "balances": [[user_id, cents] for user_id, cents in balances.items() if cents],
+        "daily_users": [[day.isoformat(), user_id, to_cents(paid), to_cents(owed), count]
+                        for (day, user_id), (paid, owed, count) in rollups.users.items()],
+        "daily_methods": [[day.isoformat(), method, to_cents(amount), count]
+                          for (day, method), (amount, count) in rollups.methods.items()],
+    }, separators=(",", ":")).encode()
+
+    partial = path + ".part"
+    with open(partial, "wb") as file:
+        file.write(MAGIC + len(header).to_bytes(8, "little") + header)
+        file.write(b"\0" * (-file.tell() % 8))
+        for blob in blobs.values():
+            file.write(blob)
+            file.write(b"\0" * (-len(blob) % 8))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial, path)
+
+
+def _swapped(column: array) -> bytes:
+    column = array(column.typecode, column)
+    column.byteswap()
+    return column.tobytes()
+
+
+class Archive:
+    """The archived months as of one manifest; hot queries and archive reads should share one snapshot."""
+
+    def __init__(self, segments: List[Segment], boundary: Optional[datetime]):
+        self.segments = sorted(segments, key=lambda segment: segment.start, reverse=True)  # Newest first
+        self.boundary = boundary
+
+    def hot(self) -> list:
+        """Conditions keeping a query on ``expenses`` to the months that are not archived."""
+        if self.boundary is None:
+            return []
+        return [or_(models.Expense.date >= self.boundary, models.Expense.date.is_(None))]
+
+    def _positions(self, query: Optional[schemas.ExpenseQuery], user_id: Optional[int],
+                   before: Optional[Tuple[datetime, int]]) -> Iterator[Tuple[Segment, int]]:
+        upper = (to_micros(before[0]), before[1]) if before else (sys.maxsize, sys.maxsize)
+        lower = None
+        method = min_cents = max_cents = None
+        if query is not None:
+            if query.date_to is not None:
+                upper = min(upper, (to_micros(query.date_to), NULL))
+            if query.date_from is not None:
+                lower = to_micros(query.date_from)
+            if query.method is not None:
+                method = METHODS.index(query.method.value)
+            if query.min_amount is not None:
+                min_cents = query.min_amount * 100
+            if query.max_amount is not None:
+                max_cents = query.max_amount * 100
+
+        for segment in self.segments:
+            if upper[0] < to_micros(segment.start):
+                continue
+            if lower is not None and to_micros(segment.end) <= lower:
+                break
+            dates, ids = segment.dates, segment.ids
+            if user_id is None:
+                order = segment.by_date
+                low, high = 0, segment.rows
+            else:
+                order = range(segment.rows)
+                low, high = segment.user_range(user_id)
+            top = bisect.bisect_left(order, upper, low, high, key=lambda i: (dates[i], ids[i]))
+            for k in range(top - 1, low - 1, -1):
+                i = order[k]
+                if lower is not None and dates[i] < lower:
+                    break
+                if method is not None and segment.methods[i] != method:
+                    continue
+                if min_cents is not None and segment.amounts[i] < min_cents:
+                    continue
+                if max_cents is not None and segment.amounts[i] > max_cents:
+                    continue
+                yield segment, i
+
+    def rows(self, query: Optional[schemas.ExpenseQuery] = None, user_id: Optional[int] = None,
+             before: Optional[Tuple[datetime, int]] = None) -> Iterator[tuple]:
+        """Archived expenses matching a listing, newest first, from just past ``before`` on.
+
+        Rows have the columns of ``crud.expense_rows_query``.
+        """
+        for segment, i in self._positions(query, user_id, before):
+            yield segment.row(i)
+
+    def expenses(self, query: Optional[schemas.ExpenseQuery] = None, user_id: Optional[int] = None,
+                 before: Optional[Tuple[datetime, int]] = None, details: bool = False) -> Iterator[ArchivedExpense]:
+        """Like ``rows``, as ArchivedExpense objects, optionally with their details."""
+        for segment, i in self._positions(query, user_id, before):
+            yield segment.expense(i, details=details)
+
+    def find(self, expense_id: int) -> Optional[ArchivedExpense]:
+        for segment in self.segments:
+            i = segment.find(expense_id)
+            if i is not None:
+                return segment.expense(i, details=True)
+        return None
+
+    def by_user(self) -> Iterator[tuple]:
+        """``(user_id, id, amount, method, description)`` for every payer, ordered by payer and id."""
+        def segment_rows(segment: Segment):
+            ids = segment.ids
+            start = bisect.bisect_right(segment.user_ids, NULL)  # Expenses without a payer are not listed
+            while start < segment.rows:
+                user_id = segment.user_ids[start]
+                end = bisect.bisect_right(segment.user_ids, user_id, start)
+                for i in sorted(range(start, end), key=ids.__getitem__):
+                    yield (user_id, ids[i], from_cents(segment.amounts[i]), METHODS[segment.methods[i]],
+                           segment.description(i))
+                start = end
+
+        return heapq.merge(*map(segment_rows, self.segments), key=itemgetter(0, 1))
+
+    def by_id(self) -> Iterator[tuple]:
+        """Every archived expense as in ``rows``, in id order."""
+        def segment_rows(segment: Segment):
+            for i in segment.by_id:
+                yield segment.row(i)
+
+        return heapq.merge(*map(segment_rows, self.segments), key=itemgetter(0))
+
+    def ledger(self) -> Dict[int, List[Decimal]]:
+        """``{user_id: [paid, owed]}`` over the archived expenses."""
+        totals = defaultdict(lambda: [0, 0])
+        for segment in self.segments:
+            for user_id, paid, owed in segment.meta["ledger"]:
+                totals[user_id][0] += paid
+                totals[user_id][1] += owed
+        return {user_id: [from_cents(paid), from_cents(owed)] for user_id, (paid, owed) in totals.items()}
+
+    def balances(self) -> Dict[int, int]:
+        """Net debts in cents per user, as ``settlement_service.net_balances`` counts them."""
+        balances = defaultdict(int)
+        for segment in self.segments:
+            for user_id, cents in segment.meta["balances"]:
+                balances[user_id] += cents
+        return balances
+
+    def add_rollups(self, rollups):
+        """Add the archived daily totals to a ``rollup_service.Rollups``."""
+        for segment in self.segments:
+            for day, user_id, paid, owed, count in segment.meta["daily_users"]:
+                totals = rollups.users[date.fromisoformat(day), user_id]
+                totals[0] += from_cents(paid)
+                totals[1] += from_cents(owed)
+                totals[2] += count
+            for day, method, amount, count in segment.meta["daily_methods"]:
+                totals = rollups.methods[date.fromisoformat(day), method]
+                totals[0] += from_cents(amount)
+                totals[1] += count
+
+
+_EMPTY = Archive([], None)
+_current = _EMPTY
+_manifest_version = None
+_checked_at = 0.0
+_open_segments: Dict[str, Segment] = {}
+_lock = threading.Lock()
+
+
+def manifest_path() -> str:
+    return os.path.join(ARCHIVE_DIR, MANIFEST)
+
+
+def read_manifest() -> dict:
+    try:
+        with open(manifest_path()) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"boundary": None, "segments": []}
+
+
+def _write_manifest(manifest: dict):
+    partial = manifest_path() + ".part"
+    with open(partial, "w") as file:
+        json.dump(manifest, file, indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial, manifest_path())
+
+
+def current() -> Archive:
+    """The archive as the manifest describes it, checked for changes every ARCHIVE_REFRESH_SECONDS."""
+    global _current, _manifest_version, _checked_at
+    if not ARCHIVE_DIR:
+        return _EMPTY
+    with _lock:
+        if time.monotonic() - _checked_at < ARCHIVE_REFRESH_SECONDS:
+            return _current
+        _checked_at = time.monotonic()
+        try:
+            stat = os.stat(manifest_path())
+            version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = None
+        if version != _manifest_version:
+            manifest = read_manifest()
+            segments = []
+            for entry in manifest["segments"]:
+                if entry["file"] not in _open_segments:
+                    _open_segments[entry["file"]] = Segment(os.path.join(ARCHIVE_DIR, entry["file"]))
+                segments.append(_open_segments[entry["file"]])
+            boundary = manifest["boundary"] and datetime.fromisoformat(manifest["boundary"])
+            _current = Archive(segments, boundary)
+            _manifest_version = version
+        return _current
+
+
+def _read_month(start: datetime, end: datetime) -> Tuple[List[tuple], Dict[int, List[tuple]]]:
+    expenses_table = models.Expense.__table__
+    details_table = models.ExpenseDetail.__table__
+    expenses, details = [], defaultdict(list)
+    db = database.SessionLocal()
+    try:
+        for shard_db in sharding.each_shard(db):
+            rows = shard_db.execute(
+                select(expenses_table.c.id, expenses_table.c.user_id, expenses_table.c.amount,
+                       expenses_table.c.method, expenses_table.c.description, expenses_table.c.date)
+                .where(expenses_table.c.date >= start, expenses_table.c.date < end, *sharding.visible(shard_db))
+            ).all()
+            expenses.extend(tuple(row) for row in rows)
+            for chunk_start in range(0, len(rows), ARCHIVE_CHUNK_SIZE):
+                ids = [row.id for row in rows[chunk_start:chunk_start + ARCHIVE_CHUNK_SIZE]]
+                for row in shard_db.execute(
+                    select(details_table.c.expense_id, details_table.c.user_id,
+                           details_table.c.amount_owed, details_table.c.percentage)
+                    .where(details_table.c.expense_id.in_(ids))
+                    .order_by(details_table.c.id)
+                ):
+                    details[row.expense_id].append((row.user_id, row.amount_owed, row.percentage))
+    finally:
+        db.close()
+    return expenses, details
+
+
+def _partition_exists(conn, name: str) -> bool:
+    if conn.dialect.name != "mysql":
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'expenses' AND PARTITION_NAME = :name"
+    ), {"name": name}).first() is not None
+
+
+def delete_month(start: datetime, end: datetime, chunk_size: int = ARCHIVE_CHUNK_SIZE) -> int:
+    """Delete an archived month from the tables of the primary or every shard; returns the expenses removed.
+
+    A MySQL partition for the month (see ``app.migrations.partition_expenses``)
+    is dropped in one statement instead of deleting its rows.
+    """
+    from app.migrations.partition_expenses import partition_name
+
+    expenses_table = models.Expense.__table__
+    engines = list(database.shard_engines().values()) or [database.engine]
+    deleted = 0
+    for engine in engines:
+        with engine.connect() as conn:
+            partition = partition_name(start) if _partition_exists(conn, partition_name(start)) else None
+        last_id = 0
+        while True:
+            with engine.connect() as conn:
+                ids = conn.execute(
+                    select(expenses_table.c.id)
+                    .where(expenses_table.c.date >= start, expenses_table.c.date < end, expenses_table.c.id > last_id)
+                    .order_by(expenses_table.c.id).limit(chunk_size)
+                ).scalars().all()
+            if not ids:
+                break
+            last_id = ids[-1]
+            # Idempotency keys are on the primary, also when the expenses are on shards
+            with database.engine.begin() as conn:
+                conn.execute(delete(models.IdempotencyKey.__table__).where(models.IdempotencyKey.expense_id.in_(ids)))
+            with engine.begin() as conn:
+                conn.execute(delete(models.ExpenseDetail.__table__).where(models.ExpenseDetail.expense_id.in_(ids)))
+                if partition is None:
+                    conn.execute(delete(expenses_table).where(expenses_table.c.id.in_(ids)))
+                deleted += len(ids)
+        if partition is not None:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE expenses DROP PARTITION {partition}"))
+    return deleted
+
+
+def _oldest_hot_expense(boundary: Optional[datetime]) -> Optional[datetime]:
+    oldest = []
+    for engine in list(database.shard_engines().values()) or [database.engine]:
+        with engine.connect() as conn:
+            stmt = select(func.min(models.Expense.date))
+            if boundary is not None:
+                stmt = stmt.where(models.Expense.date >= boundary)
+            value = conn.execute(stmt).scalar()
+            if value is not None:
+                oldest.append(value)
+    return min(oldest, default=None)
+
+
+def run(hot_months: int = ARCHIVE_HOT_MONTHS, chunk_size: int = ARCHIVE_CHUNK_SIZE, log=print) -> int:
+    """Archive every month that ended before the hot window, oldest first. Returns the months archived.
+
+    Each month is written to its segment and published in the manifest; after
+    the workers have had time to reload the manifest, the month is deleted from
+    the tables. A run interrupted between the two finishes the deletion first.
+    """
+    if not ARCHIVE_DIR:
+        raise RuntimeError("ARCHIVE_DIR is not set.")
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    cutoff = add_months(month_start(datetime.utcnow()), -hot_months)
+    manifest = read_manifest()
+    boundary = manifest["boundary"] and datetime.fromisoformat(manifest["boundary"])
+
+    if boundary is not None:
+        # Rows left in the tables by an interrupted run
+        for entry in manifest["segments"]:
+            start, end = datetime.fromisoformat(entry["start"]), datetime.fromisoformat(entry["end"])
+            leftover = delete_month(start, end, chunk_size)
+            if leftover:
+                log(f"{entry['month']}: removed {leftover} already archived expenses")
+
+    archived = 0
+    oldest = _oldest_hot_expense(boundary)
+    start = month_start(oldest) if oldest is not None else cutoff
+    if boundary is not None:
+        start = max(start, boundary)
+    while start < cutoff:
+        end = add_months(start, 1)
+        expenses, details = _read_month(start, end)
+        if expenses:
+            name = f"expenses-{start:%Y-%m}.seg"
+            write_segment(os.path.join(ARCHIVE_DIR, name), start, end, expenses, details)
+            manifest["segments"].append({
+                "month": f"{start:%Y-%m}", "file": name, "start": start.isoformat(), "end": end.isoformat(),
+                "rows": len(expenses),
+            })
+        manifest["boundary"] = end.isoformat()
+        _write_manifest(manifest)
+        if expenses:
+            time.sleep(2 * ARCHIVE_REFRESH_SECONDS)
+            delete_month(start, end, chunk_size)
+            archived += 1
+            log(f"{start:%Y-%m}: archived {len(expenses)} expenses")
+        start = end
+    return archived
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old months of expenses to the archive.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="archive every month before the hot window")
+    run_parser.add_argument("--hot-months", type=int, default=ARCHIVE_HOT_MONTHS)
+    run_parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK_SIZE)
+    commands.add_parser("status", help="list the archived months")
+    args = parser.parse_args(argv)
+
+    if not ARCHIVE_DIR:
+        parser.error("ARCHIVE_DIR is not set.")
+    if args.command == "run":
+        print(f"Archived {run(args.hot_months, args.chunk_size)} months.")
+        return 0
+
+    manifest = read_manifest()
+    for entry in manifest["segments"]:
+        size = os.path.getsize(os.path.join(ARCHIVE_DIR, entry["file"]))
+        print(f"{entry['month']}  {entry['rows']:>10} expenses  {size / 1e6:>9.1f} MB")
+    print(f"Hot from {manifest['boundary'] or 'the beginning'}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
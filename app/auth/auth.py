@@ -1,30 +1,42 @@
+import logging
 import os
-from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
 from sqlalchemy.orm import Session
-from app import crud, models
+from app import crud, models, schemas
+from app.auth.user_cache import user_cache
+from app.config.security import ALGORITHM, SECRET_KEY
 from app.database import get_db
 
-# Load environment variables from .env file
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Constants for JWT configuration
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = "HS256"
+# In stateless mode tokens carry the user's profile claims, so authenticated
+# requests need no database lookup at all. Changes to a user only show up in
+# tokens issued afterwards.
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "").lower() in ("1", "true", "yes")
 
 # Dependency for OAuth2 authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+def token_claims(user: models.User) -> dict:
+    """Claims to put in a user's access token."""
+    claims = {"sub": str(user.id)}
+    if AUTH_STATELESS:
+        claims.update(email=user.email, name=user.name, mobile_number=user.mobile_number)
+    return claims
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.User:
     """Retrieve the current user based on the JWT token provided."""
+    from jose import JWTError, jwt  # Deferred with the rest of the crypto stack; cached after the first call
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    if not SECRET_KEY:
+        raise credentials_exception
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: int = int(payload.get("sub"))  # Ensure user_id is an integer
@@ -32,14 +44,27 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         if user_id is None:
             raise credentials_exception
     except JWTError as e:
-        print(f"JWTError: {e}")
+        logger.debug("jwt rejected error=%s", e)
         raise credentials_exception
 
-    user = crud.get_user(db, user_id=user_id)
+    if AUTH_STATELESS and "email" in payload:
+        return schemas.User(
+            id=user_id,
+            email=payload["email"],
+            name=payload.get("name"),
+            mobile_number=payload.get("mobile_number"),
+        )
+
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    db_user = crud.get_user(db, user_id=user_id)
     
-    if user is None:
-        print(f"No user found for user_id: {user_id}")
+    if db_user is None:
+        logger.debug("token user not found user_id=%s", user_id)
         raise credentials_exception
 
-    print(f"User found: {user.email}")
+    user = schemas.User.model_validate(db_user)
+    user_cache.set(user_id, user)
     return user
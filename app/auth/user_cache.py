@@ -0,0 +1,72 @@
+"""TTL + LRU cache of authenticated users, keyed by user id.
+
+``get_current_user`` consults it before querying ``users``. Entries expire after
+USER_CACHE_TTL seconds, the least recently used ones are evicted beyond
+USER_CACHE_SIZE, and any ORM update or delete of a user invalidates its entry.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import event
+
+from app import metrics, models, schemas
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+cache_hits = metrics.counter("user_cache_hits_total", "Authenticated users served from the user cache.")
+cache_misses = metrics.counter("user_cache_misses_total", "Authenticated users loaded from the database.")
+
+
+class UserCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[schemas.User]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                expires_at, user = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    cache_hits.inc()
+                    return user
+                del self._entries[user_id]
+        cache_misses.inc()
+        return None
+
+    def set(self, user_id: int, user: schemas.User):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+metrics.gauge("user_cache_size", "Users currently held in the user cache.", callback=lambda: len(user_cache))
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
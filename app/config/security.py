@@ -1,38 +1,102 @@
 # app/security/password.py
 
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from functools import lru_cache, partial
+from typing import Optional, Tuple
+import asyncio
 import os
-from dotenv import load_dotenv  # Importing load_dotenv
+import threading
 
-# Load environment variables from a .env file
-load_dotenv()
+# passlib/bcrypt and jose/cryptography are imported on first use, so workers
+# start without loading them.
 
-# Retrieve the SECRET_KEY, with a default value for development
-SECRET_KEY = os.getenv('SECRET_KEY', 'your_default_secret_key')
+# Signs the access tokens, and auth.py verifies them with it. There is no
+# default: with a key published in the source, anyone could sign a token for
+# any user. The app refuses to start without one (see require_secret_key).
+SECRET_KEY = os.getenv('SECRET_KEY')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing context using bcrypt
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor. Hashes made with a different cost are flagged by
+# pwd_context.needs_update and re-hashed on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hashing runs on a dedicated pool so it never blocks the event loop. Requests
+# beyond PASSWORD_HASH_MAX_PENDING queued or running operations get a 429.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 16)))
+
+def require_secret_key():
+    """Raise at startup, rather than on the first login, when SECRET_KEY is unset."""
+    if not SECRET_KEY:
+        raise RuntimeError("SECRET_KEY is not set. Set it to a long random string; it signs the access tokens.")
+
+@lru_cache(maxsize=None)
+def pwd_context():
+    """Password hashing context using bcrypt."""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt is CPU-bound, so it runs on this bounded pool rather than the event
+# loop. It releases the GIL while hashing, so the threads run in parallel.
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending_lock = threading.Lock()
+_pending = 0
 
 
 
 def hash_password(password: str) -> str:
     """Hashes a password using bcrypt."""
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 
     
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context().verify(plain_password, hashed_password)
+
+
+async def _run_on_hash_pool(fn, *args):
+    """Run a hashing call on the bounded pool, or reject it with 429 when the pool is saturated."""
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many password operations in progress. Please retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, partial(fn, *args))
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password on the password hashing pool."""
+    return await _run_on_hash_pool(hash_password, password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password on the password hashing pool.
+
+    Returns ``(valid, new_hash)``, where ``new_hash`` is set when the stored hash
+    was made with outdated settings (e.g. a different BCRYPT_ROUNDS) and should
+    replace it.
+    """
+    return await _run_on_hash_pool(pwd_context().verify_and_update, plain_password, hashed_password)
 
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     """Creates a JWT access token with an expiration time."""
+    from jose import jwt
+
+    require_secret_key()
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
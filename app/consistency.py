@@ -0,0 +1,59 @@
+"""Read-your-writes tokens for replica routing.
+
+Every successful write response carries ``X-Consistency-Token``, the time of
+the write. A client that sends the token back on its following requests has
+them read from the primary for REPLICA_MAX_LAG_SECONDS after that write, so it
+sees its own changes even while the replicas catch up. Requests without a
+fresh token may be served from a replica.
+
+The token only moves reads to the primary, so a forged one costs nothing but
+primary capacity; tokens dated in the future are ignored.
+"""
+import os
+import time
+from typing import Optional
+
+CONSISTENCY_TOKEN_HEADER = "X-Consistency-Token"
+# How far behind the primary a replica may fall; also caps how long responses
+# read from a replica stay in the response cache
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+def issue_token() -> str:
+    return str(time.time_ns() // 1_000_000)
+
+
+def requires_primary(token: Optional[str]) -> bool:
+    """True while a token from a recent write is within the replica lag window."""
+    if not token:
+        return False
+    try:
+        written_at = int(token) / 1000
+    except ValueError:
+        return False
+    return 0 <= time.time() - written_at < REPLICA_MAX_LAG_SECONDS
+
+
+class ConsistencyTokenMiddleware:
+    """Pure ASGI middleware adding a fresh token to every successful write response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_token(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                message = {
+                    **message,
+                    "headers": [*message.get("headers", ()),
+                                (CONSISTENCY_TOKEN_HEADER.lower().encode(), issue_token().encode())],
+                }
+            await send(message)
+
+        await self.app(scope, receive, send_with_token)
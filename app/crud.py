@@ -1,23 +1,36 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
-from app import schemas, models  # Ensure these imports are correct
+from app import archive, response_cache, schemas, models, sharding
 from app.models import Expense, ExpenseDetail
-from app.config.security import hash_password, verify_password  
-from sqlalchemy.exc import IntegrityError
+from app.config.security import hash_password_async
+from app.money import to_money
+from app.services import idempotency_service, ledger_service, rollup_service, split_engine
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+import base64
+import heapq
+import json
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.sql import Select
 
 from app.schemas import ExpenseCreate, ExpenseMethod
 
-async def create_user(db: Session, user: schemas.UserCreate):
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
     # Check if the email already exists
-    existing_user = db.query(models.User).filter(models.User.email == user.email).first()
+    existing_user = await get_user_by_email_async(db, user.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered."
         )
     
-    hashed_password = hash_password(user.password) 
+    hashed_password = await hash_password_async(user.password)
     db_user = models.User(
         email=user.email,
         name=user.name,
@@ -28,11 +41,12 @@ async def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     
     try:
-        db.commit() 
-        db.refresh(db_user)  
+        await db.commit() 
+        await db.refresh(db_user)  
+        response_cache.invalidate([response_cache.GLOBAL])
         return db_user  
     except IntegrityError as e:
-        db.rollback()  
+        await db.rollback()  
         if 'UNIQUE constraint failed' in str(e):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -51,74 +65,77 @@ def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()  # Fetch by email
 
 
-def add_expense(db: Session, expense: ExpenseCreate):
+async def get_user_async(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+
+def compute_expense_details(expense: ExpenseCreate) -> List[dict]:
+    """Split an expense between its participants, raising ValueError on invalid input."""
+    return split_engine.split_expense(expense)
+
+
+def add_expense(db: Session, expense: ExpenseCreate, idempotency_key: Optional[str] = None) -> schemas.Expense:
+    """Create an expense with its details, ledger and rollup updates in one transaction.
+
+    With ``idempotency_key``, a repeated request returns the stored response
+    instead of creating the expense again. With sharding, everything is written
+    through a session on the payer's shard.
+    """
+    with sharding.routed(db, expense.user_id, write=True) as shard_db:
+        return _add_expense(shard_db, expense, idempotency_key)
+
+
+def _add_expense(db: Session, expense: ExpenseCreate, idempotency_key: Optional[str]) -> schemas.Expense:
     if expense.method not in ExpenseMethod:
         raise ValueError("Invalid expense splitting method")
 
+    fingerprint = None
+    if idempotency_key is not None:
+        fingerprint = idempotency_service.request_hash(expense)
+        original = idempotency_service.replay(db, idempotency_key, fingerprint)
+        if original is not None:
+            return original
+
+    # Split and validate before anything is written
+    details = compute_expense_details(expense)
+
     db_expense = Expense(
         user_id=expense.user_id,
-        amount=expense.amount,
+        amount=to_money(expense.amount),
         method=expense.method.value,
         description=expense.description
     )
+    sharding.assign_ids([db_expense])
 
     db.add(db_expense)
 
     try:
-        db.commit() 
-        db.refresh(db_expense)  # Refresh to get the generated ID
-
-        if expense.method == ExpenseMethod.equal:
-            # Split equally among all participants
-            num_participants = len(expense.details)
-            if num_participants == 0:
-                raise ValueError("At least one participant is required for equal splitting.")
-
-            split_amount = expense.amount / num_participants
-
-            for detail in expense.details:
-                db_detail = ExpenseDetail(
-                    expense_id=db_expense.id,
-                    user_id=detail.user_id,
-                    amount_owed=split_amount,
-                    percentage=(100 / num_participants)  # Each participant owes equal percentage
-                )
-                db.add(db_detail)
-
-        elif expense.method == ExpenseMethod.exact:
-            # Exact amounts specified for each participant
-            for detail in expense.details:
-                if detail.amount_owed is None:
-                    raise ValueError(f"Amount owed must be specified for user {detail.user_id}")
-
-                db_detail = ExpenseDetail(
-                    expense_id=db_expense.id,
-                    user_id=detail.user_id,
-                    amount_owed=detail.amount_owed,
-                    percentage=(detail.amount_owed / expense.amount) * 100  # Calculate the percentage
-                )
-                db.add(db_detail)
-
-        elif expense.method == ExpenseMethod.percentage:
-            total_percentage = sum(detail.percentage for detail in expense.details)
-            if total_percentage != 100:
-                raise ValueError("Percentages must sum up to 100.")
-
-            for detail in expense.details:
-                if detail.percentage is None:
-                    raise ValueError(f"Percentage owed must be specified for user {detail.user_id}")
-
-                amount_owed = (detail.percentage / 100) * expense.amount
-
-                db_detail = ExpenseDetail(
-                    expense_id=db_expense.id,
-                    user_id=detail.user_id,
-                    amount_owed=amount_owed,
-                    percentage=detail.percentage,
-                )
-                db.add(db_detail)
+        db.flush()  # Assigns the id; nothing is committed until the details are in
+        _insert_details(db, [(db_expense, details)])
+
+        # Keep the balance ledger and spend rollups in the same transaction as the details
+        ledger_service.apply_deltas(db, ledger_service.expense_deltas(expense.user_id, expense.amount, details))
+        rollup_service.apply_rollups(db, rollup_service.expense_rollups([(db_expense, details)]))
+
+        # Read back before commit expires the instance, which would cost a SELECT
+        created = schemas.Expense.model_validate(db_expense, from_attributes=True)
+        if idempotency_key is not None:
+            idempotency_service.record(db, idempotency_key, fingerprint, created)
 
         db.commit()  
+    except IntegrityError as e:
+        db.rollback()
+        # A concurrent request with the same key committed first
+        if idempotency_key is not None:
+            original = idempotency_service.replay(db, idempotency_key, fingerprint)
+            if original is not None:
+                return original
+        raise ValueError("An unexpected error occurred while adding expense details.") from e
     except ValueError as e:
         db.rollback()  
         raise e 
@@ -126,7 +143,127 @@ def add_expense(db: Session, expense: ExpenseCreate):
         db.rollback() 
         raise ValueError("An unexpected error occurred while adding expense details.") from e
 
-    return db_expense
+    invalidate_expense_responses([expense.user_id])
+    return created
+
+
+def invalidate_expense_responses(payer_ids):
+    """Stop serving cached balance sheets and expense lists that new expenses by ``payer_ids`` change."""
+    response_cache.invalidate([response_cache.GLOBAL, *map(response_cache.user_scope, payer_ids)])
+
+
+def _insert_details(db: Session, expenses: List[Tuple[Expense, List[dict]]]):
+    rows = [dict(detail, expense_id=db_expense.id) for db_expense, details in expenses for detail in details]
+    if rows:
+        db.execute(insert(ExpenseDetail), rows)
+
+
+def add_expenses_bulk(db: Session, expenses: List[Tuple[int, ExpenseCreate]]) -> Tuple[int, List[Tuple[int, str]]]:
+    """Insert a chunk of expenses in one transaction, or one per shard with sharding.
+
+    ``expenses`` holds ``(index, expense)`` pairs, where ``index`` is the position
+    of the item in the caller's batch. Items that fail validation are reported and
+    skipped; the rest are written together. Returns the number of created
+    expenses and a list of ``(index, error)`` pairs.
+    """
+    if not sharding.distributed():
+        return _add_expenses_bulk(db, expenses)
+
+    errors = []
+    by_shard = defaultdict(list)
+    for index, expense in expenses:
+        try:
+            by_shard[sharding.shard_for(expense.user_id, write=True)].append((index, expense))
+        except sharding.ShardMoving as e:
+            errors.append((index, str(e)))
+
+    created = 0
+    for name, shard_expenses in by_shard.items():
+        with sharding.on_shard(db, name) as shard_db:
+            shard_created, shard_errors = _add_expenses_bulk(shard_db, shard_expenses)
+        created += shard_created
+        errors.extend(shard_errors)
+    errors.sort()
+    return created, errors
+
+
+def _add_expenses_bulk(db: Session, expenses: List[Tuple[int, ExpenseCreate]]) -> Tuple[int, List[Tuple[int, str]]]:
+    errors = []
+    valid = []
+    weighted = []
+
+    for index, expense in expenses:
+        try:
+            weighted.append(split_engine.expense_weights(expense))
+        except (ValueError, ArithmeticError) as e:
+            errors.append((index, str(e)))
+            continue
+        valid.append((index, expense))
+
+    # The whole chunk is split in one pass over flat integer-cent arrays
+    chunk_details = split_engine.split_weighted([expense for _, expense in valid], weighted)
+
+    pending = []
+    for (index, expense), details in zip(valid, chunk_details):
+        pending.append((index, Expense(
+            user_id=expense.user_id,
+            amount=to_money(expense.amount),
+            method=expense.method.value,
+            description=expense.description,
+        ), details, ledger_service.expense_deltas(expense.user_id, expense.amount, details)))
+
+    if not pending:
+        return 0, errors
+    sharding.assign_ids([db_expense for _, db_expense, _, _ in pending])
+
+    try:
+        # Flushing the parents assigns their ids; the details need no ids back,
+        # so they go out as a single executemany INSERT.
+        db.add_all(db_expense for _, db_expense, _, _ in pending)
+        db.flush()
+        _insert_details(db, [(db_expense, details) for _, db_expense, details, _ in pending])
+
+        chunk_deltas = {}
+        for _, _, _, deltas in pending:
+            ledger_service.merge_deltas(chunk_deltas, deltas)
+        ledger_service.apply_deltas(db, chunk_deltas)
+        rollup_service.apply_rollups(db, rollup_service.expense_rollups(
+            (db_expense, details) for _, db_expense, details, _ in pending
+        ))
+        db.commit()
+        invalidate_expense_responses(db_expense.user_id for _, db_expense, _, _ in pending)
+        return len(pending), errors
+    except Exception:
+        db.rollback()
+
+    # The chunk failed as a whole, so retry each item in its own savepoint
+    # to find the rows responsible and keep the rest.
+    created = 0
+    for index, failed, details, deltas in pending:
+        # A fresh row: the failed flush left autoincrement ids on the chunk's
+        # objects. Ids reserved by the shard allocator were not and are kept.
+        db_expense = Expense(
+            id=failed.id if sharding.distributed() else None,
+            user_id=failed.user_id,
+            amount=failed.amount,
+            method=failed.method,
+            description=failed.description,
+        )
+        try:
+            with db.begin_nested():
+                db.add(db_expense)
+                db.flush()
+                _insert_details(db, [(db_expense, details)])
+                ledger_service.apply_deltas(db, deltas)
+                rollup_service.apply_rollups(db, rollup_service.expense_rollups([(db_expense, details)]))
+            created += 1
+        except Exception as e:
+            errors.append((index, f"Failed to insert expense: {e.__class__.__name__}"))
+    db.commit()
+    invalidate_expense_responses(db_expense.user_id for _, db_expense, _, _ in pending)
+
+    errors.sort()
+    return created, errors
 
 
 def get_all_users(db: Session):
@@ -134,8 +271,209 @@ def get_all_users(db: Session):
 
 
 def get_user_expenses(db: Session, user_id: int):
-    return db.query(models.Expense).filter(models.Expense.user_id == user_id).all()
+    archived = archive.current()
+    with sharding.routed(db, user_id) as shard_db:
+        hot = shard_db.query(models.Expense).filter(models.Expense.user_id == user_id, *archived.hot()).all()
+    return [*hot, *archived.expenses(user_id=user_id)]
 
 
 def get_all_expenses(db: Session):
-    return db.query(models.Expense).all()
+    archived = archive.current()
+    shards = sharding.fan_out(
+        db, lambda shard_db: shard_db.query(models.Expense).filter(*sharding.visible(shard_db), *archived.hot()).all()
+    )
+    return [expense for expenses in shards for expense in expenses] + list(archived.expenses())
+
+
+def encode_cursor(expense: Expense) -> str:
+    """Opaque keyset cursor pointing just past ``expense`` in (date, id) order."""
+    key = json.dumps([expense.date.isoformat(), expense.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date, expense_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(date), int(expense_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def filter_expenses(
+    stmt: Select, query: schemas.ExpenseQuery, user_id: Optional[int] = None, archived: Optional[archive.Archive] = None
+) -> Select:
+    """Apply the listing filters and the keyset position to a select over ``expenses``, newest first.
+
+    Months already in ``archived``, by default the current archive, are left out.
+    """
+    stmt = stmt.where(*(archived or archive.current()).hot())
+    if user_id is not None:
+        stmt = stmt.where(Expense.user_id == user_id)
+    if query.date_from is not None:
+        stmt = stmt.where(Expense.date >= query.date_from)
+    if query.date_to is not None:
+        stmt = stmt.where(Expense.date < query.date_to)
+    if query.method is not None:
+        stmt = stmt.where(Expense.method == query.method.value)
+    if query.min_amount is not None:
+        stmt = stmt.where(Expense.amount >= query.min_amount)
+    if query.max_amount is not None:
+        stmt = stmt.where(Expense.amount <= query.max_amount)
+
+    if query.cursor:
+        date, expense_id = decode_cursor(query.cursor)
+        stmt = stmt.where(or_(
+            Expense.date < date,
+            and_(Expense.date == date, Expense.id < expense_id),
+        ))
+
+    return stmt.order_by(Expense.date.desc(), Expense.id.desc())
+
+
+def expenses_query(
+    query: schemas.ExpenseQuery, user_id: Optional[int] = None, archived: Optional[archive.Archive] = None
+) -> Select:
+    """Build the keyset-paginated listing, newest first.
+
+    Fetches one row more than ``query.limit`` so the caller can tell whether
+    there is a next page. With a cursor, the index on (user_id, date, id) lets
+    the database seek straight to the page, so deep pages cost the same as the
+    first one.
+    """
+    return filter_expenses(select(Expense), query, user_id=user_id, archived=archived).limit(query.limit + 1)
+
+
+def expense_rows_query(
+    query: schemas.ExpenseQuery, user_id: Optional[int] = None, archived: Optional[archive.Archive] = None
+) -> Select:
+    """Every matching expense from the cursor on, as plain column rows and without a page limit."""
+    # The date is the sort key that merges the streams of several shards
+    stmt = select(Expense.id, Expense.user_id, Expense.amount, Expense.method, Expense.description, Expense.date)
+    return filter_expenses(stmt, query, user_id=user_id, archived=archived)
+
+
+def archived_expense_rows(archived: archive.Archive, query: schemas.ExpenseQuery, user_id: Optional[int] = None):
+    """The rows of ``expense_rows_query`` that are in ``archived``; they all come after the hot rows."""
+    before = decode_cursor(query.cursor) if query.cursor else None
+    return archived.rows(query, user_id=user_id, before=before)
+
+
+def _attach_users(db: Session, expenses: List[archive.ArchivedExpense]) -> List[archive.ArchivedExpense]:
+    user_ids = {expense.user_id for expense in expenses}
+    user_ids.update(detail.user_id for expense in expenses for detail in expense.details)
+    users = {user.id: user for user in db.execute(select(models.User).where(models.User.id.in_(user_ids))).scalars()}
+    return [
+        expense._replace(
+            owner=users.get(expense.user_id),
+            details=tuple(detail._replace(user=users.get(detail.user_id)) for detail in expense.details),
+        )
+        for expense in expenses
+    ]
+
+
+def _continue_in_archive(db: Optional[Session], rows: list, query: schemas.ExpenseQuery, user_id: Optional[int],
+                         archived: archive.Archive, details: bool = False) -> list:
+    """Fill up a page the hot rows left short with archived expenses, which are all older."""
+    missing = query.limit + 1 - len(rows)
+    if missing <= 0 or not archived.segments:
+        return rows
+    if rows:
+        before = (rows[-1].date, rows[-1].id)
+    else:
+        before = decode_cursor(query.cursor) if query.cursor else None
+    cold = list(islice(archived.expenses(query, user_id=user_id, before=before, details=details), missing))
+    if details and cold:
+        cold = _attach_users(db, cold)
+    return [*rows, *cold]
+
+
+def paginate(rows: List[Expense], limit: int) -> Tuple[List[Expense], Optional[str]]:
+    """Split the ``limit + 1`` rows of a page into the page and the next cursor."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def _fetch_page(db: Session, stmt: Select, query: schemas.ExpenseQuery, user_id: Optional[int],
+                archived: archive.Archive, details: bool = False) -> Tuple[List[Expense], Optional[str]]:
+    """Run a page query built by ``expenses_query`` and paginate it.
+
+    With sharding, one user's page is read from their shard alone. A page over
+    every user is read from all shards in parallel, each returning its own
+    first ``limit + 1`` rows, and the newest of those make the page. A page
+    that reaches past the hot rows continues in the archive.
+    """
+    if user_id is not None or not sharding.distributed():
+        with sharding.routed(db, user_id) as shard_db:
+            rows = shard_db.execute(stmt).unique().scalars().all()
+    else:
+        pages = sharding.fan_out(
+            db, lambda shard_db: shard_db.execute(stmt.where(*sharding.visible(shard_db))).unique().scalars().all()
+        )
+        rows = list(islice(heapq.merge(*pages, key=lambda expense: (expense.date, expense.id), reverse=True),
+                           query.limit + 1))
+    return paginate(_continue_in_archive(db, rows, query, user_id, archived, details=details), query.limit)
+
+
+def list_expenses(db: Session, query: schemas.ExpenseQuery, user_id: Optional[int] = None) -> Tuple[List[Expense], Optional[str]]:
+    archived = archive.current()
+    return _fetch_page(db, expenses_query(query, user_id=user_id, archived=archived), query, user_id, archived)
+
+
+async def list_expenses_async(db: AsyncSession, query: schemas.ExpenseQuery, user_id: Optional[int] = None) -> Tuple[List[Expense], Optional[str]]:
+    if sharding.distributed():
+        # The shards have no async engines; read them from the threadpool
+        return await run_in_threadpool(list_expenses, None, query, user_id)
+    archived = archive.current()
+    result = await db.execute(expenses_query(query, user_id=user_id, archived=archived))
+    rows = result.scalars().all()
+    if len(rows) <= query.limit and archived.segments:
+        rows = await run_in_threadpool(_continue_in_archive, None, rows, query, user_id, archived)
+    return paginate(rows, query.limit)
+
+
+def _user_loader():
+    # Shards hold no users table, so there users are loaded by a query of their own
+    return selectinload if sharding.distributed() else joinedload
+
+
+def get_expense_with_details(db: Session, expense_id: int) -> Optional[Expense]:
+    """One expense with its owner and participants, in a single SELECT.
+
+    For one parent row the JOINs multiply only by the number of participants,
+    so joined loading beats a second round trip here. The id does not say which
+    shard holds the expense, so with sharding every shard is asked; an expense
+    in none of them is looked up in the archive.
+    """
+    load_user = _user_loader()
+    stmt = select(Expense).where(Expense.id == expense_id).options(
+        load_user(Expense.owner),
+        joinedload(Expense.details).options(load_user(ExpenseDetail.user)),
+    )
+    found = sharding.fan_out(
+        db, lambda shard_db: shard_db.execute(stmt.where(*sharding.visible(shard_db))).unique().scalar_one_or_none()
+    )
+    expense = next((expense for expense in found if expense is not None), None)
+    if expense is None:
+        archived = archive.current().find(expense_id)
+        if archived is not None:
+            return _attach_users(db, [archived])[0]
+    return expense
+
+
+def list_expenses_with_details(db: Session, query: schemas.ExpenseQuery, user_id: Optional[int] = None) -> Tuple[List[Expense], Optional[str]]:
+    """A page of expenses with owners and participants, in two SELECTs whatever the page size.
+
+    The owner is many-to-one and is joined into the page query. Details, with
+    their users joined in, come from one ``IN`` query, which avoids repeating
+    every expense column once per participant.
+    """
+    load_user = _user_loader()
+    archived = archive.current()
+    stmt = expenses_query(query, user_id=user_id, archived=archived).options(
+        load_user(Expense.owner),
+        selectinload(Expense.details).options(load_user(ExpenseDetail.user)),
+    )
+    return _fetch_page(db, stmt, query, user_id, archived, details=True)
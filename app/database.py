@@ -1,17 +1,175 @@
+"""Engines, session factories and the declarative base.
 
+Nothing connects at import time. ``init_engines`` creates both engines; the
+application calls it from its lifespan handler, once per worker process, and
+``dispose_engines`` closes their pools on shutdown. A process forked after the
+engines exist starts with empty pools. Scripts that never start
+the application get the engines created on first use of ``SessionLocal``,
+``AsyncSessionLocal``, ``engine`` or ``async_engine``.
+
+Reads that tolerate a little lag can go to read replicas listed in
+READ_REPLICA_URLS (comma separated) through ``get_read_db``. Replicas are
+used in turn; one that cannot be reached is skipped for REPLICA_RETRY_SECONDS,
+and reads fall back to the primary when none is available. The replica is
+chosen when the session first needs a connection, so a request answered from
+the response cache never checks one out. A request carrying
+a fresh read-your-writes token (see ``app.consistency``) reads the primary.
+Writes always go to the primary through ``get_db``.
+
+With SHARD_URLS set (``name=url`` pairs, comma separated), one more engine is
+created per shard; ``app.sharding`` decides which of them a query goes to.
+"""
+import itertools
+import logging
 import os
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import Request
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-import pymysql
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+
+from app import consistency, metrics
+from app.db_pool import engine_options, instrument
 
-pymysql.install_as_MySQLdb()
+logger = logging.getLogger(__name__)
 
 # Get the database URL from the environment variable
 SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async drivers used in place of the synchronous ones for the async engine
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+READ_REPLICA_URLS = [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+SHARD_URLS = dict(
+    (name.strip(), url.strip())
+    for name, _, url in (pair.partition("=") for pair in os.getenv("SHARD_URLS", "").split(",") if pair.strip())
+)
+
+_engines: Optional[Tuple[Engine, AsyncEngine]] = None
+_replicas: List[Engine] = []
+_shards: Dict[str, Engine] = {}
+_replica_down_until: Dict[int, float] = {}
+_replica_turn = itertools.count()
+_replica_lock = threading.Lock()
+
+read_sessions = metrics.counter(
+    "db_read_sessions_total", "Read sessions by the database they read: replica, primary or fallback.", ("target",)
+)
+
+
+def async_database_url(url: str) -> str:
+    """Derive the async engine URL from the synchronous one, e.g. mysql+pymysql -> mysql+aiomysql."""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(hide_password=False)
+
+
+def init_engines() -> Tuple[Engine, AsyncEngine]:
+    """Create the sync and async engines and bind the session factories to them. Idempotent."""
+    global _engines, _replicas, _shards, engine, async_engine
+    if _engines is not None:
+        return _engines
+
+    url = SQLALCHEMY_DATABASE_URL
+    if not url:
+        raise RuntimeError("SQLALCHEMY_DATABASE_URL is not set.")
+    if make_url(url).drivername == "mysql":
+        # Plain mysql:// URLs use the MySQLdb API, which PyMySQL provides
+        import pymysql
+        pymysql.install_as_MySQLdb()
+
+    # ASYNC_DATABASE_URL overrides the derived URL, e.g. to pick a different async driver
+    async_url = os.getenv("ASYNC_DATABASE_URL") or async_database_url(url)
+
+    from app.middleware import instrument_sql
+
+    engine = instrument(create_engine(url, **engine_options(url)), "sync")
+    async_engine = create_async_engine(async_url, **engine_options(async_url, asynchronous=True))
+    instrument(async_engine.sync_engine, "async")
+    instrument_sql(engine)
+    instrument_sql(async_engine.sync_engine)
+    _replicas = [
+        instrument(create_engine(replica_url, **engine_options(replica_url)), f"replica{index}")
+        for index, replica_url in enumerate(READ_REPLICA_URLS)
+    ]
+    _shards = {
+        name: instrument(create_engine(shard_url, **engine_options(shard_url)), f"shard_{name}")
+        for name, shard_url in SHARD_URLS.items()
+    }
+    for extra_engine in (*_replicas, *_shards.values()):
+        instrument_sql(extra_engine)
+    _replica_down_until.clear()
+
+    SessionLocal.configure(bind=engine)
+    AsyncSessionLocal.configure(bind=async_engine)
+    _engines = engine, async_engine
+    return _engines
+
+
+async def dispose_engines():
+    """Close every pooled connection, e.g. on shutdown. The next use creates the engines again."""
+    global _engines, _replicas, _shards
+    if _engines is None:
+        return
+    sync_engine, asynchronous_engine = _engines
+    extra_engines = [*_replicas, *_shards.values()]
+    _engines, _replicas, _shards = None, [], {}
+    del globals()["engine"], globals()["async_engine"]
+    await asynchronous_engine.dispose()
+    sync_engine.dispose()
+    for extra_engine in extra_engines:
+        extra_engine.dispose()
+
+
+def _reset_pools_after_fork():
+    # A forked child (e.g. a pre-loading process manager) must not reuse the
+    # parent's sockets; drop the inherited pools without closing them
+    if _engines is not None:
+        sync_engine, asynchronous_engine = _engines
+        sync_engine.dispose(close=False)
+        asynchronous_engine.sync_engine.dispose(close=False)
+        for extra_engine in (*_replicas, *_shards.values()):
+            extra_engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+def __getattr__(name):
+    # ``engine`` and ``async_engine`` are created on first access
+    if name in ("engine", "async_engine"):
+        init_engines()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class _LazySessionmaker(sessionmaker):
+    def __call__(self, **local_kw):
+        if _engines is None:
+            init_engines()
+        return super().__call__(**local_kw)
+
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    def __call__(self, **local_kw):
+        if _engines is None:
+            init_engines()
+        return super().__call__(**local_kw)
+
+
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = _LazyAsyncSessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -22,4 +180,76 @@ def get_db():
         db.close()
 
 
+def shard_engines() -> Dict[str, Engine]:
+    """The engine of every shard in SHARD_URLS, by name; empty when sharding is off."""
+    if _engines is None:
+        init_engines()
+    return _shards
+
+
+class ReplicaSession(Session):
+    """A read session bound to a replica on first use; ``info["replica"]`` tells whether it got one."""
+
+    def get_bind(self, mapper=None, **kw):
+        if self.bind is None:
+            self.bind = _choose_replica(self)
+        return self.bind
+
+
+def _choose_replica(db: Session) -> Engine:
+    """The next available replica, or the primary when none can be reached."""
+    start = next(_replica_turn)
+    for offset in range(len(_replicas)):
+        index = (start + offset) % len(_replicas)
+        if _replica_down_until.get(index, 0) > time.monotonic():
+            continue
+        replica = _replicas[index]
+        try:
+            # Connect once here, so an unreachable replica is skipped rather than failing the read
+            with replica.connect():
+                pass
+        except DBAPIError as e:
+            with _replica_lock:
+                _replica_down_until[index] = time.monotonic() + REPLICA_RETRY_SECONDS
+            logger.warning("Read replica %d unavailable, skipping it for %ss: %s", index, REPLICA_RETRY_SECONDS, e)
+            continue
+        db.info["replica"] = True
+        read_sessions.inc(target="replica")
+        return replica
+
+    read_sessions.inc(target="fallback")
+    return engine
 
+
+def read_session(primary: bool = False) -> Session:
+    """A session for reads: the next available replica, or the primary."""
+    if _engines is None:
+        init_engines()
+    if primary or not _replicas:
+        read_sessions.inc(target="primary")
+        return SessionLocal()
+    return ReplicaSession(autoflush=False)
+
+
+def read_session_factory(request: Request) -> Callable[[], Session]:
+    """Opens read sessions for ``request``, e.g. in a streaming response that outlives the handler."""
+    token = request.headers.get(consistency.CONSISTENCY_TOKEN_HEADER)
+    primary = bool(READ_REPLICA_URLS) and consistency.requires_primary(token)
+    # The response cache is skipped too, since it may hold responses from before the write
+    request.state.read_your_writes = primary
+    return partial(read_session, primary=primary)
+
+
+def get_read_db(request: Request):
+    db = read_session_factory(request)()
+    # For the response cache, which learns only after the query whether it read a replica
+    request.state.read_db = db
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
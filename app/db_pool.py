@@ -0,0 +1,96 @@
+"""Connection pool settings from the environment, and pool health metrics.
+
+| Variable           | Default | Description                                               |
+|--------------------|---------|-----------------------------------------------------------|
+| DB_POOL_SIZE       | 5       | Connections kept open per engine                          |
+| DB_MAX_OVERFLOW    | 10      | Extra connections allowed beyond DB_POOL_SIZE under load  |
+| DB_POOL_TIMEOUT    | 30      | Seconds to wait for a connection before giving up         |
+| DB_POOL_RECYCLE    | 1800    | Seconds after which a connection is replaced              |
+| DB_POOL_PRE_PING   | true    | Test connections on checkout and replace dead ones        |
+"""
+import os
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app import metrics
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+checkout_seconds = metrics.histogram(
+    "db_pool_checkout_seconds", "Time spent waiting for a pooled connection.", ("pool",),
+)
+checkout_timeouts = metrics.counter(
+    "db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT.", ("pool",),
+)
+connections_in_use = metrics.gauge("db_pool_connections_in_use", "Connections currently checked out.", ("pool",))
+overflow_connections = metrics.gauge("db_pool_overflow", "Connections open beyond the pool size.", ("pool",))
+pool_size = metrics.gauge("db_pool_size", "Configured number of pooled connections.", ("pool",))
+
+
+class _InstrumentedPoolMixin:
+    """Times every checkout and counts the ones that time out."""
+
+    metrics_label = "default"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            checkout_timeouts.inc(pool=self.metrics_label)
+            raise
+        finally:
+            checkout_seconds.observe(time.perf_counter() - start, pool=self.metrics_label)
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.metrics_label = self.metrics_label
+        register_pool_gauges(new_pool, self.metrics_label)
+        return new_pool
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def register_pool_gauges(pool, label: str):
+    connections_in_use.set_function(pool.checkedout, pool=label)
+    overflow_connections.set_function(lambda: max(0, pool.overflow()), pool=label)
+    pool_size.set_function(pool.size, pool=label)
+
+
+def engine_options(url: str, asynchronous: bool = False) -> dict:
+    """Keyword arguments for create_engine/create_async_engine built from the DB_POOL_* variables.
+
+    SQLite keeps SQLAlchemy's default pool, which takes none of these settings.
+    """
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": InstrumentedAsyncAdaptedQueuePool if asynchronous else InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def instrument(engine, label: str):
+    """Label an engine's pool for the db_pool_* metrics."""
+    pool = engine.pool
+    if isinstance(pool, _InstrumentedPoolMixin):
+        pool.metrics_label = label
+        register_pool_gauges(pool, label)
+    return engine
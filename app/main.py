@@ -1,16 +1,64 @@
-from fastapi import FastAPI
-from app.routers import user, expense , balance_sheet  
-app = FastAPI()
+import logging
+import os
+import sys
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from app import database
+from app.config.security import require_secret_key
+from app.consistency import ConsistencyTokenMiddleware
+from app.middleware import MetricsMiddleware, TimedJSONResponse
+from app.routers import user, expense , balance_sheet, settlement, metrics, analytics, reports
+from app.services import report_service
+from app.sharding import ShardMoving
 
-app.include_router(user.router)
-app.include_router(expense.router)
-app.include_router(balance_sheet.router)
+# LOG_LEVEL=DEBUG shows the per-request authentication diagnostics
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    require_secret_key()
+    # Engines and pools are created per process at startup, not at import
+    database.init_engines()
+    yield
+    # Running reports finish and queued ones are cancelled before the pools close
+    await run_in_threadpool(report_service.shutdown)
+    await database.dispose_engines()
+
+
+async def shard_moving(request: Request, exc: ShardMoving):
+    # A range move freezes writes for a few seconds at most
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "2"})
 
 
-@app.get("/")
 def read_root():
     return {"message": "Expense Management API"}
 
+
+def create_app() -> FastAPI:
+    """Build the application; ``uvicorn --factory app.main:create_app`` calls this in each worker."""
+    app = FastAPI(default_response_class=TimedJSONResponse, lifespan=lifespan)
+    app.add_middleware(ConsistencyTokenMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.add_exception_handler(ShardMoving, shard_moving)
+
+    app.include_router(user.router)
+    app.include_router(expense.router)
+    app.include_router(balance_sheet.router)
+    app.include_router(settlement.router)
+    app.include_router(analytics.router)
+    app.include_router(reports.router)
+    app.include_router(metrics.router)
+    app.get("/")(read_root)
+    return app
+
+
+app = create_app()
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    # Single process on 127.0.0.1:8000 unless --workers is given, unlike
+    # app.serve, which starts one worker per CPU core; see it for the options
+    from app.serve import main
+    sys.exit(main(["--workers", "1", *sys.argv[1:]]))
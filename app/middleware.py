@@ -0,0 +1,144 @@
+"""Per-request instrumentation: latency, SQL statements and response rendering time.
+
+Everything is recorded into ``app.metrics`` and scraped from ``/metrics``. Setting
+PROFILE_SAMPLE_RATE (0-1) profiles that fraction of requests with cProfile and
+logs the hottest functions of any sampled request slower than
+PROFILE_SLOW_REQUEST_MS.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "500"))
+
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+request_seconds = metrics.histogram(
+    "http_request_duration_seconds", "Time to handle a request, including streaming the body.", ("method", "route"),
+)
+requests_total = metrics.counter("http_requests_total", "Requests handled.", ("method", "route", "status"))
+request_sql_statements = metrics.histogram(
+    "http_request_sql_statements", "SQL statements executed per request.", ("route",), buckets=SQL_COUNT_BUCKETS,
+)
+request_sql_seconds = metrics.histogram(
+    "http_request_sql_seconds", "Time spent executing SQL per request.", ("route",),
+)
+request_render_seconds = metrics.histogram(
+    "http_request_render_seconds", "Time spent encoding JSON response bodies per request.", ("route",),
+)
+
+
+class RequestStats:
+    __slots__ = ("sql_statements", "sql_seconds", "render_seconds")
+
+    def __init__(self):
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+
+
+# The stats object is shared by reference, so threadpool workers and the async
+# driver's greenlets, which copy the context, still add to the same request.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    stats = current_request.get()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.sql_seconds += time.perf_counter() - start
+
+
+def instrument_sql(engine):
+    """Count and time every statement ``engine`` executes against the current request."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records how long encoding the body took."""
+
+    def render(self, content) -> bytes:
+        start = time.perf_counter()
+        body = super().render(content)
+        stats = current_request.get()
+        if stats is not None:
+            stats.render_seconds += time.perf_counter() - start
+        return body
+
+
+_profiler_lock = threading.Lock()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so it adds no extra task or body buffering per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        profiler = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE and _profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            request_seconds.observe(elapsed, method=method, route=route)
+            requests_total.inc(method=method, route=route, status=status_code)
+            request_sql_statements.observe(stats.sql_statements, route=route)
+            request_sql_seconds.observe(stats.sql_seconds, route=route)
+            request_render_seconds.observe(stats.render_seconds, route=route)
+
+            if profiler is not None:
+                profiler.disable()
+                _profiler_lock.release()
+                if elapsed * 1000 >= PROFILE_SLOW_REQUEST_MS:
+                    _log_profile(profiler, method, scope["path"], elapsed)
+
+
+def _log_profile(profiler: cProfile.Profile, method: str, path: str, elapsed: float):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(25)
+    logger.warning("slow request method=%s path=%s duration_ms=%.1f\n%s", method, path, elapsed * 1000, output.getvalue())
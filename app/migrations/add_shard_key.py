@@ -0,0 +1,58 @@
+"""Add ``expenses.shard_key`` and fill it in for the existing rows.
+
+    python -m app.migrations.add_shard_key
+
+Existing rows get the key of their payer, one UPDATE per payer, then the
+column is indexed. The application maps the column only when SHARD_URLS is
+set, so run this before turning sharding on. It can run while the application
+is up, but rows inserted before the restart with SHARD_URLS keep the column's
+placeholder 0; run it once more after the restart. Safe to repeat.
+"""
+import argparse
+import sys
+
+from sqlalchemy import inspect, text
+
+from app.sharding import shard_key
+
+INDEX_NAME = "ix_expenses_shard_key"
+
+
+def migrate(engine) -> int:
+    """Add and backfill the column; returns the number of payers whose rows were updated."""
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        if "shard_key" not in {column["name"] for column in inspector.get_columns("expenses")}:
+            conn.execute(text("ALTER TABLE expenses ADD COLUMN shard_key BIGINT NOT NULL DEFAULT 0"))
+
+    with engine.connect() as conn:
+        user_ids = conn.execute(text(
+            "SELECT DISTINCT user_id FROM expenses WHERE user_id IS NOT NULL AND shard_key = 0"
+        )).scalars().all()
+
+    for user_id in user_ids:
+        # One short transaction per payer, so the table is never locked for long
+        with engine.begin() as conn:
+            conn.execute(
+                text("UPDATE expenses SET shard_key = :key WHERE user_id = :user_id AND shard_key = 0"),
+                {"key": shard_key(user_id), "user_id": user_id},
+            )
+
+    with engine.begin() as conn:
+        if INDEX_NAME not in {index["name"] for index in inspect(conn).get_indexes("expenses")}:
+            conn.execute(text(f"CREATE INDEX {INDEX_NAME} ON expenses (shard_key)"))
+    return len(user_ids)
+
+
+def main(argv=None):
+    from app.database import engine
+
+    parser = argparse.ArgumentParser(description="Add and backfill expenses.shard_key.")
+    parser.parse_args(argv)
+
+    print(f"Set the shard key of {migrate(engine)} payers' expenses.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Convert the amount columns between DECIMAL(…, 2) and BIGINT cents.
+
+    python -m app.migrations.amounts_to_cents            # DECIMAL -> cents
+    python -m app.migrations.amounts_to_cents --reverse  # cents -> DECIMAL
+
+Run it with the application stopped, then start it with ``AMOUNT_STORAGE``
+matching the new layout. Each column is copied into ``<column>_migrating``,
+dropped and replaced by the copy, so the migration works on MySQL and on
+SQLite 3.35+.
+
+MySQL commits every ALTER TABLE on its own, so a run that stops part way can
+leave a column half converted. Running the migration again picks up from
+there: a ``_migrating`` copy next to the original is discarded and made
+again, and one left without its original is renamed into place. SQLite
+cannot add a NOT NULL column to an existing table without a default, so
+there the converted columns are nullable; on MySQL they stay NOT NULL.
+"""
+import argparse
+import sys
+
+from sqlalchemy import inspect, text
+
+# (table, column, DECIMAL precision, nullable)
+AMOUNT_COLUMNS = [
+    ("expenses", "amount", 10, False),
+    ("expense_details", "amount_owed", 10, True),
+    ("user_balances", "total_paid", 12, False),
+    ("user_balances", "total_owed", 12, False),
+    ("user_balances", "net", 12, False),
+    ("spend_daily_user", "paid", 14, False),
+    ("spend_daily_user", "owed", 14, False),
+    ("spend_daily_method", "amount", 14, False),
+]
+
+
+def _columns(engine, table: str) -> dict:
+    with engine.connect() as conn:
+        return {info["name"]: info for info in inspect(conn).get_columns(table)}
+
+
+def _is_integer(info: dict) -> bool:
+    return info["type"].python_type is int
+
+
+def _execute(engine, statement: str):
+    # One transaction per statement: MySQL commits each ALTER TABLE anyway
+    with engine.begin() as conn:
+        conn.execute(text(statement))
+
+
+def convert_column(engine, table: str, column: str, precision: int, nullable: bool, reverse: bool) -> bool:
+    """Bring one column to the target layout, finishing an interrupted run first.
+
+    Returns whether the column was changed.
+    """
+    new_column = f"{column}_migrating"
+    columns = _columns(engine, table)
+    if column not in columns and new_column not in columns:
+        raise LookupError(f"{table}.{column} does not exist.")
+
+    if column in columns:
+        if new_column in columns:
+            # The original was not dropped yet, so it still holds every value
+            _execute(engine, f"ALTER TABLE {table} DROP COLUMN {new_column}")
+        if _is_integer(columns[column]) != reverse:
+            return False
+
+        mysql = engine.dialect.name == "mysql"
+        if reverse:
+            new_type = f"DECIMAL({precision}, 2)"
+            # SQLite has no DECIMAL arithmetic and would divide the integers
+            expression = f"CAST({column} AS DECIMAL({precision + 2}, 2)) / 100" if mysql else f"{column} / 100.0"
+        else:
+            new_type, expression = "BIGINT", f"ROUND({column} * 100)"
+        _execute(engine, f"ALTER TABLE {table} ADD COLUMN {new_column} {new_type}")
+        _execute(engine, f"UPDATE {table} SET {new_column} = {expression}")
+        _execute(engine, f"ALTER TABLE {table} DROP COLUMN {column}")
+        columns = _columns(engine, table)
+
+    if engine.dialect.name == "mysql":
+        # CHANGE renames the copy and restores NOT NULL in one statement
+        new_type = "BIGINT" if _is_integer(columns[new_column]) else f"DECIMAL({precision}, 2)"
+        null = "NULL" if nullable else "NOT NULL"
+        _execute(engine, f"ALTER TABLE {table} CHANGE COLUMN {new_column} {column} {new_type} {null}")
+    else:
+        _execute(engine, f"ALTER TABLE {table} RENAME COLUMN {new_column} TO {column}")
+
+    # A copy left by a run in the other direction is in place now; convert it too
+    if _is_integer(_columns(engine, table)[column]) == reverse:
+        convert_column(engine, table, column, precision, nullable, reverse)
+    return True
+
+
+def migrate(engine, reverse: bool = False) -> int:
+    """Convert every amount column not already in the target layout; return how many were converted."""
+    converted = 0
+    for table, column, precision, nullable in AMOUNT_COLUMNS:
+        if not inspect(engine).has_table(table):
+            continue
+        if convert_column(engine, table, column, precision, nullable, reverse):
+            converted += 1
+    return converted
+
+
+def main(argv=None):
+    from app.database import engine
+
+    parser = argparse.ArgumentParser(description="Convert amount columns between DECIMAL and integer cents.")
+    parser.add_argument("--reverse", action="store_true", help="convert cents back to DECIMAL")
+    args = parser.parse_args(argv)
+
+    converted = migrate(engine, reverse=args.reverse)
+    target = "DECIMAL" if args.reverse else "cents"
+    print(f"Converted {converted} columns to {target}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Partition ``expenses`` by month on MySQL.
+
+    python -m app.migrations.partition_expenses plan              # print the DDL only
+    python -m app.migrations.partition_expenses apply --ahead 3
+    python -m app.migrations.partition_expenses extend --ahead 3  # monthly, e.g. from cron
+
+``expenses`` becomes ``PARTITION BY RANGE COLUMNS(date)`` with one partition
+per month, ``p<YYYYMM>``, plus ``pmax`` for anything later. Queries on a date
+range, such as the hot-window filter of ``app.archive``, then only open the
+partitions they need, and ``python -m app.archive run`` drops an archived
+month's partition instead of deleting its rows. ``extend`` splits new months
+off ``pmax`` ahead of time, so that inserts never land in it.
+
+MySQL puts two conditions on a partitioned table, which ``apply`` meets:
+
+- the partitioning column must be part of every unique key, so the primary
+  key becomes ``(id, date)`` and ``date`` becomes NOT NULL (missing dates are
+  set to 1970-01-01);
+- InnoDB partitioned tables take no part in foreign keys, so the ones from
+  ``expense_details``, ``idempotency_keys`` and ``expenses`` itself are
+  dropped; the application keeps the rows consistent.
+
+With SHARD_URLS set the migration runs on every shard. SQLite has no
+partitioning; there the archive alone keeps ``expenses`` small. Run ``apply``
+with the application stopped, since MySQL rebuilds the table.
+"""
+import argparse
+import sys
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import inspect, text
+
+PARTITIONED_TABLE = "expenses"
+TABLES_REFERENCING = ("expenses", "expense_details", "idempotency_keys")
+
+
+def partition_name(month: datetime) -> str:
+    return f"p{month:%Y%m}"
+
+
+def _months(first: datetime, last: datetime) -> List[datetime]:
+    from app.archive import add_months
+
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    return months
+
+
+def _partition(month: datetime) -> str:
+    from app.archive import add_months
+
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+
+
+def existing_partitions(conn) -> List[str]:
+    return list(conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": PARTITIONED_TABLE}).scalars())
+
+
+def plan(conn, ahead: int) -> List[str]:
+    """The statements that partition ``expenses``, from its oldest month to ``ahead`` months from now."""
+    from app.archive import add_months, month_start
+
+    if existing_partitions(conn):
+        return []
+    statements = []
+    inspector = inspect(conn)
+    for table in TABLES_REFERENCING:
+        for foreign_key in inspector.get_foreign_keys(table):
+            if table == PARTITIONED_TABLE or foreign_key["referred_table"] == PARTITIONED_TABLE:
+                statements.append(f"ALTER TABLE {table} DROP FOREIGN KEY {foreign_key['name']}")
+
+    statements += [
+        "UPDATE expenses SET date = '1970-01-01' WHERE date IS NULL",
+        "ALTER TABLE expenses MODIFY date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP",
+        "ALTER TABLE expenses DROP PRIMARY KEY, ADD PRIMARY KEY (id, date)",
+    ]
+    oldest = conn.execute(text("SELECT MIN(date) FROM expenses")).scalar()
+    this_month = month_start(datetime.utcnow())
+    first = month_start(oldest) if oldest is not None else this_month
+    partitions = [_partition(month) for month in _months(first, add_months(this_month, ahead))]
+    partitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    statements.append(
+        "ALTER TABLE expenses PARTITION BY RANGE COLUMNS(date) (\n    " + ",\n    ".join(partitions) + "\n)"
+    )
+    return statements
+
+
+def extend(conn, ahead: int) -> List[str]:
+    """Statements splitting the months up to ``ahead`` months from now off ``pmax``."""
+    from app.archive import add_months, month_start
+
+    partitions = existing_partitions(conn)
+    if "pmax" not in partitions:
+        return []
+    monthly = sorted(name for name in partitions if name != "pmax")
+    last = datetime.strptime(monthly[-1][1:], "%Y%m") if monthly else add_months(month_start(datetime.utcnow()), -1)
+    new = _months(add_months(last, 1), add_months(month_start(datetime.utcnow()), ahead))
+    if not new:
+        return []
+    return [
+        "ALTER TABLE expenses REORGANIZE PARTITION pmax INTO (\n    "
+        + ",\n    ".join([*map(_partition, new), "PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+        + "\n)"
+    ]
+
+
+def main(argv=None):
+    from app import database
+
+    parser = argparse.ArgumentParser(description="Partition the expenses table by month (MySQL).")
+    parser.add_argument("command", choices=["plan", "apply", "extend"])
+    parser.add_argument("--ahead", type=int, default=3, help="months after the current one to create partitions for")
+    args = parser.parse_args(argv)
+
+    engines = list(database.shard_engines().values()) or [database.engine]
+    if any(engine.dialect.name != "mysql" for engine in engines):
+        parser.error("Partitioning needs MySQL; on SQLite, use python -m app.archive to keep expenses small.")
+
+    for engine in engines:
+        with engine.begin() as conn:
+            statements = extend(conn, args.ahead) if args.command == "extend" else plan(conn, args.ahead)
+            for statement in statements:
+                print(f"{statement};")
+                if args.command != "plan":
+                    conn.execute(text(statement))
+        if not statements:
+            print(f"-- {engine.url.database}: nothing to do")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
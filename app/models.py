@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, DECIMAL, ForeignKey, Float, DateTime
+from sqlalchemy import BigInteger, Column, Date, Integer, String, DECIMAL, ForeignKey, Float, DateTime, Index, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from .database import Base
+from .database import SHARD_URLS, Base
+from .money import Money
 
 class User(Base):
     __tablename__ = "users"
@@ -13,19 +14,34 @@ class User(Base):
     hashed_password = Column(String)
     expenses = relationship("Expense", back_populates="owner")
 
+def _expense_shard_key(context):
+    from app.sharding import shard_key
+    return shard_key(context.get_current_parameters().get("user_id"))
+
+
 class Expense(Base):
     __tablename__ = 'expenses'
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'), index=True)
-    amount = Column(DECIMAL(10, 2), nullable=False)
+    amount = Column(Money(10), nullable=False)
     method = Column(String, nullable=False)
     description = Column(String, nullable=False)
     date = Column(DateTime, default=datetime.utcnow)
+    if SHARD_URLS:
+        # Position of the payer on the shard ring; see app.sharding. Only mapped
+        # with sharding on; app.migrations.add_shard_key adds it to a database.
+        shard_key = Column(BigInteger, nullable=False, default=_expense_shard_key, index=True)
 
     owner = relationship("User", back_populates="expenses")
     details = relationship("ExpenseDetail", back_populates="expense")
 
+    __table_args__ = (
+        # Keyset pagination walks (date, id) within a user, or across all users
+        Index("ix_expenses_user_id_date_id", "user_id", "date", "id"),
+        Index("ix_expenses_date_id", "date", "id"),
+    )
+
 
 
 
@@ -36,8 +52,92 @@ class ExpenseDetail(Base):
     expense_id = Column(Integer, ForeignKey("expenses.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
 
-    amount_owed = Column(DECIMAL(10, 2))
+    amount_owed = Column(Money(10))
     percentage = Column(DECIMAL(5, 2))
 
     expense = relationship("Expense", back_populates="details")
     user = relationship("User")
+
+
+class UserBalance(Base):
+    """Running totals per user, kept in step with expenses by crud on every write."""
+    __tablename__ = "user_balances"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_paid = Column(Money(12), nullable=False, default=0)
+    total_owed = Column(Money(12), nullable=False, default=0)
+    net = Column(Money(12), nullable=False, default=0)
+
+    user = relationship("User")
+
+
+class DailyUserSpend(Base):
+    """Per user and UTC day: amount paid, amount owed and expenses paid. Maintained by crud."""
+    __tablename__ = "spend_daily_user"
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    paid = Column(Money(14), nullable=False, default=0)
+    owed = Column(Money(14), nullable=False, default=0)
+    expense_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Per-user range scans; the primary key serves whole-day scans
+        Index("ix_spend_daily_user_user_id_day", "user_id", "day"),
+    )
+
+
+class DailyMethodSpend(Base):
+    """Per split method and UTC day: total amount and number of expenses. Maintained by crud."""
+    __tablename__ = "spend_daily_method"
+
+    day = Column(Date, primary_key=True)
+    method = Column(String(20), primary_key=True)
+    amount = Column(Money(14), nullable=False, default=0)
+    expense_count = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """The response to an expense created with an ``Idempotency-Key`` header, replayed on retries."""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    expense_id = Column(Integer, ForeignKey("expenses.id"))
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class ReportJob(Base):
+    """A report requested through ``POST /reports``, written to a file by the report workers."""
+    __tablename__ = "report_jobs"
+
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(32), nullable=False)
+    format = Column(String(16), nullable=False)
+    status = Column(String(16), nullable=False, default="queued")
+    size = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    finished_at = Column(DateTime)
+
+
+class ShardMove(Base):
+    """A range of the shard ring moved, or being moved, from one shard to another by ``app.sharding``."""
+    __tablename__ = "shard_moves"
+
+    id = Column(Integer, primary_key=True)
+    start = Column(BigInteger, nullable=False)
+    end = Column(BigInteger, nullable=False)
+    source = Column(String(64), nullable=False)
+    target = Column(String(64), nullable=False)
+    state = Column(String(16), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class IdBlock(Base):
+    """Next free id of a sequence shared by every shard; processes reserve blocks of ids from it."""
+    __tablename__ = "id_blocks"
+
+    name = Column(String(64), primary_key=True)
+    next_id = Column(BigInteger, nullable=False)
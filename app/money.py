@@ -0,0 +1,64 @@
+"""Money values: conversions between Decimal and integer cents, and the column type.
+
+Amounts are ``DECIMAL(…, 2)`` columns by default. With ``AMOUNT_STORAGE=cents``
+they are stored as ``BIGINT`` cents instead, which are smaller and cheaper to
+aggregate. Python code sees ``Decimal`` either way. Convert an existing database
+with ``python -m app.migrations.amounts_to_cents`` before switching modes.
+"""
+import os
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from sqlalchemy import DECIMAL, BigInteger
+from sqlalchemy.types import TypeDecorator
+
+AMOUNT_STORAGE = os.getenv("AMOUNT_STORAGE", "decimal").lower()
+if AMOUNT_STORAGE not in ("decimal", "cents"):
+    raise ValueError("AMOUNT_STORAGE must be 'decimal' or 'cents'.")
+
+CENT = Decimal("0.01")
+
+
+def to_money(value) -> Decimal:
+    """Round a value the way a DECIMAL(…, 2) column stores it.
+
+    Raises ValueError, like the other invalid input, when the value is not a
+    number or has more digits than the decimal context can round.
+    """
+    try:
+        return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f"{value} is not a valid amount.") from None
+
+
+def to_cents(value) -> int:
+    return int(to_money(value).scaleb(2))
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+class Money(TypeDecorator):
+    """A two-decimal amount stored as DECIMAL(precision, 2) or, in cents mode, as BIGINT cents."""
+
+    impl = DECIMAL
+    cache_ok = True
+
+    def __init__(self, precision: int = 10):
+        super().__init__(precision, 2)
+        self.precision = precision
+
+    def load_dialect_impl(self, dialect):
+        if AMOUNT_STORAGE == "cents":
+            return dialect.type_descriptor(BigInteger())
+        return dialect.type_descriptor(DECIMAL(self.precision, 2))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or AMOUNT_STORAGE != "cents":
+            return value
+        return to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or AMOUNT_STORAGE != "cents":
+            return value
+        return from_cents(int(value))
@@ -0,0 +1,53 @@
+"""Newline-delimited JSON encoding for streamed responses.
+
+Uses orjson when it is installed (``pip install orjson``) and the standard
+library otherwise; both produce the same bytes for the plain dicts of str,
+int and None that are streamed.
+"""
+import json
+from typing import Iterable
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Request bodies are read as NDJSON under any of these names
+NDJSON_MEDIA_TYPES = (NDJSON_MEDIA_TYPE, "application/ndjson", "application/jsonl")
+
+
+def _quality(accept: str, media_type: str) -> float:
+    """The q-value ``accept`` gives ``media_type`` itself, or 0 when it is not listed.
+
+    Wildcard ranges are not counted: NDJSON is only sent when asked for by name.
+    """
+    best = 0.0
+    for media_range in accept.split(","):
+        name, *params = (part.strip() for part in media_range.split(";"))
+        if name.lower() != media_type:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        best = max(best, q)
+    return best
+
+
+def wants_ndjson(accept: str) -> bool:
+    """Whether the Accept header asks for NDJSON at least as much as for plain JSON."""
+    ndjson = _quality(accept or "", NDJSON_MEDIA_TYPE)
+    return ndjson > 0 and ndjson >= _quality(accept or "", "application/json")
+
+
+if orjson is not None:
+    def encode_lines(objects: Iterable[dict]) -> bytes:
+        return b"".join([orjson.dumps(obj) + b"\n" for obj in objects])
+else:
+    def encode_lines(objects: Iterable[dict]) -> bytes:
+        return "".join([json.dumps(obj, separators=(",", ":")) + "\n" for obj in objects]).encode()
@@ -0,0 +1,171 @@
+"""Cache of serialized JSON responses, invalidated by per-scope version counters.
+
+A cached response is keyed by its scope, the scope's current version and the
+request path and query string. Writes do not delete entries; they bump the
+version of every scope they affect, so later lookups miss and the old entries
+age out of the LRU. The version is also what the ETag is made of, so a
+matching ``If-None-Match`` is answered with 304 before any query runs.
+
+Scopes in use:
+
+- ``GLOBAL``: the balance sheet. Bumped by every new user or expense.
+- ``user_scope(user_id)``: the expenses paid by one user. Bumped by that
+  user's new expenses.
+
+With read replicas, a response read from a replica is kept for at most
+REPLICA_MAX_LAG_SECONDS, since it may predate the latest write, and requests
+with a fresh read-your-writes token skip the cache.
+
+The default backend keeps everything in process memory. With several worker
+processes every worker has its own versions, so writes in one are not seen by
+the others; set RESPONSE_CACHE_BACKEND to a ``module:attribute`` factory that
+returns a shared backend (same methods as ``MemoryBackend``) in that case.
+``app.serve`` sets RESPONSE_CACHE=off when it starts several workers without
+one: every request is then answered from the database, without an ETag.
+"""
+import hashlib
+import importlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+
+from app import metrics
+from app.consistency import REPLICA_MAX_LAG_SECONDS
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND")
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "on").lower() not in ("off", "0", "false", "no")
+
+GLOBAL = "global"
+
+cache_requests = metrics.counter(
+    "response_cache_requests_total", "Cacheable requests by outcome: hit, not_modified, miss or bypass.", ("result",)
+)
+
+# (body, headers)
+Entry = Tuple[bytes, Dict[str, str]]
+
+
+def user_scope(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+class MemoryBackend:
+    """In-process LRU of entries with a TTL, plus the version counters."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        # Versions restart with the process; the epoch keeps old ETags from matching
+        self._epoch = time.time_ns()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: Entry, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def version(self, scope: str) -> str:
+        with self._lock:
+            return f"{self._epoch}.{self._versions.get(scope, 0)}"
+
+    def bump(self, scope: str):
+        with self._lock:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _load_backend():
+    if not RESPONSE_CACHE_BACKEND:
+        return MemoryBackend(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+    module_name, _, attribute = RESPONSE_CACHE_BACKEND.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+backend = _load_backend()
+if isinstance(backend, MemoryBackend):
+    metrics.gauge("response_cache_size", "Responses currently held in the response cache.", callback=lambda: len(backend))
+
+
+def invalidate(scopes: Iterable[str]):
+    """Bump the version of every scope, so their cached responses are no longer served."""
+    for scope in set(scopes):
+        backend.bump(scope)
+
+
+class CachedResponse:
+    """One cacheable request: look it up first, and store the response on a miss.
+
+    The version is read once, before the response is built, so a write that
+    lands while building only makes the stored entry unreachable.
+    """
+
+    def __init__(self, request: Request, scope: str):
+        self.key = f"{scope}:{backend.version(scope)}:{request.url.path}?{request.url.query}"
+        self.etag = '"%s"' % hashlib.blake2b(self.key.encode(), digest_size=16).hexdigest()
+        self.if_none_match = request.headers.get("if-none-match")
+        # Set by database.get_read_db
+        self.bypass = getattr(request.state, "read_your_writes", False)
+        self.read_db = getattr(request.state, "read_db", None)
+
+    def lookup(self) -> Optional[Response]:
+        if self.bypass or not RESPONSE_CACHE_ENABLED:
+            cache_requests.inc(result="bypass")
+            return None
+        if self.if_none_match and self.etag in (tag.strip() for tag in self.if_none_match.split(",")):
+            cache_requests.inc(result="not_modified")
+            return Response(status_code=304, headers={"ETag": self.etag})
+
+        entry = backend.get(self.key)
+        if entry is None:
+            cache_requests.inc(result="miss")
+            return None
+        cache_requests.inc(result="hit")
+        return self._response(*entry)
+
+    def store(self, body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+        headers = headers or {}
+        if not RESPONSE_CACHE_ENABLED:
+            # No ETag either: this worker's versions say nothing about other workers' writes
+            return Response(content=body, media_type="application/json", headers=headers)
+        if self.read_db is None or not self.read_db.info.get("replica", False):
+            backend.set(self.key, (body, headers))
+        else:
+            # A replica may lag behind the version in the key, so this body gets
+            # its own ETag, which If-None-Match never matches
+            headers = {**headers, "ETag": self.etag[:-1] + '-replica"'}
+            backend.set(self.key, (body, headers), ttl=min(REPLICA_MAX_LAG_SECONDS, RESPONSE_CACHE_TTL))
+        return self._response(body, headers)
+
+    def _response(self, body: bytes, headers: Dict[str, str]) -> Response:
+        return Response(content=body, media_type="application/json", headers={"ETag": self.etag, **headers})
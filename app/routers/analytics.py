@@ -0,0 +1,45 @@
+from datetime import date, datetime, timedelta
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from .. import schemas
+from ..auth.auth import get_current_user
+from ..database import get_read_db
+from ..services.rollup_service import spend
+
+router = APIRouter()
+
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 3660
+
+
+@router.get("/analytics/spend", response_model=List[schemas.SpendBucket], response_model_exclude_none=True)
+def read_spend(
+    group_by: Literal["user", "method"] = "user",
+    interval: Literal["day", "week", "month"] = "day",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    user_id: Optional[int] = None,
+    method: Optional[schemas.ExpenseMethod] = None,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(get_current_user),  # Ensure user is logged in
+):
+    # Served from the daily rollup tables; both ends of the range are included
+    date_to = date_to or datetime.utcnow().date()
+    date_from = date_from or date_to - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to.")
+    if (date_to - date_from).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"The range must not exceed {MAX_RANGE_DAYS} days.")
+
+    return spend(
+        db,
+        group_by=group_by,
+        interval=interval,
+        date_from=date_from,
+        date_to=date_to,
+        user_id=user_id,
+        method=method.value if method else None,
+    )
@@ -1,42 +1,253 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+from datetime import datetime
+from decimal import Decimal
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-from .. import crud, models, schemas
-from ..database import get_db
+from .. import archive, crud, models, response_cache, schemas, sharding
+from ..database import get_async_db, get_db, get_read_db, read_session_factory
+from ..ndjson import NDJSON_MEDIA_TYPE, NDJSON_MEDIA_TYPES, wants_ndjson
+from ..services import idempotency_service
+from ..services.expense_stream import aiter_expenses_ndjson, iter_expenses_ndjson
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.auth.auth import get_current_user
-from typing import List  # Import List from typing
+from typing import AsyncIterator, List, Optional, Tuple  # Import List from typing
 
 router = APIRouter()
 
+BULK_CHUNK_SIZE = 1000  # Expenses validated and written per transaction
+MAX_PAGE_SIZE = 500
+
+
+def expense_query(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    method: Optional[schemas.ExpenseMethod] = None,
+    min_amount: Optional[Decimal] = None,
+    max_amount: Optional[Decimal] = None,
+) -> schemas.ExpenseQuery:
+    return schemas.ExpenseQuery(
+        cursor=cursor,
+        limit=limit,
+        date_from=date_from,
+        date_to=date_to,
+        method=method,
+        min_amount=min_amount,
+        max_amount=max_amount,
+    )
+
+
+expenses_json = TypeAdapter(List[schemas.Expense])
+detailed_expenses_json = TypeAdapter(List[schemas.ExpenseWithDetails])
+
+
+def _expense_page_response(
+    cached: response_cache.CachedResponse, expenses, next_cursor: Optional[str], adapter: TypeAdapter = expenses_json
+) -> Response:
+    """Serialize one page of expenses once, and pass the next cursor back in the X-Next-Cursor header."""
+    body = adapter.dump_json(adapter.validate_python(expenses, from_attributes=True))
+    return cached.store(body, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+
+def _expense_stream_query(query: schemas.ExpenseQuery, user_id: Optional[int] = None):
+    # Built before the response starts, so a bad cursor is still a 400
+    archived = archive.current()
+    try:
+        return (crud.expense_rows_query(query, user_id=user_id, archived=archived),
+                crud.archived_expense_rows(archived, query, user_id=user_id))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _expense_page(db: Session, request: Request, query: schemas.ExpenseQuery, scope: str, user_id: Optional[int] = None):
+    if wants_ndjson(request.headers.get("accept")):
+        # Every expense from the cursor on; limit does not apply
+        stmt, archived_rows = _expense_stream_query(query, user_id=user_id)
+        return StreamingResponse(
+            iter_expenses_ndjson(stmt, read_session_factory(request), user_id=user_id, archived_rows=archived_rows),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+
+    cached = response_cache.CachedResponse(request, scope)
+    response = cached.lookup()
+    if response is not None:
+        return response
+
+    try:
+        expenses, next_cursor = crud.list_expenses(db, query, user_id=user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _expense_page_response(cached, expenses, next_cursor)
+
+
+async def _iter_bulk_items(request: Request) -> AsyncIterator[Tuple[int, object]]:
+    """Yield ``(index, item)`` pairs from a JSON array body or an NDJSON stream.
+
+    Lines that are not valid JSON are yielded as the exception, so they can be
+    reported against their index like any other invalid item.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+
+    if content_type not in NDJSON_MEDIA_TYPES:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON.")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array of expenses.")
+        for index, item in enumerate(items):
+            yield index, item
+        return
+
+    index = 0
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield index, _parse_ndjson_line(line)
+                index += 1
+    if buffer.strip():
+        yield index, _parse_ndjson_line(buffer)
+
+
+def _parse_ndjson_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+def _validate_bulk_item(item) -> schemas.ExpenseCreate:
+    if isinstance(item, Exception):
+        raise ValueError(f"Invalid JSON: {item}")
+    if not isinstance(item, dict):
+        raise ValueError("Each expense must be a JSON object.")
+    return schemas.ExpenseCreate(**item)
+
 @router.post("/expenses/", response_model=schemas.Expense)
-def create_expense(expense: schemas.ExpenseCreate, db: Session = Depends(get_db)):
-    return crud.add_expense(db=db, expense=expense)
+def create_expense(
+    expense: schemas.ExpenseCreate,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    try:
+        return crud.add_expense(db=db, expense=expense, idempotency_key=idempotency_key)
+    except idempotency_service.IdempotencyKeyReused as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/expenses/bulk", response_model=schemas.BulkExpenseResult)
+async def create_expenses_bulk(request: Request, db: Session = Depends(get_db)):
+    created = 0
+    errors: List[schemas.BulkExpenseError] = []
+    chunk: List[Tuple[int, schemas.ExpenseCreate]] = []
+
+    async def flush():
+        nonlocal created
+        chunk_created, chunk_errors = await run_in_threadpool(crud.add_expenses_bulk, db, chunk)
+        created += chunk_created
+        errors.extend(schemas.BulkExpenseError(index=index, detail=detail) for index, detail in chunk_errors)
+        chunk.clear()
+
+    async for index, item in _iter_bulk_items(request):
+        try:
+            chunk.append((index, _validate_bulk_item(item)))
+        except ValueError as e:
+            errors.append(schemas.BulkExpenseError(index=index, detail=str(e)))
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            await flush()
+    if chunk:
+        await flush()
+
+    errors.sort(key=lambda error: error.index)
+    return schemas.BulkExpenseResult(created=created, errors=errors)
+
+@router.get("/expenses/detailed", response_model=List[schemas.ExpenseWithDetails])
+def read_user_expenses_detailed(
+    request: Request,
+    query: schemas.ExpenseQuery = Depends(expense_query),
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    # The current user's expenses with payer and participant breakdown
+    cached = response_cache.CachedResponse(request, response_cache.user_scope(current_user.id))
+    response = cached.lookup()
+    if response is not None:
+        return response
+
+    try:
+        expenses, next_cursor = crud.list_expenses_with_details(db, query, user_id=current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _expense_page_response(cached, expenses, next_cursor, detailed_expenses_json)
+
+@router.get("/expenses/{expense_id}", response_model=schemas.ExpenseWithDetails)
+def read_expense(
+    expense_id: int,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    expense = crud.get_expense_with_details(db, expense_id)
+    # Only the payer and the participants may see an expense; to anyone else it does not exist
+    if expense is None or (
+        expense.user_id != current_user.id and all(detail.user_id != current_user.id for detail in expense.details)
+    ):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Expense not found.")
+    return expense
 
 @router.get("/expenses/user/{user_id}", response_model=List[schemas.Expense])
 def read_expenses_by_user(
     user_id: int, 
-    db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)  # Ensure user is logged in
+    request: Request,
+    query: schemas.ExpenseQuery = Depends(expense_query),
+    db: Session = Depends(get_read_db), 
+    current_user: schemas.User = Depends(get_current_user)  # Ensure user is logged in
 ):
-    # Check if current_user has permission to access user_id's expenses
-    if current_user.id != user_id and not current_user.is_admin:
+    # Users can only list their own expenses
+    if current_user.id != user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have permission to access this user's expenses."
         )
 
     # Fetch and return the expenses for the specified user
-    return crud.get_user_expenses(db=db, user_id=user_id)
+    return _expense_page(db, request, query, response_cache.user_scope(user_id), user_id=user_id)
 
 @router.get("/expenses/", response_model=List[schemas.Expense])
 async def read_user_expenses(
-    db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)  # Ensure user is logged in
+    request: Request,
+    query: schemas.ExpenseQuery = Depends(expense_query),
+    db: AsyncSession = Depends(get_async_db), 
+    current_user: schemas.User = Depends(get_current_user)  # Ensure user is logged in
 ):
-    return crud.get_user_expenses(db=db, user_id=current_user.id)  # Retrieve expenses for the current user
+    if wants_ndjson(request.headers.get("accept")):
+        stmt, archived_rows = _expense_stream_query(query, user_id=current_user.id)
+        if sharding.distributed():
+            stream = iter_expenses_ndjson(
+                stmt, read_session_factory(request), user_id=current_user.id, archived_rows=archived_rows
+            )
+        else:
+            stream = aiter_expenses_ndjson(stmt, archived_rows=archived_rows)
+        return StreamingResponse(stream, media_type=NDJSON_MEDIA_TYPE)
 
-@router.get("/expenses/", response_model=List[schemas.Expense])
-def read_all_expenses(db: Session = Depends(get_db)):
-    return crud.get_all_expenses(db=db)
+    cached = response_cache.CachedResponse(request, response_cache.user_scope(current_user.id))
+    response = cached.lookup()
+    if response is not None:
+        return response
+
+    # Retrieve expenses for the current user
+    try:
+        expenses, next_cursor = await crud.list_expenses_async(db, query, user_id=current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _expense_page_response(cached, expenses, next_cursor)
 
 
 
@@ -0,0 +1,64 @@
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..auth.auth import get_current_user
+from ..database import get_db
+from ..services import report_service
+
+router = APIRouter()
+
+RETRY_AFTER_SECONDS = "2"
+
+
+@router.post("/reports", response_model=schemas.ReportJob, status_code=status.HTTP_202_ACCEPTED)
+def create_report(
+    report: schemas.ReportCreate,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user),  # Ensure user is logged in
+):
+    # Queued for the report processes; poll GET /reports/{id} for the file
+    try:
+        job = report_service.submit(db, report.kind, report.format)
+    except report_service.ReportQueueFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e), headers={"Retry-After": RETRY_AFTER_SECONDS}
+        )
+    response.headers["Location"] = f"/reports/{job.id}"
+    return job
+
+
+@router.get("/reports/{report_id}", response_model=schemas.ReportJob, responses={200: {"content": {
+    "text/csv": {}, "application/gzip": {}}}})
+def read_report(
+    report_id: str,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user),  # Ensure user is logged in
+):
+    """The report file once it is done; until then, the job status with 202."""
+    job = db.get(models.ReportJob, report_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if job.status == report_service.FAILED:
+        raise HTTPException(status_code=500, detail=f"Report failed: {job.error}")
+    if job.status != report_service.DONE:
+        return JSONResponse(
+            jsonable_encoder(schemas.ReportJob.model_validate(job)),
+            status_code=status.HTTP_202_ACCEPTED,
+            headers={"Retry-After": RETRY_AFTER_SECONDS},
+        )
+
+    path = report_service.report_path(job)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="The report file has expired")
+    report_format = schemas.ReportFormat(job.format)
+    return FileResponse(
+        path,
+        media_type=report_service.MEDIA_TYPES[report_format],
+        filename=f"{job.kind}-{job.id}.{job.format}",
+    )
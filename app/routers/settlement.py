@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from typing import List
+from .. import schemas
+from ..auth.auth import get_current_user
+from ..database import get_read_db
+from ..money import from_cents
+from ..services.settlement_service import get_settlements
+
+router = APIRouter()
+
+@router.get("/settlements/", response_model=List[schemas.Settlement])
+def read_settlements(
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(get_current_user),  # Ensure user is logged in
+):
+    # Minimal set of transfers that settles every outstanding balance
+    return [
+        schemas.Settlement(
+            from_user_id=transfer.from_user_id,
+            to_user_id=transfer.to_user_id,
+            amount=from_cents(transfer.amount_cents),
+        )
+        for transfer in get_settlements(db)
+    ]
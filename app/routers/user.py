@@ -1,18 +1,22 @@
+import logging
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List  # Make sure to import List
 from .. import crud, models, schemas
-from ..database import get_db
+from ..database import get_async_db, get_db
 from app.crud import get_user  # Implement this function to fetch user from DB
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from app.config.security import create_access_token, verify_password
+from app.config.security import create_access_token, verify_and_update_password_async
+from app.auth.auth import token_claims
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.post("/users/", response_model=schemas.User)  # Ensure response_model is defined
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     try:
         return await crud.create_user(db=db, user=user)  # Use await here
     except ValueError as e:
@@ -23,15 +27,19 @@ def read_user(user_id: int, db: Session = Depends(get_db)):
     return crud.get_user(db=db, user_id=user_id)
 
 @router.post("/token")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_email(db=db, email=form_data.username)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await crud.get_user_by_email_async(db=db, email=form_data.username)
     if user:
-        print(f"User found: {user.email}")
-        if verify_password(form_data.password, user.hashed_password):
-            access_token = create_access_token(data={"sub": user.email})
+        valid, new_hash = await verify_and_update_password_async(form_data.password, user.hashed_password)
+        if valid:
+            if new_hash:
+                # The stored hash used outdated settings, e.g. a different BCRYPT_ROUNDS
+                user.hashed_password = new_hash
+                await db.commit()
+            access_token = create_access_token(data=token_claims(user))
             return {"access_token": access_token, "token_type": "bearer"}
     
-    print("Invalid credentials")
+    logger.debug("login rejected email=%s", form_data.username)
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Incorrect username or password",
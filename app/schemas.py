@@ -1,7 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 from enum import Enum
 from decimal import Decimal
+from datetime import date, datetime
 
 class UserCreate(BaseModel):
     email: str
@@ -15,18 +16,19 @@ class User(BaseModel):
     name: str
     mobile_number: str
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ExpenseMethod(str, Enum):
     equal = "equal"
     exact = "exact"
     percentage = "percentage"
+    shares = "shares"
 
 class ExpenseDetailCreate(BaseModel):
     user_id: int
     amount_owed: Optional[Decimal] = None  
-    percentage: Optional[float] = None    
+    percentage: Optional[Decimal] = None    
+    shares: Optional[int] = None
 
 class ExpenseCreate(BaseModel):
     user_id: int
@@ -42,8 +44,29 @@ class Expense(BaseModel):
     method: ExpenseMethod
     description: str  
 
-    class Config:
-        orm_mode = True 
+    model_config = ConfigDict(from_attributes=True)
+
+class UserSummary(BaseModel):
+    id: int
+    name: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ExpenseParticipant(BaseModel):
+    user_id: int
+    amount_owed: Decimal
+    percentage: Optional[Decimal] = None
+    user: Optional[UserSummary] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ExpenseWithDetails(Expense):
+    """An expense with its payer and per-participant breakdown."""
+    date: datetime
+    owner: Optional[UserSummary] = None
+    details: List[ExpenseParticipant]
+
+    model_config = ConfigDict(from_attributes=True)
 
 class ExpenseOut(BaseModel):
     id: int
@@ -51,8 +74,7 @@ class ExpenseOut(BaseModel):
     method: ExpenseMethod
     description: str
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class BalanceSheetEntry(BaseModel):
     user_id: int
@@ -60,5 +82,62 @@ class BalanceSheetEntry(BaseModel):
     total_expense: Decimal
     individual_expenses: List[ExpenseOut]
 
-    class Config:
-        from_attributes = True  
+    model_config = ConfigDict(from_attributes=True)
+
+class BulkExpenseError(BaseModel):
+    index: int
+    detail: str
+
+class BulkExpenseResult(BaseModel):
+    created: int
+    errors: List[BulkExpenseError]
+
+class Settlement(BaseModel):
+    from_user_id: int
+    to_user_id: int
+    amount: Decimal
+
+class ExpenseQuery(BaseModel):
+    """Filters and keyset position for an expense listing, newest first."""
+    cursor: Optional[str] = None
+    limit: int = 50
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    method: Optional[ExpenseMethod] = None
+    min_amount: Optional[Decimal] = None
+    max_amount: Optional[Decimal] = None
+
+class SpendBucket(BaseModel):
+    """Spend in one period for one user (paid/owed) or one split method (amount)."""
+    period_start: date
+    user_id: Optional[int] = None
+    method: Optional[str] = None
+    paid: Optional[Decimal] = None
+    owed: Optional[Decimal] = None
+    amount: Optional[Decimal] = None
+    expense_count: int
+
+class ReportKind(str, Enum):
+    balance_sheet = "balance_sheet"
+    expenses = "expenses"
+
+class ReportFormat(str, Enum):
+    csv = "csv"
+    csv_gz = "csv.gz"
+
+class ReportCreate(BaseModel):
+    kind: ReportKind
+    format: ReportFormat = ReportFormat.csv
+
+class ReportJob(BaseModel):
+    """Status of a report job; ``size`` is the file size in bytes once it is done."""
+    id: str
+    kind: ReportKind
+    format: ReportFormat
+    status: str
+    size: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,73 @@
+"""Serve the API with one worker process per CPU core.
+
+    python -m app.serve --workers 8 --port 8000
+
+Workers share nothing: uvicorn starts each one as a fresh process that builds
+the app with ``app.main:create_app``, so every worker opens its own engines
+and pools in the lifespan handler. On SIGTERM or SIGINT the supervisor stops
+accepting connections, each worker finishes its in-flight requests (for at
+most WEB_GRACEFUL_TIMEOUT seconds), then closes its pools and exits.
+
+The response cache keeps its versions in each process, so one worker would
+keep serving responses, and answering 304, after another worker's write.
+With more than one worker and no shared RESPONSE_CACHE_BACKEND, the workers
+run with the response cache turned off.
+
+Every option can also be set through the environment variables listed in
+``--help``.
+"""
+import argparse
+import logging
+import os
+import sys
+
+WEB_HOST = os.getenv("WEB_HOST", "127.0.0.1")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "5"))  # Seconds an idle connection is kept open
+WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", "2048"))  # Connections queued by the kernel before accept
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+# Restart a worker after this many requests, to bound slow leaks; 0 disables
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=WEB_HOST, help="WEB_HOST (default %(default)s)")
+    parser.add_argument("--port", type=int, default=WEB_PORT, help="WEB_PORT (default %(default)s)")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="WEB_WORKERS (default: CPU count, %(default)s)")
+    parser.add_argument("--keep-alive", type=int, default=WEB_KEEPALIVE, help="WEB_KEEPALIVE seconds (default %(default)s)")
+    parser.add_argument("--backlog", type=int, default=WEB_BACKLOG, help="WEB_BACKLOG (default %(default)s)")
+    parser.add_argument("--graceful-timeout", type=int, default=WEB_GRACEFUL_TIMEOUT,
+                        help="WEB_GRACEFUL_TIMEOUT seconds to drain on shutdown (default %(default)s)")
+    parser.add_argument("--max-requests", type=int, default=WEB_MAX_REQUESTS,
+                        help="WEB_MAX_REQUESTS per worker before it is replaced, 0 for no limit (default %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    import uvicorn
+
+    args = parse_args(argv)
+    if args.workers > 1 and not os.getenv("RESPONSE_CACHE_BACKEND"):
+        # The workers inherit this process's environment
+        os.environ["RESPONSE_CACHE"] = "off"
+        logger.warning("Response cache off: %d workers and no shared RESPONSE_CACHE_BACKEND.", args.workers)
+    uvicorn.run(
+        "app.main:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=max(1, args.workers),
+        timeout_keep_alive=args.keep_alive,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_max_requests=args.max_requests or None,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import csv
+import heapq
+from collections import namedtuple
+from io import StringIO
+from itertools import groupby
+from operator import attrgetter, itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import archive, models, schemas, sharding
+from app.database import SessionLocal
+
+CSV_HEADER = ["User ID", "User Name", "Total Expense", "Expense ID", "Amount", "Method", "Description"]
+CSV_CHUNK_SIZE = 64 * 1024  # Bytes buffered before a chunk is sent
+STREAM_BATCH_SIZE = 1000  # Rows fetched per round trip from the server-side cursor
+
+BalanceSheetRow = namedtuple("BalanceSheetRow", "user_id user_name id amount method description")
+
+
+def _expense_out(user_id, id, amount, method, description) -> schemas.ExpenseOut:
+    return schemas.ExpenseOut.model_construct(
+        id=id, amount=amount, method=schemas.ExpenseMethod(method), description=description
+    )
+
+
+def _expenses_by_user(db: Session, archived: archive.Archive) -> Dict[int, List[schemas.ExpenseOut]]:
+    # Every expense in one pass, ordered so each user's rows are contiguous
+    expenses = db.execute(
+        select(
+            models.Expense.user_id,
+            models.Expense.id,
+            models.Expense.amount,
+            models.Expense.method,
+            models.Expense.description,
+        )
+        .where(models.Expense.user_id.isnot(None), *sharding.visible(db), *archived.hot())
+        .order_by(models.Expense.user_id, models.Expense.id)
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    return {
+        user_id: [_expense_out(*expense) for expense in user_expenses]
+        for user_id, user_expenses in groupby(expenses, key=itemgetter(0))
+    }
+
+
+def _add_archived(expenses_by_user: Dict[int, List[schemas.ExpenseOut]], archived: archive.Archive):
+    for user_id, rows in groupby(archived.by_user(), key=itemgetter(0)):
+        cold = [_expense_out(*row) for row in rows]
+        expenses_by_user[user_id] = list(heapq.merge(cold, expenses_by_user.get(user_id, []), key=attrgetter("id")))
+
+
+def build_balance_sheet(db: Session) -> List[schemas.BalanceSheetEntry]:
+    """Build the balance sheet with two queries, independent of the number of users.
+
+    Totals come from the ``user_balances`` ledger rather than summing ``expenses``.
+    Expenses are read as plain Core rows rather than ORM instances, so nothing is
+    added to the session's identity map; the column types already deliver
+    ``Decimal`` amounts, so the rows are not validated again. With sharding the
+    expenses are read from every shard in parallel; each user's are on one.
+    Archived expenses are merged in from the segments.
+    """
+    # Total expenses per user from the materialized ledger, O(users)
+    totals = (
+        db.query(models.User.id, models.User.name, models.UserBalance.total_paid.label("total_expense"))
+        .join(models.UserBalance, models.UserBalance.user_id == models.User.id)
+        .filter(models.UserBalance.total_paid != 0)
+        .order_by(models.User.id)
+        .all()
+    )
+
+    archived = archive.current()
+    expenses_by_user = {}
+    for shard_expenses in sharding.fan_out(db, lambda shard_db: _expenses_by_user(shard_db, archived)):
+        expenses_by_user.update(shard_expenses)
+    if archived.segments:
+        _add_archived(expenses_by_user, archived)
+
+    return [
+        schemas.BalanceSheetEntry(
+            user_id=row.id,
+            user_name=row.name,
+            total_expense=row.total_expense,
+            individual_expenses=expenses_by_user.get(row.id, []),
+        )
+        for row in totals
+    ]
+
+
+def _balance_sheet_rows(db: Session) -> Iterator:
+    """Expense rows with their payer's name, ordered by payer and expense id."""
+    archived = archive.current()
+    names = None
+    if not sharding.distributed():
+        rows = db.execute(
+            select(
+                models.User.id.label("user_id"),
+                models.User.name.label("user_name"),
+                models.Expense.id,
+                models.Expense.amount,
+                models.Expense.method,
+                models.Expense.description,
+            )
+            .join(models.Expense, models.Expense.user_id == models.User.id)
+            .where(*archived.hot())
+            .order_by(models.User.id, models.Expense.id)
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+    else:
+        # The users are on the primary, so the join happens here, against a name per user
+        names = dict(db.execute(select(models.User.id, models.User.name)).all())
+        rows = _named(names, sharding.execute_merged(
+            db,
+            select(models.Expense.user_id, models.Expense.id, models.Expense.amount,
+                   models.Expense.method, models.Expense.description)
+            .where(models.Expense.user_id.isnot(None), *archived.hot())
+            .order_by(models.Expense.user_id, models.Expense.id),
+            key=itemgetter(0, 1),
+            batch_size=STREAM_BATCH_SIZE,
+        ))
+
+    if not archived.segments:
+        return rows
+    if names is None:
+        names = dict(db.execute(select(models.User.id, models.User.name)).all())
+    return heapq.merge(rows, _named(names, archived.by_user()), key=attrgetter("user_id", "id"))
+
+
+def _named(names: Dict[int, str], expenses: Iterable[tuple]) -> Iterator[BalanceSheetRow]:
+    return (
+        BalanceSheetRow(user_id, names[user_id], expense_id, amount, method, description)
+        for user_id, expense_id, amount, method, description in expenses
+        if user_id in names
+    )
+
+
+def iter_balance_sheet_csv(db: Session) -> Iterator[str]:
+    """Yield the balance sheet as CSV chunks, reading expenses through a server-side cursor.
+
+    Rows arrive ordered by user, so only the current user's expenses are held in
+    memory while their total is computed.
+    """
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_HEADER)
+
+    rows = _balance_sheet_rows(db)
+
+    for (user_id, user_name), user_expenses in groupby(rows, key=attrgetter("user_id", "user_name")):
+        user_expenses = list(user_expenses)
+        user_total_expense = sum(expense.amount for expense in user_expenses)
+
+        for expense in user_expenses:
+            # Convert the method string to the corresponding Enum value
+            expense_method = schemas.ExpenseMethod(expense.method)
+            writer.writerow([
+                user_id,
+                user_name,
+                user_total_expense,
+                expense.id,
+                expense.amount,
+                expense_method.value,
+                expense.description,
+            ])
+
+        if output.tell() >= CSV_CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    yield output.getvalue()
+
+
+def stream_balance_sheet_csv(session_factory: Callable[[], Session] = SessionLocal) -> Iterator[str]:
+    """Stream the CSV with a session owned by the generator, so it outlives the request handler."""
+    db = session_factory()
+    try:
+        yield from iter_balance_sheet_csv(db)
+    finally:
+        db.close()
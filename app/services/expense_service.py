@@ -1,48 +1,42 @@
 from sqlalchemy.orm import Session
-from app.models import Expense as ExpenseModel
-from app.schemas import ExpenseCreate, ExpenseMethod
+from app.models import Expense as ExpenseModel, ExpenseDetail
+from app.schemas import ExpenseCreate
+from app import crud, sharding
+from app.money import to_money
+from app.services import ledger_service, rollup_service
+from app.services.split_engine import split_expense
 from typing import List
 from datetime import datetime
 
 
 def create_expense(db: Session, expense: ExpenseCreate) -> ExpenseModel:
-    if expense.method == ExpenseMethod.equal:
-        total_amount = expense.amount
-        number_of_participants = len(expense.details)
-        equal_share = total_amount / number_of_participants
+    with sharding.routed(db, expense.user_id, write=True) as shard_db:
+        return _create_expense(shard_db, expense)
 
-        for detail in expense.details:
-            detail.amount_owed = equal_share  # Set the equal share for each participant
 
-    elif expense.method == ExpenseMethod.exact:
-        total_split = sum(detail.amount_owed for detail in expense.details if detail.amount_owed is not None)
-        if total_split != expense.amount:
-            raise ValueError("The total of exact amounts must equal the total expense amount.")
-
-    elif expense.method == ExpenseMethod.percentage:
-        total_percentage = sum(detail.percentage for detail in expense.details if detail.percentage is not None)
-        if total_percentage != 100:
-            raise ValueError("Percentages must add up to 100%.")
-
-        for detail in expense.details:
-            if detail.percentage is not None:
-                detail.amount_owed = expense.amount * (detail.percentage / 100)
+def _create_expense(db: Session, expense: ExpenseCreate) -> ExpenseModel:
+    # Same split rules as crud.add_expense, shared through the split engine
+    details = split_expense(expense)
 
     db_expense = ExpenseModel(
         user_id=expense.user_id,
-        amount=expense.amount,
-        method=expense.method,
+        amount=to_money(expense.amount),
+        method=expense.method.value,
         description=expense.description,
-         date=datetime.utcnow()
-        
+        date=datetime.utcnow(),
+        details=[ExpenseDetail(**detail) for detail in details],
     )
+    sharding.assign_ids([db_expense])
     db.add(db_expense)
+    ledger_service.apply_deltas(db, ledger_service.expense_deltas(expense.user_id, expense.amount, details))
+    rollup_service.apply_rollups(db, rollup_service.expense_rollups([(db_expense, details)]))
     db.commit()
+    crud.invalidate_expense_responses([expense.user_id])
     db.refresh(db_expense)
     return db_expense
 
 def get_user_expenses(db: Session, user_id: int) -> List[ExpenseModel]:
-    return db.query(ExpenseModel).filter(ExpenseModel.user_id == user_id).all()
+    return crud.get_user_expenses(db, user_id)
 
 def get_all_expenses(db: Session) -> List[ExpenseModel]:
-    return db.query(ExpenseModel).all()
+    return crud.get_all_expenses(db)
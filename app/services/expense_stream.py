@@ -0,0 +1,78 @@
+"""Stream expense listings as NDJSON straight from a server-side cursor.
+
+Rows are fetched STREAM_BATCH_SIZE at a time with ``yield_per`` and each batch
+is encoded and sent before the next one is read, so memory stays flat however
+many expenses match. The generators own their sessions, since they keep
+reading after the request handler has returned. With sharding, one user's
+expenses stream from their shard, and everyone's from all shards merged in
+(date, id) order. Archived expenses, all older than the hot ones, follow.
+"""
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from app import sharding
+from app.database import AsyncSessionLocal, SessionLocal
+from app.ndjson import encode_lines
+
+STREAM_BATCH_SIZE = 1000
+
+
+def _encode_batch(rows) -> bytes:
+    # Amounts keep the "10.00" string form of the JSON API
+    return encode_lines(
+        {"id": id, "user_id": user_id, "amount": str(amount), "method": method, "description": description}
+        for id, user_id, amount, method, description, _ in rows
+    )
+
+
+def _archived_batches(rows: Iterable[tuple]) -> Iterator[bytes]:
+    rows = iter(rows)
+    for batch in iter(lambda: list(islice(rows, STREAM_BATCH_SIZE)), []):
+        yield _encode_batch(batch)
+
+
+def iter_expenses_ndjson(
+    stmt: Select, session_factory: Callable[[], Session] = SessionLocal, user_id: Optional[int] = None,
+    archived_rows: Iterable[tuple] = (),
+) -> Iterator[bytes]:
+    """Yield one NDJSON chunk per batch of rows from ``crud.expense_rows_query``, then from ``archived_rows``.
+
+    ``user_id`` is the user ``stmt`` is filtered on, if any.
+    """
+    yield from _hot_batches(stmt, session_factory, user_id)
+    yield from _archived_batches(archived_rows)
+
+
+def _hot_batches(stmt: Select, session_factory: Callable[[], Session], user_id: Optional[int]) -> Iterator[bytes]:
+    db = session_factory()
+    try:
+        if user_id is None and sharding.distributed():
+            rows = sharding.execute_merged(
+                db, stmt, key=lambda row: (row.date, row.id), reverse=True, batch_size=STREAM_BATCH_SIZE
+            )
+            try:
+                for batch in iter(lambda: list(islice(rows, STREAM_BATCH_SIZE)), []):
+                    yield _encode_batch(batch)
+            finally:
+                rows.close()  # Closes the shard sessions if the client went away
+            return
+
+        with sharding.routed(db, user_id) as shard_db:
+            result = shard_db.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+            for rows in result.partitions():
+                yield _encode_batch(rows)
+    finally:
+        db.close()
+
+
+async def aiter_expenses_ndjson(stmt: Select, archived_rows: Iterable[tuple] = ()) -> AsyncIterator[bytes]:
+    """Async counterpart of ``iter_expenses_ndjson``, for routes on the async engine."""
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for rows in result.partitions():
+            yield _encode_batch(rows)
+    for chunk in _archived_batches(archived_rows):
+        yield chunk
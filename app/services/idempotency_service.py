@@ -0,0 +1,81 @@
+"""Idempotency keys for expense creation.
+
+A client that sends ``Idempotency-Key`` with ``POST /expenses/`` gets the
+expense created at most once for that key. The key is stored with a hash of
+the request and the response, in the same transaction as the expense, so a
+retry costs one primary-key lookup and returns the original response. Reusing
+a key with a different request is rejected.
+
+Keys are kept for IDEMPOTENCY_KEY_TTL_HOURS; expired ones can be removed with:
+
+    python -m app.services.idempotency_service purge
+"""
+import argparse
+import hashlib
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+
+class IdempotencyKeyReused(ValueError):
+    """The key was already used for a different request."""
+
+
+def request_hash(expense: schemas.ExpenseCreate) -> str:
+    return hashlib.sha256(expense.model_dump_json().encode()).hexdigest()
+
+
+def replay(db: Session, key: str, fingerprint: str) -> Optional[schemas.Expense]:
+    """Return the response stored for ``key``, or None if the key has not been used."""
+    stored = db.get(models.IdempotencyKey, key)
+    if stored is None:
+        return None
+    if stored.request_hash != fingerprint:
+        raise IdempotencyKeyReused("This Idempotency-Key was already used with a different request.")
+    return schemas.Expense.model_validate_json(stored.response)
+
+
+def record(db: Session, key: str, fingerprint: str, response: schemas.Expense):
+    """Store the response for ``key`` inside the caller's transaction."""
+    db.add(models.IdempotencyKey(
+        key=key,
+        request_hash=fingerprint,
+        expense_id=response.id,
+        response=response.model_dump_json(),
+    ))
+
+
+def purge_expired(db: Session, ttl_hours: float = IDEMPOTENCY_KEY_TTL_HOURS) -> int:
+    cutoff = datetime.utcnow() - timedelta(hours=ttl_hours)
+    # Keys stay on the primary, also when the expenses are sharded
+    purged = db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.created_at < cutoff)).rowcount
+    db.commit()
+    return purged
+
+
+def main(argv=None):
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Remove expired idempotency keys.")
+    parser.add_argument("command", choices=["purge"])
+    parser.add_argument("--ttl-hours", type=float, default=IDEMPOTENCY_KEY_TTL_HOURS)
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        print(f"Removed {purge_expired(db, args.ttl_hours)} expired idempotency keys.")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
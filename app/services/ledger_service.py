@@ -0,0 +1,158 @@
+"""Materialized per-user balance ledger (``user_balances``).
+
+``crud`` applies every new expense to the ledger in the same transaction as its
+details, so balances can be read without scanning ``expenses``. The ledger can
+be checked against, or rebuilt from, the raw tables:
+
+    python -m app.services.ledger_service verify
+    python -m app.services.ledger_service rebuild
+"""
+import argparse
+import sys
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from app import archive, models, sharding
+from app.money import to_money
+from app.upsert import increment
+
+ZERO = Decimal("0.00")
+
+
+class LedgerDrift(NamedTuple):
+    user_id: int
+    stored_paid: Decimal
+    expected_paid: Decimal
+    stored_owed: Decimal
+    expected_owed: Decimal
+
+
+def expense_deltas(payer_id: int, amount, details: Iterable[dict]) -> Dict[int, List[Decimal]]:
+    """Return ``{user_id: [paid, owed]}`` increments for one expense and its split."""
+    deltas = defaultdict(lambda: [ZERO, ZERO])
+    if payer_id is not None:
+        deltas[payer_id][0] += to_money(amount)
+    for detail in details:
+        if detail["user_id"] is not None and detail["amount_owed"] is not None:
+            deltas[detail["user_id"]][1] += to_money(detail["amount_owed"])
+    return deltas
+
+
+def merge_deltas(target: Dict[int, List[Decimal]], deltas: Dict[int, List[Decimal]]):
+    for user_id, (paid, owed) in deltas.items():
+        totals = target.setdefault(user_id, [ZERO, ZERO])
+        totals[0] += paid
+        totals[1] += owed
+
+
+def apply_deltas(db: Session, deltas: Dict[int, List[Decimal]]):
+    """Add ``deltas`` to the ledger inside the caller's transaction.
+
+    Each row is incremented with a single upsert, so concurrent writers neither
+    lose updates nor collide inserting a user's first ledger row.
+    """
+    for user_id, (paid, owed) in deltas.items():
+        increment(db, models.UserBalance, {"user_id": user_id},
+                  {"total_paid": paid, "total_owed": owed, "net": paid - owed})
+
+
+def compute_ledger(db: Session) -> Dict[int, Tuple[Decimal, Decimal]]:
+    """Recompute ``{user_id: (total_paid, total_owed)}`` from the raw tables, on every shard.
+
+    Archived months count with the totals stored in their segments.
+    """
+    archived = archive.current()
+    ledger = defaultdict(lambda: [ZERO, ZERO])
+    for user_id, (paid, owed) in archived.ledger().items():
+        ledger[user_id][0] += paid
+        ledger[user_id][1] += owed
+
+    for shard_db in sharding.each_shard(db):
+        visible = [*sharding.visible(shard_db), *archived.hot()]
+        paid = (
+            shard_db.query(models.Expense.user_id, func.sum(models.Expense.amount))
+            .filter(models.Expense.user_id.isnot(None), *visible)
+            .group_by(models.Expense.user_id)
+        )
+        for user_id, total in paid:
+            ledger[user_id][0] += to_money(total or 0)
+
+        owed = (
+            shard_db.query(models.ExpenseDetail.user_id, func.sum(models.ExpenseDetail.amount_owed))
+            .filter(models.ExpenseDetail.user_id.isnot(None))
+            .group_by(models.ExpenseDetail.user_id)
+        )
+        if visible:
+            # Skip the details of archived expenses and of those the shard holds only as a copy
+            owed = owed.join(models.Expense, models.Expense.id == models.ExpenseDetail.expense_id).filter(*visible)
+        for user_id, total in owed:
+            ledger[user_id][1] += to_money(total or 0)
+
+    return {user_id: (paid, owed) for user_id, (paid, owed) in ledger.items()}
+
+
+def verify_ledger(db: Session) -> List[LedgerDrift]:
+    """Compare the stored ledger with the raw tables and return every row that differs."""
+    expected = compute_ledger(db)
+    stored = {
+        row.user_id: (to_money(row.total_paid), to_money(row.total_owed))
+        for row in db.query(models.UserBalance)
+    }
+
+    drift = []
+    for user_id in sorted(expected.keys() | stored.keys()):
+        stored_paid, stored_owed = stored.get(user_id, (ZERO, ZERO))
+        expected_paid, expected_owed = expected.get(user_id, (ZERO, ZERO))
+        if (stored_paid, stored_owed) != (expected_paid, expected_owed):
+            drift.append(LedgerDrift(user_id, stored_paid, expected_paid, stored_owed, expected_owed))
+    return drift
+
+
+def rebuild_ledger(db: Session) -> int:
+    """Replace the ledger with totals recomputed from the raw tables. Returns the row count."""
+    ledger = compute_ledger(db)
+    try:
+        db.query(models.UserBalance).delete()
+        if ledger:
+            db.execute(insert(models.UserBalance.__table__), [
+                {"user_id": user_id, "total_paid": paid, "total_owed": owed, "net": paid - owed}
+                for user_id, (paid, owed) in ledger.items()
+            ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(ledger)
+
+
+def main(argv=None):
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Verify or rebuild the user_balances ledger.")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            print(f"Rebuilt ledger for {rebuild_ledger(db)} users.")
+            return 0
+
+        drift = verify_ledger(db)
+        for row in drift:
+            print(
+                f"user {row.user_id}: paid {row.stored_paid} (expected {row.expected_paid}), "
+                f"owed {row.stored_owed} (expected {row.expected_owed})"
+            )
+        print(f"{len(drift)} users with drift.")
+        return 1 if drift else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
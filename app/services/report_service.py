@@ -0,0 +1,294 @@
+"""Reports built in the background and served as files.
+
+``POST /reports`` records a job and hands it to a small pool of worker
+processes; ``GET /reports/{id}`` returns the file once the job is done. The
+reports read whole tables, so they run outside the web workers:
+
+- at most REPORT_WORKERS reports run at once per web worker, each in its own
+  process with engines of its own, so they never take connections from the
+  request pools or hold the GIL the event loop needs;
+- the report processes run at a lower CPU priority (REPORT_NICE);
+- beyond REPORT_MAX_PENDING queued or running jobs, new ones are rejected.
+
+Files are written to REPORT_DIR, which every web worker on the host shares, so
+any of them can serve a finished report. Jobs and their files are kept for
+REPORT_TTL_HOURS; expired ones, and jobs left unfinished by a crash, are
+removed with:
+
+    python -m app.services.report_service purge
+"""
+import argparse
+import csv
+import gzip
+import heapq
+import logging
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from io import StringIO, TextIOWrapper
+from operator import itemgetter
+from typing import Callable, Dict, Iterator, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app import archive, models, schemas, sharding
+
+logger = logging.getLogger(__name__)
+
+REPORT_DIR = os.getenv("REPORT_DIR") or os.path.join(tempfile.gettempdir(), "expense-reports")
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "1"))
+REPORT_MAX_PENDING = int(os.getenv("REPORT_MAX_PENDING", str(REPORT_WORKERS * 8)))
+REPORT_NICE = int(os.getenv("REPORT_NICE", "10"))
+REPORT_TTL_HOURS = float(os.getenv("REPORT_TTL_HOURS", "24"))
+
+EXPENSES_CSV_HEADER = ["Expense ID", "User ID", "Amount", "Method", "Description", "Date"]
+CSV_CHUNK_SIZE = 64 * 1024
+STREAM_BATCH_SIZE = 1000
+MEDIA_TYPES = {
+    schemas.ReportFormat.csv: "text/csv",
+    schemas.ReportFormat.csv_gz: "application/gzip",
+}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class ReportQueueFull(RuntimeError):
+    """REPORT_MAX_PENDING jobs are already queued or running in this process."""
+
+
+def iter_expenses_csv(db: Session) -> Iterator[str]:
+    """Every expense as CSV chunks, in id order, read through a server-side cursor on each shard.
+
+    Archived expenses are merged in by id.
+    """
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(EXPENSES_CSV_HEADER)
+    expenses = models.Expense.__table__
+    archived = archive.current()
+    rows = sharding.execute_merged(
+        db,
+        select(expenses.c.id, expenses.c.user_id, expenses.c.amount, expenses.c.method,
+               expenses.c.description, expenses.c.date)
+        .where(*archived.hot())
+        .order_by(expenses.c.id),
+        key=itemgetter(0),
+        batch_size=STREAM_BATCH_SIZE,
+    )
+    if archived.segments:
+        rows = heapq.merge(rows, archived.by_id(), key=itemgetter(0))
+    for row in rows:
+        writer.writerow(row)
+        if output.tell() >= CSV_CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
+def _balance_sheet_csv(db: Session) -> Iterator[str]:
+    from app.services.balance_sheet_service import iter_balance_sheet_csv
+    return iter_balance_sheet_csv(db)
+
+
+REPORTS: Dict[schemas.ReportKind, Callable[[Session], Iterator[str]]] = {
+    schemas.ReportKind.balance_sheet: _balance_sheet_csv,
+    schemas.ReportKind.expenses: iter_expenses_csv,
+}
+
+
+def report_path(job: models.ReportJob) -> str:
+    return os.path.join(REPORT_DIR, f"{job.id}.{job.format}")
+
+
+def write_report(db: Session, job: models.ReportJob) -> int:
+    """Write the report to a temporary file and move it into place. Returns its size."""
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    path = report_path(job)
+    partial = path + ".part"
+    try:
+        with open(partial, "wb") as raw:
+            binary = raw
+            if job.format == schemas.ReportFormat.csv_gz.value:
+                # The gzip header records a file name; give it the final one, not the .part
+                binary = gzip.GzipFile(filename=os.path.basename(path), mode="wb", fileobj=raw, compresslevel=6)
+            with TextIOWrapper(binary, encoding="utf-8", newline="") as output:
+                for chunk in REPORTS[schemas.ReportKind(job.kind)](db):
+                    output.write(chunk)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return os.path.getsize(path)
+
+
+def _finish(job_id: str, **values):
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.ReportJob)
+            .where(models.ReportJob.id == job_id, models.ReportJob.status.in_((QUEUED, RUNNING)))
+            .values(finished_at=datetime.utcnow(), **values)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _claim(job_id: str) -> Optional[models.ReportJob]:
+    """Mark a queued job running and return it detached, or None if it is not queued."""
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        job = db.get(models.ReportJob, job_id)
+        if job is None or job.status != QUEUED:
+            return None
+        job.status = RUNNING
+        db.flush()
+        db.expunge(job)
+        db.commit()
+        return job
+    finally:
+        db.close()
+
+
+def run_job(job_id: str):
+    """Build one report; runs in a report process, which has engines of its own.
+
+    The job row is claimed and finished on the primary in short sessions of
+    their own, so while the report is built its only connection is the read
+    session, on a replica when READ_REPLICA_URLS lists any.
+    """
+    from app.database import read_session
+
+    job = _claim(job_id)
+    if job is None:
+        return
+    read_db = read_session()
+    try:
+        size = write_report(read_db, job)
+    except Exception as e:
+        logger.exception("Report %s failed", job_id)
+        _finish(job_id, status=FAILED, error=str(e) or type(e).__name__)
+    else:
+        _finish(job_id, status=DONE, size=size)
+    finally:
+        read_db.close()
+
+
+def _init_report_process():
+    # Yield the CPU to the web workers; report processes are not latency sensitive
+    if REPORT_NICE and hasattr(os, "nice"):
+        os.nice(REPORT_NICE)
+
+
+_executor = None  # ProcessPoolExecutor
+_pending_lock = threading.Lock()
+_pending = 0
+
+
+def _get_executor():
+    # Created on the first report, so web workers that never run one pay nothing.
+    # Spawned rather than forked: the parent has threads and open pools.
+    global _executor
+    if _executor is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        _executor = ProcessPoolExecutor(
+            max_workers=REPORT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_report_process,
+        )
+    return _executor
+
+
+def _job_settled(job_id: str, future: Future):
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+    if future.cancelled():
+        error = "Cancelled at shutdown."
+    elif future.exception() is not None:
+        # The report process died, e.g. killed for running out of memory
+        error = f"Report process failed: {future.exception()!r}"
+    else:
+        return
+    _finish(job_id, status=FAILED, error=error)
+
+
+def submit(db: Session, kind: schemas.ReportKind, format: schemas.ReportFormat) -> models.ReportJob:
+    """Record a job and queue it, or raise ReportQueueFull if this process has too many pending."""
+    global _executor, _pending
+    with _pending_lock:
+        if _pending >= REPORT_MAX_PENDING:
+            raise ReportQueueFull("Too many reports in progress. Please retry shortly.")
+        _pending += 1
+
+    try:
+        job_id = uuid.uuid4().hex
+        job = models.ReportJob(id=job_id, kind=kind.value, format=format.value, status=QUEUED)
+        db.add(job)
+        db.commit()
+        try:
+            future = _get_executor().submit(run_job, job_id)
+        except RuntimeError:
+            # BrokenProcessPool: a report process died; start a fresh pool
+            _executor = None
+            future = _get_executor().submit(run_job, job_id)
+    except BaseException:
+        with _pending_lock:
+            _pending -= 1
+        raise
+    future.add_done_callback(lambda settled: _job_settled(job_id, settled))
+    return job
+
+
+def shutdown():
+    """Wait for running reports and cancel queued ones; called when the web worker stops."""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def purge_expired(db: Session, ttl_hours: float = REPORT_TTL_HOURS) -> int:
+    """Delete jobs created before the TTL, finished or not, and their files."""
+    cutoff = datetime.utcnow() - timedelta(hours=ttl_hours)
+    expired = db.scalars(select(models.ReportJob).where(models.ReportJob.created_at < cutoff)).all()
+    for job in expired:
+        for path in (report_path(job), report_path(job) + ".part"):
+            if os.path.exists(path):
+                os.remove(path)
+        db.delete(job)
+    db.commit()
+    return len(expired)
+
+
+def main(argv=None):
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Remove expired report jobs and their files.")
+    parser.add_argument("command", choices=["purge"])
+    parser.add_argument("--ttl-hours", type=float, default=REPORT_TTL_HOURS)
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        print(f"Removed {purge_expired(db, args.ttl_hours)} expired reports.")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""Daily spend rollups (``spend_daily_user`` and ``spend_daily_method``).
+
+``crud`` adds every new expense to the rollups in the same transaction as its
+details, so analytics over any date range read one row per day and key instead
+of scanning ``expenses``. Days are UTC calendar days of ``Expense.date``.
+
+The rollups can be rebuilt from history, a chunk of expenses at a time:
+
+    python -m app.services.rollup_service backfill --chunk-size 10000
+"""
+import argparse
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import archive, models, sharding
+from app.money import to_money
+from app.upsert import increment
+from app.services import ledger_service
+
+ZERO = Decimal("0.00")
+BACKFILL_CHUNK_SIZE = 10_000
+INTERVALS = ("day", "week", "month")
+
+
+class Rollups(NamedTuple):
+    # {(day, user_id): [paid, owed, expense_count]}
+    users: Dict[Tuple[date, int], list]
+    # {(day, method): [amount, expense_count]}
+    methods: Dict[Tuple[date, str], list]
+
+
+def new_rollups() -> Rollups:
+    return Rollups(defaultdict(lambda: [ZERO, ZERO, 0]), defaultdict(lambda: [ZERO, 0]))
+
+
+def add_expense(rollups: Rollups, expense: models.Expense, details: Iterable[dict]):
+    """Accumulate one expense and its split into ``rollups``."""
+    day = (expense.date or datetime.utcnow()).date()
+    for user_id, (paid, owed) in ledger_service.expense_deltas(expense.user_id, expense.amount, details).items():
+        totals = rollups.users[day, user_id]
+        totals[0] += paid
+        totals[1] += owed
+    if expense.user_id is not None:
+        rollups.users[day, expense.user_id][2] += 1
+
+    totals = rollups.methods[day, expense.method]
+    totals[0] += to_money(expense.amount)
+    totals[1] += 1
+
+
+def expense_rollups(expenses: Iterable[Tuple[models.Expense, Iterable[dict]]]) -> Rollups:
+    rollups = new_rollups()
+    for expense, details in expenses:
+        add_expense(rollups, expense, details)
+    return rollups
+
+
+def apply_rollups(db: Session, rollups: Rollups):
+    """Add ``rollups`` to the stored rows inside the caller's transaction.
+
+    Same pattern as the balance ledger: one upsert per day and key, so days and
+    keys without a row yet are created without racing concurrent writers.
+    """
+    for (day, user_id), (paid, owed, count) in rollups.users.items():
+        increment(db, models.DailyUserSpend, {"day": day, "user_id": user_id},
+                  {"paid": paid, "owed": owed, "expense_count": count})
+
+    for (day, method), (amount, count) in rollups.methods.items():
+        increment(db, models.DailyMethodSpend, {"day": day, "method": method},
+                  {"amount": amount, "expense_count": count})
+
+
+def backfill_rollups(db: Session, chunk_size: int = BACKFILL_CHUNK_SIZE) -> int:
+    """Rebuild the rollups from ``expenses`` and ``expense_details``. Returns the number of expenses read.
+
+    Expenses are read in primary-key order, ``chunk_size`` at a time, and each
+    chunk's rollups are written before the next chunk is read, so memory stays
+    bounded by the chunk size. Everything runs in one transaction, so readers
+    see either the old rollups or the complete new ones. With sharding the
+    shards are read one after the other, and the rollups written to ``db``.
+    Archived months are added from the totals stored in their segments.
+    """
+    expenses_table = models.Expense.__table__
+    details_table = models.ExpenseDetail.__table__
+    processed = 0
+    try:
+        db.query(models.DailyUserSpend).delete()
+        db.query(models.DailyMethodSpend).delete()
+
+        archived = archive.current()
+        if archived.segments:
+            rollups = new_rollups()
+            archived.add_rollups(rollups)
+            apply_rollups(db, rollups)
+
+        for shard_db in sharding.each_shard(db):
+            visible = [*sharding.visible(shard_db), *archived.hot()]
+            last_id = 0
+            while True:
+                chunk = shard_db.execute(
+                    select(expenses_table.c.id, expenses_table.c.user_id, expenses_table.c.amount,
+                           expenses_table.c.method, expenses_table.c.date)
+                    .where(expenses_table.c.id > last_id, *visible)
+                    .order_by(expenses_table.c.id)
+                    .limit(chunk_size)
+                ).all()
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+
+                details = defaultdict(list)
+                for row in shard_db.execute(
+                    select(details_table.c.expense_id, details_table.c.user_id, details_table.c.amount_owed)
+                    .where(details_table.c.expense_id.between(chunk[0].id, last_id))
+                ):
+                    details[row.expense_id].append({"user_id": row.user_id, "amount_owed": row.amount_owed})
+
+                apply_rollups(db, expense_rollups((expense, details[expense.id]) for expense in chunk))
+                processed += len(chunk)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return processed
+
+
+def period_start(day: date, interval: str) -> date:
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    return day
+
+
+def spend(
+    db: Session,
+    group_by: str,
+    interval: str,
+    date_from: date,
+    date_to: date,
+    user_id: Optional[int] = None,
+    method: Optional[str] = None,
+) -> List[dict]:
+    """Spend per period for ``date_from`` to ``date_to`` inclusive, grouped by user or by method.
+
+    Reads one rollup row per day and key in the range; weeks (starting Monday)
+    and months are summed from the daily rows.
+    """
+    if group_by == "user":
+        table = models.DailyUserSpend.__table__
+        key, sums = table.c.user_id, ("paid", "owed", "expense_count")
+        query = select(table.c.day, key, table.c.paid, table.c.owed, table.c.expense_count)
+        if user_id is not None:
+            query = query.where(key == user_id)
+    else:
+        table = models.DailyMethodSpend.__table__
+        key, sums = table.c.method, ("amount", "expense_count")
+        query = select(table.c.day, key, table.c.amount, table.c.expense_count)
+        if method is not None:
+            query = query.where(key == method)
+
+    query = query.where(table.c.day.between(date_from, date_to)).order_by(table.c.day, key)
+
+    buckets = {}
+    for row in db.execute(query):
+        bucket_key = (period_start(row.day, interval), row[1])
+        bucket = buckets.get(bucket_key)
+        if bucket is None:
+            buckets[bucket_key] = dict(zip(sums, row[2:]))
+        else:
+            for name, value in zip(sums, row[2:]):
+                bucket[name] += value
+
+    return [
+        {"period_start": period, key.name: key_value, **totals}
+        for (period, key_value), totals in sorted(buckets.items())
+    ]
+
+
+def main(argv=None):
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild the daily spend rollups from history.")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        print(f"Rolled up {backfill_rollups(db, chunk_size=args.chunk_size)} expenses.")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
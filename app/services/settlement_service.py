@@ -0,0 +1,107 @@
+"""Debt simplification: who pays whom to settle every balance.
+
+Each participant in an expense owes the payer their ``amount_owed``. Those debts
+are netted to one balance per user, and the balances are settled with a greedy
+match of the largest creditor against the largest debtor. The greedy match
+produces at most ``n - 1`` transfers for ``n`` users with a non-zero balance and
+runs in O(n log n); finding the true minimum is NP-hard.
+"""
+import heapq
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app import archive, models, sharding
+from app.money import to_cents
+
+
+class Transfer(NamedTuple):
+    from_user_id: int
+    to_user_id: int
+    amount_cents: int
+
+
+def net_from_details(rows: Iterable[Tuple[int, int, int]]) -> Dict[int, int]:
+    """Net ``(payer_id, participant_id, amount_owed_cents)`` rows into ``{user_id: cents}``.
+
+    Positive balances are owed to the user, negative balances are owed by them.
+    """
+    balances = defaultdict(int)
+    for payer_id, participant_id, cents in rows:
+        if payer_id != participant_id:
+            balances[payer_id] += cents
+            balances[participant_id] -= cents
+    return balances
+
+
+def net_balances(db: Session) -> Dict[int, int]:
+    """Net every expense detail in the database into ``{user_id: cents}``.
+
+    The database does the aggregation, so only one row per user comes back,
+    from each shard when there are several; their balances are summed here,
+    with the archived months' totals.
+    """
+    archived = archive.current()
+    balances = defaultdict(int)
+    for shard_balances in sharding.fan_out(db, lambda shard_db: _net_shard_balances(shard_db, archived)):
+        for user_id, cents in shard_balances.items():
+            balances[user_id] += cents
+    for user_id, cents in archived.balances().items():
+        balances[user_id] += cents
+    return balances
+
+
+def _net_shard_balances(db: Session, archived: archive.Archive) -> Dict[int, int]:
+    expense, detail = models.Expense, models.ExpenseDetail
+    is_debt = (expense.user_id != detail.user_id) & detail.amount_owed.isnot(None)
+    visible = [*sharding.visible(db), *archived.hot()]
+
+    balances = defaultdict(int)
+    credits = (
+        db.query(expense.user_id, func.sum(detail.amount_owed))
+        .join(detail, detail.expense_id == expense.id)
+        .filter(is_debt, *visible)
+        .group_by(expense.user_id)
+    )
+    for user_id, total in credits:
+        balances[user_id] += to_cents(total)
+
+    debits = (
+        db.query(detail.user_id, func.sum(detail.amount_owed))
+        .join(expense, detail.expense_id == expense.id)
+        .filter(is_debt, *visible)
+        .group_by(detail.user_id)
+    )
+    for user_id, total in debits:
+        balances[user_id] -= to_cents(total)
+
+    return balances
+
+
+def simplify_debts(balances: Dict[int, int]) -> List[Transfer]:
+    """Settle net balances with the greedy max-creditor/max-debtor matching."""
+    # heapq is a min-heap, so amounts are negated to pop the largest first
+    creditors = [(-cents, user_id) for user_id, cents in balances.items() if cents > 0]
+    debtors = [(cents, user_id) for user_id, cents in balances.items() if cents < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append(Transfer(debtor, creditor, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+
+    return transfers
+
+
+def get_settlements(db: Session) -> List[Transfer]:
+    return simplify_debts(net_balances(db))
@@ -0,0 +1,225 @@
+"""Split engine shared by every path that turns an expense into per-participant amounts.
+
+All arithmetic is done in integer cents. Every method reduces to integer weights
+per participant:
+
+| Method     | Weight                          | Total                   |
+|------------|---------------------------------|-------------------------|
+| equal      | 1                               | number of participants  |
+| shares     | the participant's share count   | sum of shares           |
+| percentage | percentage × 10^d               | 100 × 10^d              |
+| exact      | amount owed in cents            | expense amount in cents |
+
+For percentages, ``d`` is the largest number of decimal places among the
+participants, so the weights are exact integers and no precision is lost.
+
+Each participant gets ``floor(amount * weight / total)`` cents, and the cents
+left over go one each to the participants with the largest remainders, ties
+going to the earlier participant (largest remainder method). Splits therefore
+always add up to the expense amount, and the same input always gives the same
+split.
+
+``split_batch`` works on flat ``array('q')`` buffers so a whole batch of expenses
+is split in one call without building per-participant objects. When NumPy is
+installed, the batch is split with vectorized array operations instead of a
+Python loop; both give identical results.
+"""
+from array import array
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+
+from app.money import CENT, from_cents, to_cents
+from app.schemas import ExpenseCreate, ExpenseMethod
+
+HUNDRED = Decimal(100)
+# Beyond this many decimal places a percentage no longer changes a split by a cent
+PERCENTAGE_MAX_PLACES = 12
+PERCENTAGE_STEP = Decimal(1).scaleb(-PERCENTAGE_MAX_PLACES)
+NUMPY_MIN_BATCH = 64  # Below this many participants the pure Python loop is faster
+# amount * weight must fit in int64 for the vectorized path
+NUMPY_MAX_PRODUCT = 2**62
+
+
+def percentage_weights(details) -> List[int]:
+    """Exact integer weights, summing to 100 × 10^d, for percentages that add up to exactly 100."""
+    percentages = []
+    for detail in details:
+        if detail.percentage is None:
+            raise ValueError(f"Percentage owed must be specified for user {detail.user_id}")
+        try:
+            percentage = Decimal(str(detail.percentage))
+            if not percentage.is_finite():
+                raise InvalidOperation
+            exact = percentage.quantize(PERCENTAGE_STEP)
+        except InvalidOperation:
+            raise ValueError(f"{detail.percentage} is not a valid percentage.") from None
+        if exact != percentage:
+            raise ValueError(
+                f"The percentage for user {detail.user_id} has more than {PERCENTAGE_MAX_PLACES} decimal places."
+            )
+        percentages.append(exact.normalize())
+
+    if sum(percentages) != HUNDRED:
+        raise ValueError("Percentages must sum up to 100.")
+    places = max(-percentage.as_tuple().exponent for percentage in percentages)
+    return [int(percentage.scaleb(places)) for percentage in percentages]
+
+
+def expense_weights(expense: ExpenseCreate) -> Tuple[int, List[int]]:
+    """Validate ``expense`` and return its amount in cents and one integer weight per participant."""
+    if not expense.details:
+        raise ValueError(f"At least one participant is required for {expense.method.value} splitting.")
+
+    amount = to_cents(expense.amount)
+
+    if expense.method == ExpenseMethod.equal:
+        return amount, [1] * len(expense.details)
+
+    if expense.method == ExpenseMethod.shares:
+        weights = []
+        for detail in expense.details:
+            if detail.shares is None or detail.shares < 0:
+                raise ValueError(f"A non-negative number of shares must be specified for user {detail.user_id}")
+            weights.append(detail.shares)
+        if sum(weights) == 0:
+            raise ValueError("At least one participant must hold a share.")
+        return amount, weights
+
+    if expense.method == ExpenseMethod.percentage:
+        return amount, percentage_weights(expense.details)
+
+    if expense.method == ExpenseMethod.exact:
+        weights = []
+        for detail in expense.details:
+            if detail.amount_owed is None:
+                raise ValueError(f"Amount owed must be specified for user {detail.user_id}")
+            weights.append(to_cents(detail.amount_owed))
+        if sum(weights) != amount:
+            raise ValueError("The total of exact amounts must equal the total expense amount.")
+        if amount == 0:
+            raise ValueError("Amount must not be zero for exact splitting.")
+        return amount, weights
+
+    raise ValueError("Invalid expense splitting method")
+
+
+@lru_cache(maxsize=None)
+def _numpy():
+    # NumPy is optional and slow to import, so it is loaded by the first batch large enough to use it
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def split_batch(amounts: Sequence[int], weights: Sequence[int], offsets: Sequence[int]) -> array:
+    """Split a batch of expenses in one pass.
+
+    Expense ``k`` has amount ``amounts[k]`` in cents and participants
+    ``weights[offsets[k]:offsets[k + 1]]``; ``offsets`` therefore has one more
+    entry than ``amounts``. Returns the cents owed by every participant, laid out
+    like ``weights``.
+    """
+    if len(weights) >= NUMPY_MIN_BATCH and _numpy() is not None:
+        owed = _split_batch_numpy(amounts, weights, offsets)
+        if owed is not None:
+            return owed
+    return _split_batch_python(amounts, weights, offsets)
+
+
+def _split_batch_python(amounts: Sequence[int], weights: Sequence[int], offsets: Sequence[int]) -> array:
+    owed = array("q", bytes(8 * len(weights)))
+
+    for k, amount in enumerate(amounts):
+        start, end = offsets[k], offsets[k + 1]
+        participant_weights = weights[start:end]
+        total = sum(participant_weights)
+        if total == 0:
+            raise ValueError(f"Expense {k} has no weights to split by.")
+
+        shares = [amount * weight // total for weight in participant_weights]
+        leftover = amount - sum(shares)
+        if leftover:
+            remainders = [amount * weight % total for weight in participant_weights]
+            # Largest remainder first; the sort is stable (also with reverse=True),
+            # so ties go to the earlier participant
+            for i in sorted(range(len(shares)), key=remainders.__getitem__, reverse=True)[:leftover]:
+                shares[i] += 1
+
+        owed[start:end] = array("q", shares)
+
+    return owed
+
+
+def _split_batch_numpy(amounts: Sequence[int], weights: Sequence[int], offsets: Sequence[int]):
+    """Vectorized ``split_batch``; returns None when the products could overflow int64."""
+    np = _numpy()
+    amounts = np.asarray(amounts, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, counts = offsets[:-1], np.diff(offsets)
+    if len(amounts) == 0:
+        return array("q")
+    if (counts == 0).any():
+        raise ValueError(f"Expense {int(np.argmax(counts == 0))} has no weights to split by.")
+    if int(np.abs(amounts).max()) * int(np.abs(weights).max()) >= NUMPY_MAX_PRODUCT:
+        return None
+
+    totals = np.add.reduceat(weights, starts)
+    if (totals == 0).any():
+        raise ValueError(f"Expense {int(np.argmax(totals == 0))} has no weights to split by.")
+
+    expense_of = np.repeat(np.arange(len(amounts)), counts)
+    products = amounts[expense_of] * weights
+    shares = np.floor_divide(products, totals[expense_of])
+    remainders = products - shares * totals[expense_of]
+    leftover = amounts - np.add.reduceat(shares, starts)
+
+    # Within each expense, order participants by remainder (largest first, ties
+    # to the earlier participant) and give one cent to the first ``leftover``.
+    order = np.lexsort((np.arange(len(weights)), -remainders, expense_of))
+    rank = np.arange(len(weights)) - starts[expense_of[order]]
+    shares[order[rank < leftover[expense_of[order]]]] += 1
+
+    return array("q", shares.tobytes())
+
+
+def split_weighted(expenses: Sequence[ExpenseCreate], weighted: Sequence[Tuple[int, List[int]]]) -> List[List[dict]]:
+    """Split expenses whose ``(amount, weights)`` came from ``expense_weights``.
+
+    Returns the ExpenseDetail column values for each expense.
+    """
+    amounts, weights, offsets = array("q"), array("q"), array("q", [0])
+    for amount, participant_weights in weighted:
+        amounts.append(amount)
+        weights.extend(participant_weights)
+        offsets.append(len(weights))
+
+    owed = split_batch(amounts, weights, offsets)
+
+    results = []
+    for k, expense in enumerate(expenses):
+        start, end = offsets[k], offsets[k + 1]
+        total = sum(weights[start:end])
+        results.append([
+            dict(
+                user_id=detail.user_id,
+                amount_owed=from_cents(owed[start + i]),
+                percentage=(Decimal(weights[start + i] * 100) / total).quantize(CENT, rounding=ROUND_HALF_UP),
+            )
+            for i, detail in enumerate(expense.details)
+        ])
+    return results
+
+
+def split_expenses(expenses: Sequence[ExpenseCreate]) -> List[List[dict]]:
+    """Validate and split expenses, raising ValueError on the first invalid one."""
+    return split_weighted(expenses, [expense_weights(expense) for expense in expenses])
+
+
+def split_expense(expense: ExpenseCreate) -> List[dict]:
+    """Split one expense, raising ValueError on invalid input."""
+    return split_expenses([expense])[0]
@@ -0,0 +1,558 @@
+"""Horizontal sharding of expenses by payer.
+
+``expenses`` and ``expense_details`` can be spread over several databases,
+the shards, listed in SHARD_URLS as ``name=url`` pairs. Every other table
+(users, the balance ledger, the rollups, idempotency keys, reports and the
+shard map itself) stays on the primary database. Idempotency keys stay there
+because a key is not tied to one payer: a request that reuses a key for
+another payer must still find it. Without SHARD_URLS all tables live on the
+primary and the helpers here pass the caller's session through.
+
+Placement: with sharding on, every expense stores ``shard_key``, a 32-bit hash
+of its payer's id. The keys form a ring on which each shard of SHARD_RING owns
+SHARD_VNODES points, and a key belongs to the shard of the next point. A
+payer's expenses and their details are therefore all on one shard.
+
+Routing: ``routed`` opens a session on one payer's shard, so crud writes and
+per-user reads touch exactly one shard. The session binds the other tables to
+the primary, so the ledger and rollup updates go through the same session and
+are committed after the shard (with SHARD_TWO_PHASE, in one two-phase commit).
+Reads over every payer use ``fan_out``, which runs a function on all shards in
+parallel, or ``execute_merged``, which merges one ordered query from every
+shard into a single ordered stream. Expense ids come from one sequence on the
+primary (``id_blocks``), so they are unique across shards.
+
+Rebalancing moves ranges of the ring between shards while the application
+keeps serving them:
+
+1. ``copying``: the range is copied to the target in chunks. The source still
+   serves it; fan-out reads ignore the copies on the target.
+2. ``frozen``: writes to the range fail with ShardMoving, and are retried by
+   clients, while the rows written during the copy are copied as well.
+3. ``moved``: the target serves the range. The rows left on the source are
+   ignored, then deleted.
+4. ``done``.
+
+Workers reload the moves every SHARD_MAP_REFRESH_SECONDS, and the tool waits
+twice that long between the steps. To add a shard, list it in SHARD_URLS, move
+the ranges a ring including it would assign to it, then add it to SHARD_RING:
+
+    python -m app.sharding init
+    python -m app.sharding rebalance --ring s0,s1,s2
+    python -m app.sharding status
+"""
+import argparse
+import bisect
+import hashlib
+import heapq
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
+
+from sqlalchemy import and_, delete, func, insert, inspect, or_, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app import database, models
+
+SHARD_RING = [name.strip() for name in os.getenv("SHARD_RING", "").split(",") if name.strip()] or list(database.SHARD_URLS)
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+SHARD_MAP_REFRESH_SECONDS = float(os.getenv("SHARD_MAP_REFRESH_SECONDS", "1"))
+SHARD_ID_BLOCK = int(os.getenv("SHARD_ID_BLOCK", "1000"))  # Expense ids a process reserves at a time
+SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", str(4 * max(1, len(database.SHARD_URLS)))))
+# XA across the shard and the primary; MySQL only
+SHARD_TWO_PHASE = os.getenv("SHARD_TWO_PHASE", "false").lower() in ("1", "true", "yes")
+MOVE_CHUNK_SIZE = 1000
+
+KEY_SPACE = 1 << 32
+SHARDED_TABLES = ("expenses", "expense_details")
+COPYING, FROZEN, MOVED, DONE = "copying", "frozen", "moved", "done"
+
+T = TypeVar("T")
+
+
+class ShardMoving(RuntimeError):
+    """The payer's part of the ring is being moved to another shard; retry shortly."""
+
+
+def distributed() -> bool:
+    return bool(database.SHARD_URLS)
+
+
+def _hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=4).digest(), "big")
+
+
+def shard_key(user_id: Optional[int]) -> int:
+    """Position of a payer on the ring, in [0, 2**32)."""
+    return 0 if user_id is None else _hash(str(user_id))
+
+
+class HashRing:
+    """Consistent hash ring with ``vnodes`` points per shard."""
+
+    def __init__(self, names: Iterable[str], vnodes: int = SHARD_VNODES):
+        points = sorted((_hash(f"{name}#{index}"), name) for name in names for index in range(vnodes))
+        if not points:
+            raise ValueError("The shard ring has no shards.")
+        self.positions = [position for position, _ in points]
+        self.names = [name for _, name in points]
+
+    def owner(self, key: int) -> str:
+        return self.names[bisect.bisect_right(self.positions, key) % len(self.names)]
+
+
+class Move(NamedTuple):
+    id: int
+    start: int
+    end: int
+    source: str
+    target: str
+    state: str
+
+
+class ShardMap:
+    """The ring plus the moves made on it; the latest move covering a key wins."""
+
+    def __init__(self, ring: HashRing, moves: List[Move]):
+        self.ring = ring
+        self.moves = moves
+
+    def _latest_move(self, key: int) -> Optional[Move]:
+        for move in reversed(self.moves):
+            if move.start <= key < move.end:
+                return move
+        return None
+
+    def owner(self, key: int) -> str:
+        move = self._latest_move(key)
+        if move is None:
+            return self.ring.owner(key)
+        return move.target if move.state in (MOVED, DONE) else move.source
+
+    def frozen(self, key: int) -> bool:
+        move = self._latest_move(key)
+        return move is not None and move.state == FROZEN
+
+    def hidden(self, shard: str) -> List[Tuple[int, int]]:
+        """Ranges whose rows ``shard`` holds without serving them: copies not yet, or no longer, in use."""
+        return [
+            (move.start, move.end) for move in self.moves
+            if (move.state in (COPYING, FROZEN) and move.target == shard)
+            or (move.state == MOVED and move.source == shard)
+        ]
+
+    def ranges(self, start: int = 0, end: int = KEY_SPACE, ring: Optional[HashRing] = None) -> List[Tuple[int, int, str, str]]:
+        """Split ``[start, end)`` into ``(start, end, owner, owner under ring)`` ranges."""
+        ring = ring or self.ring
+        bounds = {start, end}
+        for positions in (self.ring.positions, ring.positions, *((move.start, move.end) for move in self.moves)):
+            bounds.update(position for position in positions if start < position < end)
+
+        ranges = []
+        bounds = sorted(bounds)
+        for low, high in zip(bounds, bounds[1:]):
+            owners = (self.owner(low), ring.owner(low))
+            if ranges and ranges[-1][1] == low and ranges[-1][2:] == owners:
+                ranges[-1] = (ranges[-1][0], high, *owners)
+            else:
+                ranges.append((low, high, *owners))
+        return ranges
+
+
+_map: Optional[ShardMap] = None
+_map_loaded_at = 0.0
+_map_lock = threading.Lock()
+
+
+def load_moves() -> List[Move]:
+    moves = models.ShardMove.__table__
+    with database.engine.connect() as conn:
+        return [Move(*row) for row in conn.execute(
+            select(moves.c.id, moves.c.start, moves.c.end, moves.c.source, moves.c.target, moves.c.state)
+            .order_by(moves.c.id)
+        )]
+
+
+def current_map() -> ShardMap:
+    """The shard map, reloaded from the primary every SHARD_MAP_REFRESH_SECONDS."""
+    global _map, _map_loaded_at
+    with _map_lock:
+        if _map is None or time.monotonic() - _map_loaded_at >= SHARD_MAP_REFRESH_SECONDS:
+            _map = ShardMap(HashRing(SHARD_RING), load_moves())
+            _map_loaded_at = time.monotonic()
+        return _map
+
+
+def shard_session(name: str, global_bind=None) -> Session:
+    """A session on shard ``name``; every other table goes to ``global_bind``, by default the primary."""
+    shard_engine = database.shard_engines()[name]
+    global_bind = global_bind or database.engine
+    binds = {
+        table: shard_engine if table.name in SHARDED_TABLES else global_bind
+        for table in models.Base.metadata.sorted_tables
+    }
+    db = Session(binds=binds, autoflush=False, twophase=SHARD_TWO_PHASE)
+    db.info["shard"] = name
+    return db
+
+
+@contextmanager
+def on_shard(db: Optional[Session], name: str) -> Iterator[Session]:
+    """A session on shard ``name``, with the other tables on ``db``'s database."""
+    shard_db = shard_session(name, db.get_bind() if db is not None else None)
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+def shard_for(user_id: Optional[int], write: bool = False) -> str:
+    shard_map = current_map()
+    key = shard_key(user_id)
+    if write and shard_map.frozen(key):
+        raise ShardMoving("This user's expenses are being moved between shards. Please retry shortly.")
+    return shard_map.owner(key)
+
+
+@contextmanager
+def routed(db: Optional[Session], user_id: Optional[int], write: bool = False) -> Iterator[Session]:
+    """A session on the shard of ``user_id``'s expenses, or ``db`` itself without sharding.
+
+    ``write`` raises ShardMoving while the user's range is frozen by a move.
+    """
+    if not distributed():
+        yield db
+        return
+    with on_shard(db, shard_for(user_id, write=write)) as shard_db:
+        yield shard_db
+
+
+def each_shard(db: Session) -> Iterator[Session]:
+    """A session on every shard in turn, or ``db`` itself without sharding."""
+    if not distributed():
+        yield db
+        return
+    for name in database.shard_engines():
+        with on_shard(db, name) as shard_db:
+            yield shard_db
+
+
+_fan_out_executor: Optional[ThreadPoolExecutor] = None
+_fan_out_lock = threading.Lock()
+
+
+def fan_out(db: Optional[Session], fn: Callable[[Session], T]) -> List[T]:
+    """Run ``fn`` on a session for each shard, all shards in parallel, and return the results.
+
+    Without sharding ``fn`` runs once, on ``db``. ``fn`` must finish reading
+    before it returns, since each session is closed right after.
+    """
+    global _fan_out_executor
+    if not distributed():
+        return [fn(db)]
+
+    global_bind = db.get_bind() if db is not None else None
+
+    def run(name: str) -> T:
+        shard_db = shard_session(name, global_bind)
+        try:
+            return fn(shard_db)
+        finally:
+            shard_db.close()
+
+    with _fan_out_lock:
+        if _fan_out_executor is None:
+            _fan_out_executor = ThreadPoolExecutor(max_workers=SHARD_FANOUT_WORKERS, thread_name_prefix="shard-fan-out")
+    return list(_fan_out_executor.map(run, database.shard_engines()))
+
+
+def visible(db: Session) -> list:
+    """Conditions on ``expenses`` that skip the rows ``db``'s shard holds but does not serve.
+
+    Empty unless a move is in progress; apply them to every read that spans shards.
+    """
+    shard = db.info.get("shard") if db is not None else None
+    if shard is None:
+        return []
+    return [
+        or_(models.Expense.shard_key < start, models.Expense.shard_key >= end)
+        for start, end in current_map().hidden(shard)
+    ]
+
+
+def execute_merged(db: Session, stmt, key: Callable, reverse: bool = False, batch_size: int = 1000) -> Iterator:
+    """Rows of ``stmt`` from every shard, merged on ``key``.
+
+    ``stmt`` must already be ordered by ``key`` (descending with ``reverse``).
+    Each shard is read through a server-side cursor, ``batch_size`` rows at a
+    time, so memory does not grow with the result.
+    """
+    if not distributed():
+        yield from db.execute(stmt.execution_options(yield_per=batch_size))
+        return
+
+    sessions = []
+    try:
+        streams = []
+        for name in database.shard_engines():
+            shard_db = shard_session(name, db.get_bind() if db is not None else None)
+            sessions.append(shard_db)
+            streams.append(shard_db.execute(stmt.where(*visible(shard_db)).execution_options(yield_per=batch_size)))
+        yield from heapq.merge(*streams, key=key, reverse=reverse)
+    finally:
+        for shard_db in sessions:
+            shard_db.close()
+
+
+_id_lock = threading.Lock()
+_id_blocks: Dict[str, Tuple[int, int]] = {}  # sequence -> (next id, end of the reserved block)
+
+
+def _reserve_ids(name: str, size: int) -> Tuple[int, int]:
+    blocks = models.IdBlock.__table__
+    with database.engine.begin() as conn:
+        conn.execute(update(blocks).where(blocks.c.name == name).values(next_id=blocks.c.next_id + size))
+        end = conn.execute(select(blocks.c.next_id).where(blocks.c.name == name)).scalar_one()
+    return end - size, end
+
+
+def allocate_ids(count: int, name: str = "expenses") -> List[int]:
+    """``count`` ids unique across every shard, from blocks reserved on the primary."""
+    ids = []
+    with _id_lock:
+        while len(ids) < count:
+            next_id, end = _id_blocks.get(name, (0, 0))
+            if next_id >= end:
+                next_id, end = _reserve_ids(name, max(SHARD_ID_BLOCK, count - len(ids)))
+            taken = min(end - next_id, count - len(ids))
+            ids.extend(range(next_id, next_id + taken))
+            _id_blocks[name] = (next_id + taken, end)
+    return ids
+
+
+def assign_ids(expenses: List[models.Expense]):
+    """Give new expenses their ids before they are flushed; shards cannot use autoincrement."""
+    if distributed() and expenses:
+        for expense, expense_id in zip(expenses, allocate_ids(len(expenses))):
+            expense.id = expense_id
+
+
+def _reset_after_fork():
+    # A forked child must not hand out ids from its parent's block
+    global _map, _fan_out_executor
+    _id_blocks.clear()
+    _map = None
+    _fan_out_executor = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def create_tables():
+    """Create the tables: sharded ones on every shard, the rest on the primary. Seeds the id sequence."""
+    tables = models.Base.metadata.sorted_tables
+    if not distributed():
+        models.Base.metadata.create_all(database.engine)
+        return
+
+    with database.engine.begin() as conn:
+        _create_missing(conn, [table for table in tables if table.name not in SHARDED_TABLES])
+    last_id = 0
+    for shard_engine in database.shard_engines().values():
+        with shard_engine.begin() as conn:
+            _create_missing(conn, [table for table in tables if table.name in SHARDED_TABLES])
+            last_id = max(last_id, conn.execute(select(func.max(models.Expense.id))).scalar() or 0)
+
+    blocks = models.IdBlock.__table__
+    with database.engine.begin() as conn:
+        if conn.execute(select(blocks.c.name).where(blocks.c.name == "expenses")).first() is None:
+            conn.execute(insert(blocks).values(name="expenses", next_id=last_id + 1))
+
+
+def _create_missing(conn, tables: list):
+    existing = set(inspect(conn).get_table_names())
+    names = {table.name for table in tables}
+    for table in tables:
+        if table.name in existing:
+            continue
+        # Foreign keys to tables in another database cannot be enforced
+        local_keys = [fk for fk in table.foreign_key_constraints if fk.referred_table.name in names]
+        conn.execute(CreateTable(table, include_foreign_key_constraints=local_keys))
+        for index in table.indexes:
+            conn.execute(CreateIndex(index))
+
+
+def _in_range(table, start: int, end: int):
+    return and_(table.c.shard_key >= start, table.c.shard_key < end)
+
+
+def _copy_range(move: Move, chunk_size: int) -> int:
+    """Copy the range's expenses missing on the target, with their details. Returns the count."""
+    expenses = models.Expense.__table__
+    details = models.ExpenseDetail.__table__
+    engines = database.shard_engines()
+    copied = 0
+    last_id = 0
+    while True:
+        with engines[move.source].connect() as source:
+            rows = source.execute(
+                select(expenses).where(_in_range(expenses, move.start, move.end), expenses.c.id > last_id)
+                .order_by(expenses.c.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                return copied
+            last_id = rows[-1].id
+            ids = [row.id for row in rows]
+            detail_rows = source.execute(select(details).where(details.c.expense_id.in_(ids))).all()
+
+        with engines[move.target].begin() as target:
+            present = set(target.execute(select(expenses.c.id).where(expenses.c.id.in_(ids))).scalars())
+            new_ids = set(ids) - present
+            if not new_ids:
+                continue
+            target.execute(insert(expenses), [dict(row._mapping) for row in rows if row.id in new_ids])
+            # Detail ids are per shard; the target assigns its own
+            new_details = [
+                {column: value for column, value in row._mapping.items() if column != "id"}
+                for row in detail_rows if row.expense_id in new_ids
+            ]
+            if new_details:
+                target.execute(insert(details), new_details)
+            copied += len(new_ids)
+
+
+def _delete_range(move: Move, chunk_size: int) -> int:
+    expenses = models.Expense.__table__
+    deleted = 0
+    while True:
+        with database.shard_engines()[move.source].begin() as source:
+            ids = source.execute(
+                select(expenses.c.id).where(_in_range(expenses, move.start, move.end)).limit(chunk_size)
+            ).scalars().all()
+            if not ids:
+                return deleted
+            source.execute(delete(models.ExpenseDetail.__table__).where(models.ExpenseDetail.expense_id.in_(ids)))
+            source.execute(delete(expenses).where(expenses.c.id.in_(ids)))
+            deleted += len(ids)
+
+
+def _set_state(moves: List[Move], state: str) -> List[Move]:
+    table = models.ShardMove.__table__
+    with database.engine.begin() as conn:
+        conn.execute(update(table).where(table.c.id.in_([move.id for move in moves])).values(state=state))
+    return [move._replace(state=state) for move in moves]
+
+
+def _wait_for_workers():
+    time.sleep(2 * SHARD_MAP_REFRESH_SECONDS)
+
+
+def move_ranges(ranges: List[Tuple[int, int, str, str]], chunk_size: int = MOVE_CHUNK_SIZE, log=print) -> int:
+    """Move ``(start, end, source, target)`` ranges of the ring, all through each step together.
+
+    Resumes moves of the same ranges left unfinished by an earlier run.
+    Returns the number of expenses moved.
+    """
+    if not ranges:
+        return 0
+    table = models.ShardMove.__table__
+    unfinished = {(move.start, move.end, move.target): move for move in load_moves() if move.state != DONE}
+    moves = []
+    with database.engine.begin() as conn:
+        for start, end, source, target in ranges:
+            move = unfinished.get((start, end, target))
+            if move is None:
+                move_id = conn.execute(insert(table).values(
+                    start=start, end=end, source=source, target=target, state=COPYING
+                )).inserted_primary_key[0]
+                move = Move(move_id, start, end, source, target, COPYING)
+            moves.append(move)
+
+    steps = (COPYING, FROZEN, MOVED, DONE)
+    moved = 0
+    for step in steps[min(steps.index(move.state) for move in moves):]:
+        moves = _set_state(moves, step)
+        _wait_for_workers()
+        if step in (COPYING, FROZEN):
+            copied = sum(_copy_range(move, chunk_size) for move in moves)
+            moved += copied if step == COPYING else 0
+            log(f"{step}: copied {copied} expenses")
+        elif step == MOVED:
+            deleted = sum(_delete_range(move, chunk_size) for move in moves)
+            moved = max(moved, deleted)
+            log(f"{step}: deleted {deleted} expenses from the sources")
+    log(f"done: moved {len(moves)} ranges")
+    return moved
+
+
+def plan_ring(names: List[str]) -> List[Tuple[int, int, str, str]]:
+    """The ranges whose owner changes when the ring becomes ``names``."""
+    return [
+        (start, end, owner, new_owner)
+        for start, end, owner, new_owner in current_map().ranges(ring=HashRing(names))
+        if owner != new_owner
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the expense shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="create the tables and the id sequence")
+    commands.add_parser("status", help="show each shard's share of the ring, its expenses, and the moves")
+    rebalance = commands.add_parser("rebalance", help="move the ranges a new ring assigns elsewhere")
+    rebalance.add_argument("--ring", required=True, help="comma-separated shard names of the new ring")
+    rebalance.add_argument("--chunk-size", type=int, default=MOVE_CHUNK_SIZE)
+    move = commands.add_parser("move", help="move one range of the ring to a shard")
+    move.add_argument("--start", type=int, required=True)
+    move.add_argument("--end", type=int, required=True)
+    move.add_argument("--to", required=True)
+    move.add_argument("--chunk-size", type=int, default=MOVE_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    if not distributed():
+        parser.error("SHARD_URLS is not set.")
+
+    if args.command == "init":
+        create_tables()
+        print(f"Created the tables on the primary and on {len(database.SHARD_URLS)} shards.")
+    elif args.command == "status":
+        shard_map = current_map()
+        share = {name: 0 for name in database.SHARD_URLS}
+        for start, end, owner, _ in shard_map.ranges():
+            share[owner] += end - start
+        for name, shard_engine in database.shard_engines().items():
+            with shard_engine.connect() as conn:
+                count = conn.execute(select(func.count()).select_from(models.Expense.__table__)).scalar()
+            print(f"{name:<12} {share[name] / KEY_SPACE:>7.1%} of the ring  {count:>12} expenses")
+        for move in shard_map.moves:
+            print(f"move {move.id}: [{move.start}, {move.end}) {move.source} -> {move.target}  {move.state}")
+    else:
+        if args.command == "rebalance":
+            names = [name.strip() for name in args.ring.split(",") if name.strip()]
+            unknown = set(names) - set(database.SHARD_URLS)
+            if unknown:
+                parser.error(f"Not in SHARD_URLS: {', '.join(sorted(unknown))}")
+            ranges = [(start, end, source, target) for start, end, source, target in plan_ring(names)]
+        else:
+            if args.to not in database.SHARD_URLS:
+                parser.error(f"Not in SHARD_URLS: {args.to}")
+            ranges = [
+                (start, end, owner, args.to)
+                for start, end, owner, _ in current_map().ranges(args.start, args.end)
+                if owner != args.to
+            ]
+        print(f"Moving {len(ranges)} ranges.")
+        move_ranges(ranges, chunk_size=args.chunk_size)
+        if args.command == "rebalance":
+            print(f"Now set SHARD_RING={','.join(names)}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""Add to a counter row in one statement, creating the row if it does not exist yet.
+
+The ledger and the rollups keep running totals per key. An UPDATE followed by
+an INSERT when no row matched races: two first writes for the same key both
+insert, and one fails on the primary key. An upsert lets the database settle
+it: ``INSERT ... ON DUPLICATE KEY UPDATE`` on MySQL and ``INSERT ... ON
+CONFLICT DO UPDATE`` on SQLite.
+"""
+from typing import Dict
+
+from sqlalchemy.orm import Session
+
+
+def increment(db: Session, model, key: Dict[str, object], amounts: Dict[str, object]):
+    """Add ``amounts`` to the ``model`` row with primary key ``key``, inside the caller's transaction."""
+    table = model.__table__
+    dialect = db.get_bind(model).dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        stmt = insert(table).values(**key, **amounts)
+        stmt = stmt.on_duplicate_key_update({name: table.c[name] + stmt.inserted[name] for name in amounts})
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        stmt = insert(table).values(**key, **amounts)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key), set_={name: table.c[name] + stmt.excluded[name] for name in amounts}
+        )
+    else:
+        raise NotImplementedError(f"No upsert for the {dialect} dialect.")
+    db.execute(stmt)
@@ -0,0 +1,31 @@
+"""Query count and latency of the balance sheet as the number of users grows.
+
+    python -m benchmarks.bench_balance_sheet
+"""
+import argparse
+
+from benchmarks.common import count_queries, seed, session, timed
+from app.services.balance_sheet_service import build_balance_sheet
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1_000, 10_000, 20_000])
+    parser.add_argument("--expenses-per-user", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'expenses':>10} {'queries':>8} {'seconds':>9}")
+    for users in args.users:
+        seed(users, args.expenses_per_user)
+        db = session()
+        try:
+            with count_queries() as counter:
+                build_balance_sheet(db)
+            elapsed = timed(build_balance_sheet, db)
+        finally:
+            db.close()
+        print(f"{users:>8} {users * args.expenses_per_user:>10} {counter['queries']:>8} {elapsed:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
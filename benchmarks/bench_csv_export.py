@@ -0,0 +1,40 @@
+"""Time to first chunk, total time and peak memory of the streaming CSV export.
+
+    python -m benchmarks.bench_csv_export
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import seed, session
+from app.services.balance_sheet_service import iter_balance_sheet_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--expenses-per-user", type=int, nargs="+", default=[10, 100, 500])
+    args = parser.parse_args()
+
+    print(f"{'expenses':>10} {'first chunk ms':>15} {'total s':>9} {'peak MiB':>9}")
+    for expenses_per_user in args.expenses_per_user:
+        seed(args.users, expenses_per_user)
+        db = session()
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            chunks = iter_balance_sheet_csv(db)
+            next(chunks)
+            first_chunk = time.perf_counter() - start
+            for _ in chunks:
+                pass
+            total = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            db.close()
+        print(f"{args.users * expenses_per_user:>10} {first_chunk * 1000:>15.1f} {total:>9.2f} {peak / 2**20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
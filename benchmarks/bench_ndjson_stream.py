@@ -0,0 +1,59 @@
+"""Peak memory and time of one user's whole expense listing, as one JSON body versus streamed NDJSON.
+
+    python -m benchmarks.bench_ndjson_stream --expenses-per-user 10000 100000
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import seed, session
+from pydantic import TypeAdapter
+
+from app import crud, schemas
+from app.services.expense_stream import iter_expenses_ndjson
+
+expenses_json = TypeAdapter(list[schemas.Expense])
+
+
+def json_body(query):
+    db = session()
+    try:
+        expenses, _ = crud.list_expenses(db, query, user_id=1)
+        return len(expenses_json.dump_json(expenses_json.validate_python(expenses, from_attributes=True)))
+    finally:
+        db.close()
+
+
+def ndjson_stream(query):
+    return sum(len(chunk) for chunk in iter_expenses_ndjson(crud.expense_rows_query(query, user_id=1), user_id=1))
+
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--expenses-per-user", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'json s':>8} {'json MiB':>9} {'ndjson s':>9} {'ndjson MiB':>11}")
+    for expenses_per_user in args.expenses_per_user:
+        seed(args.users, expenses_per_user)
+        query = schemas.ExpenseQuery(limit=expenses_per_user)
+        json_time, json_peak = measure(json_body, query)
+        ndjson_time, ndjson_peak = measure(ndjson_stream, query)
+        print(f"{expenses_per_user:>8} {json_time:>8.2f} {json_peak / 2**20:>9.1f} "
+              f"{ndjson_time:>9.2f} {ndjson_peak / 2**20:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Time and peak memory of the balance sheet with ORM instances versus plain rows.
+
+    python -m benchmarks.bench_report_rows --users 1000 --expenses-per-user 1000
+    AMOUNT_STORAGE=cents python -m benchmarks.bench_report_rows --users 1000 --expenses-per-user 1000
+
+Run it once per storage mode to compare DECIMAL columns with integer cents.
+"""
+import argparse
+import time
+import tracemalloc
+from itertools import groupby
+from operator import attrgetter
+
+from benchmarks.common import seed, session
+from app import models, schemas
+from app.money import AMOUNT_STORAGE
+from app.services.balance_sheet_service import build_balance_sheet, iter_balance_sheet_csv
+
+
+def orm_balance_sheet(db):
+    """The balance sheet as it was built before: ORM instances validated one by one."""
+    totals = (
+        db.query(models.User.id, models.User.name, models.UserBalance.total_paid.label("total_expense"))
+        .join(models.UserBalance, models.UserBalance.user_id == models.User.id)
+        .filter(models.UserBalance.total_paid != 0)
+        .order_by(models.User.id)
+        .all()
+    )
+    expenses = db.query(models.Expense).order_by(models.Expense.user_id, models.Expense.id)
+    expenses_by_user = {
+        user_id: [schemas.ExpenseOut.from_orm(expense) for expense in user_expenses]
+        for user_id, user_expenses in groupby(expenses, key=attrgetter("user_id"))
+    }
+    return [
+        schemas.BalanceSheetEntry(
+            user_id=row.id, user_name=row.name, total_expense=row.total_expense,
+            individual_expenses=expenses_by_user.get(row.id, []),
+        )
+        for row in totals
+    ]
+
+
+def csv_export(db):
+    for _ in iter_balance_sheet_csv(db):
+        pass
+
+
+def measure(fn):
+    """Time one run, then trace memory in a second run; tracemalloc skews timings badly."""
+    db = session()
+    try:
+        start = time.perf_counter()
+        fn(db)
+        elapsed = time.perf_counter() - start
+        db.expunge_all()
+
+        tracemalloc.start()
+        fn(db)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        db.close()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--expenses-per-user", type=int, default=1_000)
+    args = parser.parse_args()
+
+    seed(args.users, args.expenses_per_user)
+    print(f"{args.users * args.expenses_per_user} expenses, AMOUNT_STORAGE={AMOUNT_STORAGE}")
+    print(f"{'path':<16} {'seconds':>9} {'peak MiB':>9}")
+    for name, fn in [("orm", orm_balance_sheet), ("rows", build_balance_sheet), ("csv", csv_export)]:
+        elapsed, peak = measure(fn)
+        print(f"{name:<16} {elapsed:>9.2f} {peak / 2**20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Latency of a small request while full-table reports are being produced.
+
+Starts ``python -m app.serve`` against the benchmark database and, for each
+mode, keeps ``--exporters`` clients busy requesting reports while a probe
+client times ``--probe-path``:
+
+- ``idle``: no reports, the baseline;
+- ``sync``: the exporters download ``/download_balance_sheet/``, built inside
+  the web worker;
+- ``jobs``: the exporters submit ``POST /reports`` and poll ``GET /reports/{id}``
+  until the file is ready, so the work runs in the report processes.
+
+    python -m benchmarks.bench_reports --users 200 --expenses-per-user 500
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.bench_workers import free_port, wait_until_ready
+from benchmarks.common import BENCH_PASSWORD, engine, seed
+
+MODES = ("idle", "sync", "jobs")
+
+
+async def export_sync(client: httpx.AsyncClient) -> int:
+    async with client.stream("GET", "/download_balance_sheet/") as response:
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+    return size
+
+
+async def export_job(client: httpx.AsyncClient) -> int:
+    job = (await client.post("/reports", json={"kind": "balance_sheet", "format": "csv"})).json()
+    while True:
+        response = await client.get(f"/reports/{job['id']}")
+        if response.status_code != 202:
+            response.raise_for_status()
+            return len(response.content)
+        await asyncio.sleep(0.2)
+
+
+async def run_mode(url: str, mode: str, headers: dict, args) -> dict:
+    latencies = []
+    exports = 0
+    deadline = time.monotonic() + args.duration
+
+    async with httpx.AsyncClient(base_url=url, headers=headers, timeout=300) as client:
+        async def exporter():
+            nonlocal exports
+            export = export_sync if mode == "sync" else export_job
+            while time.monotonic() < deadline:
+                await export(client)
+                exports += 1
+
+        async def probe():
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                (await client.get(args.probe_path)).raise_for_status()
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(args.probe_interval)
+
+        tasks = [probe()]
+        if mode != "idle":
+            tasks += [exporter() for _ in range(args.exporters)]
+        await asyncio.gather(*tasks)
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "probes": len(latencies),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "exports": exports,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--expenses-per-user", type=int, default=250)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--exporters", type=int, default=2, help="concurrent report clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per mode")
+    parser.add_argument("--probe-path", default="/analytics/spend?group_by=method")
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--web-workers", type=int, default=1)
+    args = parser.parse_args()
+
+    seed(args.users, args.expenses_per_user)
+    if engine.dialect.name == "sqlite":
+        # In SQLite's default journal mode a write waiting behind a report's long
+        # read blocks every new reader; WAL lets them proceed, as MySQL's MVCC does
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "RESPONSE_CACHE_SIZE": "0", "LOG_LEVEL": "WARNING"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--workers", str(args.web_workers), "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(url)
+        response = httpx.post(f"{url}/token", data={"username": "user1@example.com", "password": BENCH_PASSWORD})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        print(f"{'mode':>5} {'probes':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'exports':>8}")
+        for mode in args.modes:
+            result = asyncio.run(run_mode(url, mode, headers, args))
+            print(f"{result['mode']:>5} {result['probes']:>7} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                  f"{result['max_ms']:>8.1f} {result['exports']:>8}")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=120)
+
+
+if __name__ == "__main__":
+    main()
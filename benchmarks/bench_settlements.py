@@ -0,0 +1,40 @@
+"""Netting and debt simplification time for growing numbers of expense detail rows.
+
+    python -m benchmarks.bench_settlements
+"""
+import argparse
+import random
+import time
+
+# Imported for its side effect: sets up the benchmark environment before app is imported
+import benchmarks.common  # noqa: F401
+from app.services.settlement_service import net_from_details, simplify_debts
+
+
+def random_details(rows: int, users: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [(rng.randint(1, users), rng.randint(1, users), rng.randint(1, 100_000)) for _ in range(rows)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--users", type=int, default=5_000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'users':>7} {'net s':>7} {'simplify s':>11} {'transfers':>10}")
+    for rows in args.rows:
+        details = random_details(rows, args.users)
+
+        start = time.perf_counter()
+        balances = net_from_details(details)
+        netted = time.perf_counter()
+        transfers = simplify_debts(balances)
+        simplified = time.perf_counter()
+
+        assert sum(balances.values()) == 0
+        print(f"{rows:>10} {len(balances):>7} {netted - start:>7.3f} {simplified - netted:>11.3f} {len(transfers):>10}")
+
+
+if __name__ == "__main__":
+    main()
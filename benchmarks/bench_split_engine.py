@@ -0,0 +1,52 @@
+"""Throughput of the batch split engine in participant splits per second.
+
+    python -m benchmarks.bench_split_engine
+"""
+import argparse
+import random
+import time
+from array import array
+
+# Imported for its side effect: sets up the benchmark environment before app is imported
+import benchmarks.common  # noqa: F401
+from app.services.split_engine import split_batch
+
+BASIS_POINTS = 10_000  # 100% in hundredths of a percent
+
+
+def random_batch(expenses: int, max_participants: int, method: str, seed: int = 0):
+    rng = random.Random(seed)
+    amounts, weights, offsets = array("q"), array("q"), array("q", [0])
+    for _ in range(expenses):
+        participants = rng.randint(2, max_participants)
+        amounts.append(rng.randint(1, 10_000_00))
+        if method == "equal":
+            weights.extend([1] * participants)
+        elif method == "shares":
+            weights.extend(rng.randint(1, 5) for _ in range(participants))
+        else:
+            # Percentages in basis points that add up to 100%
+            cuts = sorted(rng.sample(range(1, BASIS_POINTS), participants - 1))
+            weights.extend(b - a for a, b in zip([0] + cuts, cuts + [BASIS_POINTS]))
+        offsets.append(len(weights))
+    return amounts, weights, offsets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--expenses", type=int, default=300_000)
+    parser.add_argument("--max-participants", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'method':>10} {'splits':>10} {'seconds':>8} {'splits/s':>12}")
+    for method in ("equal", "shares", "percentage"):
+        amounts, weights, offsets = random_batch(args.expenses, args.max_participants, method)
+        start = time.perf_counter()
+        owed = split_batch(amounts, weights, offsets)
+        elapsed = time.perf_counter() - start
+        assert sum(owed) == sum(amounts)
+        print(f"{method:>10} {len(weights):>10} {elapsed:>8.3f} {len(weights) / elapsed:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
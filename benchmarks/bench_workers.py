@@ -0,0 +1,130 @@
+"""Throughput of ``python -m app.serve`` as the number of worker processes grows.
+
+Seeds the benchmark database, then for each worker count starts the server,
+drives a CPU-bound endpoint from several client processes for a fixed time and
+shuts the server down with SIGTERM, checking that it drains and exits cleanly:
+
+    python -m benchmarks.bench_workers --workers 1 2 4 8 --duration 15
+
+The client processes share the machine with the server, so leave them a core
+or two (``--client-processes``), or run the server elsewhere for exact numbers.
+The response cache is disabled so every request does the full work.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.common import seed
+
+import httpx  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url + "/").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not start within {timeout} s")
+
+
+def client_process(url: str, path: str, connections: int, duration: float, results):
+    async def run():
+        completed = errors = 0
+        deadline = time.monotonic() + duration
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+            async def worker():
+                nonlocal completed, errors
+                while time.monotonic() < deadline:
+                    response = await client.get(path)
+                    completed += 1
+                    errors += response.status_code >= 400
+            await asyncio.gather(*(worker() for _ in range(connections)))
+        return completed, errors
+
+    results.put(asyncio.run(run()))
+
+
+def measure(workers: int, args) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "RESPONSE_CACHE_SIZE": "0", "LOG_LEVEL": "WARNING"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(url)
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(target=client_process, args=(url, args.path, args.connections, args.duration, results))
+            for _ in range(args.client_processes)
+        ]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        totals = [results.get() for _ in clients]
+        elapsed = time.perf_counter() - start
+        for client in clients:
+            client.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            # A single uvicorn process re-raises SIGTERM once it has shut down cleanly
+            shutdown = "clean" if server.wait(timeout=60) in (0, -signal.SIGTERM) else "error"
+        except subprocess.TimeoutExpired:
+            server.kill()
+            shutdown = "killed"
+
+    completed = sum(done for done, _ in totals)
+    return {
+        "workers": workers,
+        "throughput_rps": completed / elapsed,
+        "errors": sum(errors for _, errors in totals),
+        "shutdown": shutdown,
+    }
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, cpus} & set(range(1, cpus + 1))))
+    parser.add_argument("--path", default="/balance_sheet/")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--expenses-per-user", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per worker count")
+    parser.add_argument("--client-processes", type=int, default=max(1, cpus // 2))
+    parser.add_argument("--connections", type=int, default=16, help="concurrent connections per client process")
+    args = parser.parse_args()
+
+    seed(args.users, args.expenses_per_user)
+
+    print(f"{'workers':>7} {'req/s':>9} {'speedup':>8} {'efficiency':>10} {'errors':>7} {'shutdown':>9}")
+    baseline = None
+    for workers in args.workers:
+        result = measure(workers, args)
+        baseline = baseline or result["throughput_rps"] / workers
+        speedup = result["throughput_rps"] / baseline
+        print(f"{workers:>7} {result['throughput_rps']:>9.0f} {speedup:>8.2f} {speedup / workers:>10.0%} "
+              f"{result['errors']:>7} {result['shutdown']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Shared helpers for the benchmark scripts.
+
+The benchmarks run against a throwaway SQLite database, so the database URL has
+to be set before anything under ``app`` is imported.
+"""
+import os
+import tempfile
+
+BENCH_DB_PATH = os.path.join(tempfile.gettempdir(), "expense_bench.db")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{BENCH_DB_PATH}")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+# Seeded users share one password; the lowest bcrypt cost keeps /token measuring the app, not bcrypt
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import time  # noqa: E402
+
+from app.database import SessionLocal, engine  # noqa: E402, F401
+from tests.helpers import SEED_PASSWORD as BENCH_PASSWORD, count_queries, seed  # noqa: E402, F401
+
+
+def timed(fn, *args, repeat: int = 3):
+    """Return the best wall-clock time of ``repeat`` calls to ``fn``."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def session():
+    return SessionLocal()
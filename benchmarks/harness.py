@@ -0,0 +1,211 @@
+"""Benchmark every router in-process and compare the run against a JSON baseline.
+
+Seeds a SQLite database, drives the ASGI app through httpx without a network
+hop, and records throughput, latency percentiles, SQL statements per request
+and peak RSS for each scenario:
+
+    python -m benchmarks.harness --users 1000 --expenses 100000 --save-baseline
+    python -m benchmarks.harness --users 1000 --expenses 100000 --threshold 0.2
+
+The second command exits with status 1 when a scenario's p95 latency,
+throughput or SQL statements per request is more than 20% worse than the
+baseline. Any run in which a request fails with an error status exits with
+status 1 as well, and is not saved as a baseline.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import sys
+import time
+from itertools import count
+
+from benchmarks.common import BENCH_PASSWORD, count_queries, seed
+
+import httpx  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+DEFAULT_BASELINE = "benchmarks/baseline.json"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if platform.system() == "Darwin" else 2**10)
+
+
+def scenarios(users: int, headers: dict):
+    """``(name, requests weight, request factory)`` for every endpoint under test.
+
+    Whole-table reports are weighted down so large databases finish in
+    reasonable time.
+    """
+    new_users = count()
+    participants = [{"user_id": (i % users) + 1} for i in range(3)]
+    expense = {"user_id": 1, "amount": "90.00", "method": "equal", "description": "Benchmark", "details": participants}
+
+    def create_user():
+        n = next(new_users)
+        return "POST", "/users/", {"json": {
+            "email": f"bench-{n}-{time.time_ns()}@example.com", "name": "Bench",
+            "mobile_number": "0000000000", "password": BENCH_PASSWORD,
+        }}
+
+    return [
+        ("root", 1.0, lambda: ("GET", "/", {})),
+        ("create_user", 0.2, create_user),
+        ("login", 0.2, lambda: ("POST", "/token", {"data": {"username": "user1@example.com", "password": BENCH_PASSWORD}})),
+        ("create_expense", 1.0, lambda: ("POST", "/expenses/", {"json": expense})),
+        ("bulk_expenses", 0.1, lambda: ("POST", "/expenses/bulk", {"json": [expense] * 100})),
+        ("list_expenses", 1.0, lambda: ("GET", "/expenses/", {"headers": headers})),
+        ("list_user_expenses", 1.0, lambda: ("GET", "/expenses/user/1", {"headers": headers})),
+        ("balance_sheet", 0.05, lambda: ("GET", "/balance_sheet/", {})),
+        ("download_balance_sheet", 0.05, lambda: ("GET", "/download_balance_sheet/", {})),
+        ("settlements", 0.1, lambda: ("GET", "/settlements/", {"headers": headers})),
+        ("analytics_spend", 1.0, lambda: ("GET", "/analytics/spend?group_by=method&interval=month", {"headers": headers})),
+        ("metrics", 1.0, lambda: ("GET", "/metrics", {})),
+    ]
+
+
+async def run_scenario(client: httpx.AsyncClient, factory, requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = factory()
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    with count_queries() as counter:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "queries_per_request": round(counter["queries"] / requests, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def run(args) -> dict:
+    expenses_per_user = max(1, args.expenses // args.users)
+    seed(args.users, expenses_per_user, participants=args.participants)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.post("/token", data={"username": "user1@example.com", "password": BENCH_PASSWORD})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        results = {}
+        for name, weight, factory in scenarios(args.users, headers):
+            if args.only and name not in args.only:
+                continue
+            requests = max(1, int(args.requests * weight))
+            results[name] = await run_scenario(client, factory, requests, min(args.concurrency, requests))
+            print(f"{name:<24} {results[name]}", file=sys.stderr)
+
+    return {
+        "config": {
+            "users": args.users,
+            "expenses": args.users * expenses_per_user,
+            "participants": args.participants,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": results,
+    }
+
+
+def failed_requests(current: dict):
+    """Yield a message for every scenario in which some requests answered with an error status."""
+    for name, result in current["scenarios"].items():
+        if result["errors"]:
+            yield f"{name}: {result['errors']} of {result['requests']} requests failed"
+
+
+def regressions(current: dict, baseline: dict, threshold: float):
+    """Yield a message for every scenario that is worse than the baseline by more than ``threshold``."""
+    for name, base in baseline["scenarios"].items():
+        result = current["scenarios"].get(name)
+        if result is None:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            yield f"{name}: p95 {result['p95_ms']} ms vs baseline {base['p95_ms']} ms"
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - threshold):
+            yield f"{name}: throughput {result['throughput_rps']} req/s vs baseline {base['throughput_rps']} req/s"
+        if result["queries_per_request"] > base["queries_per_request"] * (1 + threshold):
+            yield f"{name}: {result['queries_per_request']} queries/request vs baseline {base['queries_per_request']}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--expenses", type=int, default=10_000, help="total expenses, spread evenly over the users")
+    parser.add_argument("--participants", type=int, default=3, help="expense details per expense")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario before weighting")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--only", nargs="+", help="run only these scenarios")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression, e.g. 0.2 for 20%%")
+    args = parser.parse_args()
+
+    current = asyncio.run(run(args))
+    report = json.dumps(current, indent=2)
+    print(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+
+    # Fast errors would otherwise pass for good latency and throughput
+    errors = list(failed_requests(current))
+    for error in errors:
+        print(f"ERRORS {error}", file=sys.stderr)
+
+    if args.save_baseline:
+        if errors:
+            print("Not saving a baseline from a run with failed requests.", file=sys.stderr)
+            return 1
+        with open(args.baseline, "w") as f:
+            f.write(report + "\n")
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.", file=sys.stderr)
+        return 1 if errors else 0
+
+    if baseline["config"] != current["config"]:
+        print("Baseline was recorded with a different configuration; not comparing.", file=sys.stderr)
+        return 1 if errors else 0
+
+    failures = list(regressions(current, baseline, args.threshold))
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    return 1 if errors or failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Latency percentiles of an authenticated endpoint under many concurrent clients.
+
+Start the server from the revision to measure, then point the load test at it:
+
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --clients 500
+
+Run it once against the old revision and once against the new one to compare
+p99 latency before and after a change.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def login(client: httpx.AsyncClient) -> str:
+    email = f"load-{uuid.uuid4().hex[:12]}@example.com"
+    response = await client.post("/users/", json={
+        "email": email, "name": "Load Test", "mobile_number": "0000000000", "password": "load-test",
+    })
+    response.raise_for_status()
+    response = await client.post("/token", data={"username": email, "password": "load-test"})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def run(url: str, path: str, clients: int, requests_per_client: int):
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        headers = {"Authorization": f"Bearer {await login(client)}"}
+        latencies, errors = [], 0
+
+        async def worker():
+            nonlocal errors
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code >= 400
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    print(f"{len(latencies)} requests, {errors} errors, {len(latencies) / elapsed:.0f} req/s")
+    for pct in (50, 95, 99):
+        print(f"p{pct}: {percentile(latencies, pct) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/expenses/")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.path, args.clients, args.requests_per_client))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Shared fixtures. The tests run against a throwaway SQLite database.
+
+The settings are set before anything under ``app`` is imported, and the
+database URL is overridden even when one is configured, so the tests never
+touch a real database.
+
+Settings that ``app`` reads when it is imported, such as SHARD_URLS, cannot
+change within one test session. A module that needs them is marked with
+``pytestmark = pytest.mark.isolated(**settings)``. In place of its tests the
+session then collects one item, which runs the module in a fresh interpreter
+with ``settings`` in the environment and a database of its own in
+EXPENSE_TEST_DB. ``{tmp_path}`` in a setting is replaced by a temporary
+directory for that run.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Set in the interpreter running an ``isolated`` module, whose tests then run as usual
+ISOLATED_RUN = os.getenv("EXPENSE_ISOLATED_RUN") == "1"
+TEST_DB_PATH = os.getenv("EXPENSE_TEST_DB") or os.path.join(tempfile.gettempdir(), "expense_tests.db")
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{TEST_DB_PATH}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from contextlib import contextmanager  # noqa: E402
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import database, response_cache  # noqa: E402
+from app.config.security import create_access_token  # noqa: E402
+from app.main import create_app  # noqa: E402
+from tests.helpers import count_queries, seed  # noqa: E402
+
+
+class IsolatedRunFailed(Exception):
+    """The output of a failed isolated run."""
+
+
+class IsolatedRun(pytest.Item):
+    """Runs the tests of an ``isolated`` module with pytest in a new interpreter."""
+
+    def __init__(self, *, settings: dict, **kwargs):
+        super().__init__(**kwargs)
+        self.settings = settings
+
+    def runtest(self):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            env = {
+                **os.environ,
+                "EXPENSE_ISOLATED_RUN": "1",
+                "EXPENSE_TEST_DB": os.path.join(tmp_path, "primary.db"),
+                **{name: value.format(tmp_path=tmp_path) for name, value in self.settings.items()},
+            }
+            result = subprocess.run(
+                [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", str(self.path)],
+                cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+            )
+        if result.returncode != 0:
+            raise IsolatedRunFailed(result.stdout)
+
+    def repr_failure(self, excinfo):
+        if isinstance(excinfo.value, IsolatedRunFailed):
+            return str(excinfo.value)
+        return super().repr_failure(excinfo)
+
+    def reportinfo(self):
+        return self.path, None, self.name
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "isolated(**settings): run the module in a fresh interpreter with these settings")
+
+
+def pytest_collection_modifyitems(config, items):
+    if ISOLATED_RUN:
+        return
+    kept, runs = [], {}
+    for item in items:
+        marker = item.get_closest_marker("isolated")
+        if marker is None:
+            kept.append(item)
+            continue
+        module = item.getparent(pytest.Module)
+        if module not in runs:
+            runs[module] = IsolatedRun.from_parent(module, name="in_a_fresh_interpreter", settings=marker.kwargs)
+            kept.append(runs[module])
+    items[:] = kept
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(create_app()) as client:
+        yield client
+
+
+@pytest.fixture
+def db():
+    """A session on the test database, closed after the test."""
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="session")
+def auth_headers():
+    """Headers authenticating as user 1."""
+    return {"Authorization": f"Bearer {create_access_token({'sub': '1'})}"}
+
+
+def reset_users():
+    seed(3, 0)
+    response_cache.backend.clear()
+
+
+@pytest.fixture(scope="module")
+def users(client):
+    """A database emptied for the module, holding users 1 to 3 and nothing else."""
+    reset_users()
+
+
+@pytest.fixture
+def fresh_users(client):
+    """Like ``users``, but emptied again for every test."""
+    reset_users()
+
+
+@pytest.fixture
+def assert_selects():
+    """``with assert_selects(n):`` fails unless exactly ``n`` SELECTs run inside the block, on either app engine."""
+    @contextmanager
+    def check(expected: int, *binds):
+        with count_queries(*binds) as counter:
+            yield counter
+        assert counter["selects"] == expected, f"expected {expected} SELECTs, got {counter['selects']}"
+
+    return check
@@ -0,0 +1,85 @@
+"""Database helpers shared by the tests and the benchmark scripts.
+
+Both point ``app`` at a throwaway database before importing this module: the
+tests in ``conftest.py``, the benchmarks in ``benchmarks/common.py``.
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+
+from sqlalchemy import event, insert
+
+from app import models
+from app.config.security import hash_password
+from app.database import Base, SessionLocal, async_engine, engine
+from app.services.ledger_service import rebuild_ledger
+from app.services.rollup_service import backfill_rollups
+
+SEED_PASSWORD = "benchmark-password"
+
+
+def reset_database():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+
+def seed(users: int, expenses_per_user: int, participants: int = 2, batch_size: int = 10_000):
+    """Insert ``users`` users, each paying ``expenses_per_user`` equal-split expenses.
+
+    Every user can log in as ``user<id>@example.com`` with SEED_PASSWORD.
+    """
+    reset_database()
+    hashed_password = hash_password(SEED_PASSWORD)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": i, "email": f"user{i}@example.com", "name": f"User {i}",
+             "mobile_number": "0000000000", "hashed_password": hashed_password}
+            for i in range(1, users + 1)
+        ])
+
+        expense_id = 0
+        expenses, details = [], []
+        share = Decimal("100.00") / participants
+        for user_id in range(1, users + 1):
+            for _ in range(expenses_per_user):
+                expense_id += 1
+                expenses.append({"id": expense_id, "user_id": user_id, "amount": Decimal("100.00"),
+                                 "method": "equal", "description": f"Expense {expense_id}"})
+                for offset in range(participants):
+                    details.append({"expense_id": expense_id, "user_id": (user_id + offset - 1) % users + 1,
+                                    "amount_owed": share, "percentage": Decimal(100) / participants})
+            if len(expenses) >= batch_size:
+                conn.execute(insert(models.Expense), expenses)
+                conn.execute(insert(models.ExpenseDetail), details)
+                expenses, details = [], []
+        if expenses:
+            conn.execute(insert(models.Expense), expenses)
+            conn.execute(insert(models.ExpenseDetail), details)
+
+    db = SessionLocal()
+    try:
+        rebuild_ledger(db)
+        backfill_rollups(db)
+    finally:
+        db.close()
+
+
+@contextmanager
+def count_queries(*binds):
+    """Count the SQL statements executed on ``binds`` (default: both app engines) inside the block.
+
+    ``queries`` counts every statement and ``selects`` only SELECTs.
+    """
+    binds = binds or (engine, async_engine.sync_engine)
+    counter = {"queries": 0, "selects": 0}
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        counter["queries"] += 1
+        counter["selects"] += statement.lstrip().upper().startswith("SELECT")
+
+    for bind in binds:
+        event.listen(bind, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        for bind in binds:
+            event.remove(bind, "before_cursor_execute", before_cursor_execute)
@@ -0,0 +1,64 @@
+"""The amounts migration converts both ways and finishes a run that stopped part way."""
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app.migrations.amounts_to_cents import migrate
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'amounts.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE expenses (id INTEGER PRIMARY KEY, amount DECIMAL(10, 2) NOT NULL)"))
+        conn.execute(text("CREATE TABLE expense_details (id INTEGER PRIMARY KEY, amount_owed DECIMAL(10, 2))"))
+        conn.execute(text("INSERT INTO expenses (id, amount) VALUES (1, 12.34), (2, 0.05)"))
+        conn.execute(text("INSERT INTO expense_details (id, amount_owed) VALUES (1, 6.17), (2, NULL)"))
+    yield engine
+    engine.dispose()
+
+
+def amounts(engine):
+    with engine.connect() as conn:
+        return {
+            "expenses": conn.execute(text("SELECT amount FROM expenses ORDER BY id")).scalars().all(),
+            "expense_details": conn.execute(text("SELECT amount_owed FROM expense_details ORDER BY id")).scalars().all(),
+        }
+
+
+def column_names(engine, table):
+    return [column["name"] for column in inspect(engine).get_columns(table)]
+
+
+def test_converts_to_cents_and_back(engine):
+    assert migrate(engine) == 2
+    assert amounts(engine) == {"expenses": [1234, 5], "expense_details": [617, None]}
+    assert migrate(engine) == 0
+
+    assert migrate(engine, reverse=True) == 2
+    converted = amounts(engine)
+    assert [Decimal(str(value)) for value in converted["expenses"]] == [Decimal("12.34"), Decimal("0.05")]
+    assert converted["expense_details"][1] is None
+
+
+def test_a_copy_next_to_its_original_is_made_again(engine):
+    # Stopped after ADD COLUMN, before the copy was filled in
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE expenses ADD COLUMN amount_migrating BIGINT"))
+
+    assert migrate(engine) == 2
+    assert amounts(engine)["expenses"] == [1234, 5]
+    assert column_names(engine, "expenses") == ["id", "amount"]
+
+
+def test_a_copy_whose_original_was_dropped_is_renamed_into_place(engine):
+    # Stopped after DROP COLUMN, before the rename
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE expenses ADD COLUMN amount_migrating BIGINT"))
+        conn.execute(text("UPDATE expenses SET amount_migrating = ROUND(amount * 100)"))
+        conn.execute(text("ALTER TABLE expenses DROP COLUMN amount"))
+
+    assert migrate(engine) == 2
+    assert amounts(engine)["expenses"] == [1234, 5]
+    assert column_names(engine, "expenses") == ["id", "amount"]
@@ -0,0 +1,224 @@
+"""The expense archive, against a SQLite database and a temporary ARCHIVE_DIR.
+
+A year of expenses is written through the API and spread over the last twelve
+months, then every month before the three hot ones is archived. The balance
+sheet, the CSV downloads, settlements, spend analytics, the paged and streamed
+listings and the detail lookups must answer exactly as they did before
+archiving; only the hot months may be left in the tables, and the ledger must
+still match.
+
+The archive is configured when ``app`` is imported, so the test session runs
+this module again in a fresh interpreter with ARCHIVE_DIR set.
+"""
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+from app import archive, crud, database, models, response_cache, schemas
+from app.services import ledger_service, report_service, rollup_service
+from app.services.expense_stream import iter_expenses_ndjson
+
+USERS = 8
+MONTHS = 12
+HOT_MONTHS = 3
+PER_USER_MONTH = 6
+NDJSON = {"Accept": "application/x-ndjson"}
+
+pytestmark = pytest.mark.isolated(
+    ARCHIVE_DIR="{tmp_path}/archive",
+    ARCHIVE_HOT_MONTHS=str(HOT_MONTHS),
+    ARCHIVE_REFRESH_SECONDS="0.1",
+)
+
+
+def expense(user_id: int, n: int) -> dict:
+    partner = user_id % USERS + 1
+    if n % 3 == 0:
+        return {"user_id": user_id, "amount": f"{30 + n}.00", "method": "exact", "description": f"Rent {n}",
+                "details": [{"user_id": user_id, "amount_owed": "10.00"}, {"user_id": partner, "amount_owed": f"{20 + n}.00"}]}
+    if n % 3 == 1:
+        return {"user_id": user_id, "amount": "50.00", "method": "percentage", "description": f"Trip {n}",
+                "details": [{"user_id": user_id, "percentage": "40"}, {"user_id": partner, "percentage": "60"}]}
+    return {"user_id": user_id, "amount": f"{n}.25", "method": "equal", "description": f"Lunch {n} " + "x" * (n % 7),
+            "details": [{"user_id": user_id}, {"user_id": partner}]}
+
+
+def spread_over_months(db) -> list:
+    """Move every expense into one of the last MONTHS months, as if written over a year."""
+    now = datetime.utcnow()
+    this_month = archive.month_start(now)
+    ids = db.execute(select(models.Expense.id).order_by(models.Expense.id)).scalars().all()
+    for expense_id in ids:
+        month = archive.add_months(this_month, -(expense_id % MONTHS))
+        when = month + timedelta(days=expense_id % 27, seconds=expense_id, microseconds=expense_id * 7)
+        when = min(when, now - timedelta(seconds=expense_id))  # Nothing in the future
+        db.execute(update(models.Expense).where(models.Expense.id == expense_id).values(date=when))
+    db.commit()
+    rollup_service.backfill_rollups(db)
+    return ids
+
+
+def paged(client, url: str, limit: int, headers=None, **params) -> list:
+    items, cursor = [], None
+    while True:
+        query = {"limit": limit, **params, **({"cursor": cursor} if cursor else {})}
+        response = client.get(url, params=query, headers=headers)
+        response.raise_for_status()
+        items += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return items
+
+
+def listed(db, limit: int) -> list:
+    ids, cursor = [], None
+    while True:
+        page, cursor = crud.list_expenses(db, schemas.ExpenseQuery(limit=limit, cursor=cursor))
+        ids += [item.id for item in page]
+        if cursor is None:
+            return ids
+
+
+def streamed(query: schemas.ExpenseQuery) -> bytes:
+    current = archive.current()
+    return b"".join(iter_expenses_ndjson(crud.expense_rows_query(query, archived=current),
+                                         archived_rows=crud.archived_expense_rows(current, query)))
+
+
+def snapshot(client, headers: dict, old_id: int, since: str) -> dict:
+    response_cache.backend.clear()
+    db = database.SessionLocal()
+    try:
+        return {
+            "balance sheet": client.get("/balance_sheet/").json(),
+            "balance sheet CSV": client.get("/download_balance_sheet/").text,
+            "settlements": client.get("/settlements/", headers=headers).json(),
+            "spend by user and month": client.get(
+                "/analytics/spend", params={"interval": "month", "date_from": since}, headers=headers).json(),
+            "spend by method and week": client.get(
+                "/analytics/spend", params={"group_by": "method", "interval": "week", "date_from": since},
+                headers=headers).json(),
+            "paged listing of everyone": listed(db, 7),
+            "paged listing of a user, filtered": paged(
+                client, "/expenses/user/1", 4, headers, min_amount="10", method="equal"),
+            "paged listing of the current user (async)": paged(client, "/expenses/", 9, headers),
+            "paged detailed listing": paged(client, "/expenses/detailed", 5, headers),
+            "NDJSON stream of everyone": streamed(schemas.ExpenseQuery()),
+            "NDJSON stream of everyone before a cursor": streamed(schemas.ExpenseQuery(
+                cursor=crud.encode_cursor(crud.get_expense_with_details(db, old_id + MONTHS)))),
+            "NDJSON stream of the current user": client.get("/expenses/", headers={**NDJSON, **headers}).text,
+            "NDJSON stream from a date": client.get(
+                "/expenses/user/1", params={"date_from": since}, headers={**NDJSON, **headers}).text,
+            "old expense by id": client.get(f"/expenses/{old_id}", headers=headers).json(),
+            "expenses report CSV": "".join(report_service.iter_expenses_csv(db)),
+            "legacy lists": (sorted(item.id for item in crud.get_all_expenses(db)),
+                             sorted(item.id for item in crud.get_user_expenses(db, 1))),
+        }
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def before(client, auth_headers) -> dict:
+    """A year of expenses, and the answers the application gave before archiving."""
+    database.Base.metadata.create_all(database.engine)
+    for user_id in range(1, USERS + 1):
+        client.post("/users/", json={"email": f"user{user_id}@example.com", "name": f"User {user_id}",
+                                     "mobile_number": "0", "password": "pw"}).raise_for_status()
+    items = [expense(user_id, n) for user_id in range(1, USERS + 1) for n in range(MONTHS * PER_USER_MONTH)]
+    assert client.post("/expenses/bulk", json=items).json() == {"created": len(items), "errors": []}
+
+    db = database.SessionLocal()
+    try:
+        ids = spread_over_months(db)
+        per_month = Counter(f"{when:%Y-%m}" for when in db.execute(select(models.Expense.date)).scalars())
+    finally:
+        db.close()
+    since = archive.add_months(archive.month_start(datetime.utcnow()), -MONTHS).date().isoformat()
+    old_id = next(expense_id for expense_id in ids if expense_id % MONTHS == MONTHS - 1)
+    return {"ids": ids, "per month": per_month, "since": since, "old id": old_id,
+            "answers": snapshot(client, auth_headers, old_id, since)}
+
+
+@pytest.fixture(scope="module")
+def archived(before) -> int:
+    months = archive.run(log=lambda message: None)
+    time.sleep(0.2)  # Let this process notice the new manifest
+    return months
+
+
+def test_old_expense_is_found_before_archiving(before):
+    assert before["answers"]["old expense by id"].get("id") == before["old id"]
+
+
+def test_every_month_before_the_hot_window_is_archived(archived):
+    assert archived == MONTHS - HOT_MONTHS - 1
+
+
+def test_manifest_lists_one_segment_per_archived_month(before, archived):
+    manifest = archive.read_manifest()
+    cutoff = archive.add_months(archive.month_start(datetime.utcnow()), -HOT_MONTHS)
+    assert datetime.fromisoformat(manifest["boundary"]) == cutoff
+    assert archive.current().boundary == cutoff
+    months = [entry["month"] for entry in manifest["segments"]]
+    assert months == sorted(set(months)) and len(months) == archived
+    for entry in manifest["segments"]:
+        assert os.path.exists(os.path.join(archive.ARCHIVE_DIR, entry["file"]))
+        assert entry["rows"] == before["per month"][entry["month"]]
+
+
+def test_segments_hold_the_archived_rows(archived):
+    segments = archive.current().segments
+    manifest = archive.read_manifest()
+    assert [segment.rows for segment in segments] == [entry["rows"] for entry in manifest["segments"]]
+    assert all(segment.size > 0 for segment in segments)
+
+
+def test_only_the_hot_months_are_left_in_the_tables(before, archived):
+    db = database.SessionLocal()
+    try:
+        hot, oldest = db.execute(select(func.count(), func.min(models.Expense.date)).select_from(models.Expense)).one()
+    finally:
+        db.close()
+    assert oldest >= archive.current().boundary
+    assert hot + sum(segment.rows for segment in archive.current().segments) == len(before["ids"])
+
+
+def test_archived_details_are_deleted_with_their_expenses(archived):
+    db = database.SessionLocal()
+    try:
+        orphans = db.execute(select(func.count()).select_from(models.ExpenseDetail).where(
+            models.ExpenseDetail.expense_id.notin_(select(models.Expense.id)))).scalar()
+    finally:
+        db.close()
+    assert orphans == 0
+
+
+def test_ledger_matches_the_hot_rows_and_the_archive(archived):
+    db = database.SessionLocal()
+    try:
+        rollup_service.backfill_rollups(db)
+        assert ledger_service.verify_ledger(db) == []
+    finally:
+        db.close()
+
+
+def test_reads_answer_as_before_archiving(client, auth_headers, before, archived):
+    after = snapshot(client, auth_headers, before["old id"], before["since"])
+    assert [name for name in before["answers"] if after[name] != before["answers"][name]] == []
+    assert len(after["paged listing of everyone"]) == len(before["ids"])
+
+
+def test_new_expenses_still_land_in_the_hot_tables(client, auth_headers, archived):
+    created = client.post("/expenses/", json=expense(1, 1)).json()
+    response_cache.backend.clear()
+    newest = client.get("/expenses/", params={"limit": 1}, headers=auth_headers).json()
+    assert newest[0]["id"] == created["id"]
+
+
+def test_a_second_run_finds_nothing_to_archive(archived):
+    assert archive.run(log=lambda message: None) == 0
@@ -0,0 +1,50 @@
+"""A bulk chunk that fails as a whole is retried item by item, keeping the items that succeed."""
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from app import crud, models
+from app.services import ledger_service
+
+BROKEN = "Broken"
+
+
+def expense(payer: int, amount: str, description: str = "Groceries") -> dict:
+    return {"user_id": payer, "amount": amount, "method": "equal", "description": description,
+            "details": [{"user_id": 1}, {"user_id": 2}]}
+
+
+@pytest.fixture
+def failing_item(monkeypatch):
+    """Make inserting the details of any expense described as BROKEN fail, as a constraint violation would."""
+    insert_details = crud._insert_details
+
+    def failing(db, expenses):
+        if any(db_expense.description == BROKEN for db_expense, _ in expenses):
+            raise IntegrityError("INSERT INTO expense_details", {}, Exception("constraint failed"))
+        insert_details(db, expenses)
+
+    monkeypatch.setattr(crud, "_insert_details", failing)
+
+
+def test_a_failed_item_is_reported_and_the_rest_are_kept(client, fresh_users, failing_item, db):
+    before = db.scalar(select(func.max(models.Expense.id))) or 0
+
+    response = client.post("/expenses/bulk", json=[expense(1, "10"), expense(2, "20", BROKEN), expense(2, "30")])
+
+    assert response.json() == {"created": 2, "errors": [{"index": 1, "detail": "Failed to insert expense: IntegrityError"}]}
+    created = db.execute(select(models.Expense.id, models.Expense.amount).order_by(models.Expense.id)).all()
+    # Fresh ids for the retried rows, not the ones the failed flush handed out
+    assert created == [(before + 1, Decimal("10.00")), (before + 2, Decimal("30.00"))]
+    detail_ids = db.scalars(select(models.ExpenseDetail.expense_id).distinct().order_by(models.ExpenseDetail.expense_id)).all()
+    assert detail_ids == [before + 1, before + 2]
+
+
+def test_the_ledger_holds_only_the_kept_items(client, fresh_users, failing_item, db):
+    client.post("/expenses/bulk", json=[expense(1, "10"), expense(2, "20", BROKEN), expense(2, "30")])
+
+    balances = {row.user_id: (row.total_paid, row.total_owed) for row in db.query(models.UserBalance)}
+    assert balances == {1: (Decimal("10.00"), Decimal("20.00")), 2: (Decimal("30.00"), Decimal("20.00"))}
+    assert ledger_service.verify_ledger(db) == []
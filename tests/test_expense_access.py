@@ -0,0 +1,39 @@
+"""Users see their own expenses and the ones they take part in, and nobody else's."""
+import pytest
+
+
+def expense(payer: int, participants: list) -> dict:
+    return {"user_id": payer, "amount": "20", "method": "equal", "description": "Lunch",
+            "details": [{"user_id": user_id} for user_id in participants]}
+
+
+def test_another_users_listing_is_forbidden(client, auth_headers, users):
+    response = client.get("/expenses/user/2", headers=auth_headers)
+    assert response.status_code == 403
+
+
+def test_own_listing_is_allowed(client, auth_headers, users):
+    assert client.get("/expenses/user/1", headers=auth_headers).status_code == 200
+
+
+def test_an_expense_is_visible_to_its_payer_and_participants(client, auth_headers, users):
+    paid = client.post("/expenses/", json=expense(1, [2, 3])).json()
+    shared = client.post("/expenses/", json=expense(2, [1, 2])).json()
+    assert client.get(f"/expenses/{paid['id']}", headers=auth_headers).status_code == 200
+    assert client.get(f"/expenses/{shared['id']}", headers=auth_headers).status_code == 200
+
+
+def test_an_expense_of_other_users_is_not_found(client, auth_headers, users):
+    other = client.post("/expenses/", json=expense(2, [2, 3])).json()
+    assert client.get(f"/expenses/{other['id']}", headers=auth_headers).status_code == 404
+
+
+@pytest.mark.parametrize("method, url", [
+    ("GET", "/settlements/"),
+    ("GET", "/analytics/spend"),
+    ("POST", "/reports"),
+    ("GET", "/reports/0"),
+])
+def test_reporting_endpoints_need_a_logged_in_user(client, method, url):
+    response = client.request(method, url, json={"kind": "expenses"} if method == "POST" else None)
+    assert response.status_code == 401
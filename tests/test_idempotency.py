@@ -0,0 +1,48 @@
+"""POST /expenses/ with an Idempotency-Key creates the expense at most once."""
+from sqlalchemy import func, select
+
+from app import database, models
+
+EXPENSE = {"user_id": 1, "amount": "30", "method": "equal", "description": "Taxi",
+           "details": [{"user_id": 1}, {"user_id": 2}]}
+
+
+def rows(model) -> int:
+    db = database.SessionLocal()
+    try:
+        return db.execute(select(func.count()).select_from(model)).scalar()
+    finally:
+        db.close()
+
+
+def test_a_retry_with_the_same_key_returns_the_stored_response(client, users):
+    headers = {"Idempotency-Key": "retry-1"}
+    created = client.post("/expenses/", json=EXPENSE, headers=headers)
+    assert created.status_code == 200, created.text
+    stored = rows(models.Expense), rows(models.ExpenseDetail), rows(models.IdempotencyKey)
+
+    retried = client.post("/expenses/", json=EXPENSE, headers=headers)
+
+    assert retried.status_code == 200
+    assert retried.json() == created.json()
+    assert (rows(models.Expense), rows(models.ExpenseDetail), rows(models.IdempotencyKey)) == stored
+
+
+def test_a_key_reused_with_a_different_body_is_rejected(client, users):
+    headers = {"Idempotency-Key": "reused-1"}
+    client.post("/expenses/", json=EXPENSE, headers=headers).raise_for_status()
+    expenses = rows(models.Expense)
+
+    reused = client.post("/expenses/", json={**EXPENSE, "amount": "31"}, headers=headers)
+
+    assert reused.status_code == 422
+    assert "different request" in reused.json()["detail"]
+    assert rows(models.Expense) == expenses
+
+
+def test_requests_without_a_key_are_not_deduplicated(client, users):
+    expenses = rows(models.Expense)
+    first = client.post("/expenses/", json=EXPENSE).json()
+    second = client.post("/expenses/", json=EXPENSE).json()
+    assert first["id"] != second["id"]
+    assert rows(models.Expense) == expenses + 2
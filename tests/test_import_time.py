@@ -0,0 +1,63 @@
+"""Importing the app stays cheap, and modules meant to load on first use do not load at startup.
+
+Each run imports the frameworks first, then ``app.main``, under
+``python -X importtime``. The budget is checked against the cumulative times
+the interpreter reports for the top-level ``app`` imports, so it covers the
+application's own modules and anything new they pull in. It leaves out FastAPI
+and SQLAlchemy, whose import time varies far more from run to run than the
+app's does.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Imported before the timer starts; the app cannot start faster than these
+FRAMEWORK_MODULES = [
+    "fastapi", "fastapi.concurrency", "fastapi.responses", "fastapi.security",
+    "pydantic", "sqlalchemy", "sqlalchemy.orm", "sqlalchemy.ext.asyncio", "dotenv",
+]
+# Loaded lazily by the code that needs them, never by importing the app
+DEFERRED_MODULES = ["jose", "passlib", "bcrypt", "cryptography", "pymysql", "numpy"]
+# The app's own import takes about 100 ms here; the budget leaves room for slower machines
+APP_IMPORT_BUDGET_MS = 500
+RUNS = 3
+
+PROBE = f"import {', '.join(FRAMEWORK_MODULES)}; import app.main"
+
+
+def import_app():
+    """Run the probe under ``-X importtime``. Returns the app's import time in ms and every module it imported.
+
+    Each ``import time: self [us] | cumulative [us] | name`` line is one module;
+    nested imports have their name indented by two more spaces than their parent.
+    """
+    # No database settings: importing must not need them
+    env = {key: value for key, value in os.environ.items() if key != "SQLALCHEMY_DATABASE_URL"}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE],
+                            capture_output=True, text=True, env=env, cwd=ROOT, check=True)
+
+    app_us, modules = 0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        module = name.strip()
+        modules.append(module)
+        if name.startswith("  "):
+            continue  # Counted in its parent's cumulative time
+        if module == "app" or module.startswith("app."):
+            app_us += int(cumulative)
+    return app_us / 1000, modules
+
+
+def test_app_import_time_and_deferred_modules():
+    runs = [import_app() for _ in range(RUNS)]
+    best_ms = min(elapsed for elapsed, _ in runs)
+    loaded = sorted({name for _, names in runs for name in names if name.split(".")[0] in DEFERRED_MODULES})
+
+    assert not loaded, f"imported at startup: {', '.join(loaded)}"
+    assert best_ms <= APP_IMPORT_BUDGET_MS, f"the app imports took {best_ms:.0f} ms cumulative"
@@ -0,0 +1,72 @@
+"""The balance ledger stays equal to the totals recomputed from the raw tables."""
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import delete, update
+
+from app import database, models
+from app.schemas import ExpenseCreate
+from app.services import expense_service, ledger_service
+
+
+def expense(payer: int, amount: str, participants: list) -> dict:
+    return {"user_id": payer, "amount": amount, "method": "equal", "description": "Groceries",
+            "details": [{"user_id": user_id} for user_id in participants]}
+
+
+@pytest.fixture
+def recorded(client, fresh_users):
+    """Expenses written through every create path: single, bulk and the expense service, for this test alone."""
+    client.post("/expenses/", json=expense(1, "30", [1, 2, 3])).raise_for_status()
+    bulk = client.post("/expenses/bulk", json=[expense(2, "10", [2, 3]), expense(3, "0.10", [1, 2, 3])]).json()
+    assert bulk == {"created": 2, "errors": []}
+    db = database.SessionLocal()
+    try:
+        expense_service.create_expense(db, ExpenseCreate(**expense(1, "5", [1, 3])))
+    finally:
+        db.close()
+
+
+def test_ledger_has_no_drift_after_creating_expenses(recorded, db):
+    assert ledger_service.verify_ledger(db) == []
+
+
+def test_ledger_holds_the_expected_totals(recorded, db):
+    balances = {row.user_id: (row.total_paid, row.total_owed, row.net) for row in db.query(models.UserBalance)}
+    # 0.10 three ways is 0.04, 0.03, 0.03
+    assert balances == {
+        1: (Decimal("35.00"), Decimal("12.54"), Decimal("22.46")),
+        2: (Decimal("10.00"), Decimal("15.03"), Decimal("-5.03")),
+        3: (Decimal("0.10"), Decimal("17.53"), Decimal("-17.43")),
+    }
+
+
+def test_verify_reports_an_expense_changed_outside_the_ledger(recorded, db):
+    expense_id = db.query(models.Expense.id).filter(models.Expense.user_id == 2).scalar()
+    db.execute(update(models.Expense).where(models.Expense.id == expense_id).values(amount=Decimal("12.00")))
+    db.commit()
+
+    drift = ledger_service.verify_ledger(db)
+
+    assert [(row.user_id, row.stored_paid, row.expected_paid) for row in drift] == [(2, Decimal("10.00"), Decimal("12.00"))]
+
+
+def test_verify_reports_an_expense_deleted_outside_the_ledger(recorded, db):
+    expense_id = db.query(models.Expense.id).filter(models.Expense.user_id == 3).scalar()
+    db.execute(delete(models.ExpenseDetail).where(models.ExpenseDetail.expense_id == expense_id))
+    db.execute(delete(models.Expense).where(models.Expense.id == expense_id))
+    db.commit()
+
+    drift = {row.user_id for row in ledger_service.verify_ledger(db)}
+
+    assert drift == {1, 2, 3}
+
+
+def test_rebuild_removes_the_drift(recorded, db):
+    db.execute(update(models.UserBalance).where(models.UserBalance.user_id == 1).values(total_paid=Decimal("1.00")))
+    db.commit()
+    assert ledger_service.verify_ledger(db) != []
+
+    ledger_service.rebuild_ledger(db)
+
+    assert ledger_service.verify_ledger(db) == []
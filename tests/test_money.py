@@ -0,0 +1,52 @@
+"""Amounts are rounded to cents, and amounts that cannot be are rejected as bad input."""
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import text
+
+from app import database, money
+from app.money import to_cents, to_money
+from app.schemas import ExpenseCreate
+from app.services import expense_service, ledger_service
+
+TOO_MANY_DIGITS = "1e30"  # Needs more digits than the default decimal context, once quantized to cents
+
+
+@pytest.mark.parametrize("value, expected", [("1.005", "1.01"), ("2.004", "2.00"), (3, "3.00"), ("-0.015", "-0.02")])
+def test_to_money_rounds_half_up_to_cents(value, expected):
+    assert to_money(value) == Decimal(expected)
+
+
+@pytest.mark.parametrize("value", [TOO_MANY_DIGITS, "Infinity", "ten"])
+def test_amounts_that_cannot_be_rounded_raise_value_error(value):
+    with pytest.raises(ValueError):
+        to_cents(value)
+
+
+@pytest.mark.parametrize("field", ["amount", "percentage"])
+def test_creating_an_expense_with_too_many_digits_is_a_client_error(client, field):
+    expense = {"user_id": 1, "amount": "10", "method": "percentage", "description": "Huge",
+               "details": [{"user_id": 1, "percentage": "100"}]}
+    if field == "amount":
+        expense["amount"] = TOO_MANY_DIGITS
+    else:
+        expense["details"][0]["percentage"] = TOO_MANY_DIGITS
+
+    response = client.post("/expenses/", json=expense)
+
+    assert response.status_code in (400, 422), response.text
+
+
+def test_the_expense_service_stores_the_amount_in_cents(client, users):
+    db = database.SessionLocal()
+    try:
+        created = expense_service.create_expense(db, ExpenseCreate(
+            user_id=1, amount="10.005", method="equal", description="Rounded", details=[{"user_id": 1}, {"user_id": 2}]))
+
+        # Read back without the column type, which would round on the way out
+        stored = db.execute(text("SELECT amount FROM expenses WHERE id = :id"), {"id": created.id}).scalar()
+        assert Decimal(str(stored)) == (1001 if money.AMOUNT_STORAGE == "cents" else Decimal("10.01"))
+        assert sum(detail.amount_owed for detail in created.details) == Decimal("10.01")
+        assert ledger_service.verify_ledger(db) == []
+    finally:
+        db.close()
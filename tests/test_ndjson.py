@@ -0,0 +1,89 @@
+"""NDJSON on the expense listings (Accept) and on bulk creation (Content-Type)."""
+import json
+
+import pytest
+
+from app.ndjson import NDJSON_MEDIA_TYPE, NDJSON_MEDIA_TYPES, wants_ndjson
+
+LISTINGS = ["/expenses/", "/expenses/user/1"]
+
+
+def expense(n: int) -> dict:
+    return {"user_id": 1, "amount": f"{n}.00", "method": "equal", "description": f"Expense {n}",
+            "details": [{"user_id": 1}, {"user_id": 2}]}
+
+
+def lines(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.fixture(scope="module")
+def listed(client, users):
+    assert client.post("/expenses/bulk", json=[expense(n) for n in range(1, 8)]).json()["created"] == 7
+
+
+@pytest.mark.parametrize("url", LISTINGS)
+def test_listings_default_to_a_json_page(client, auth_headers, listed, url):
+    response = client.get(url, params={"limit": 3}, headers=auth_headers)
+    assert response.headers["content-type"] == "application/json"
+    assert len(response.json()) == 3
+    assert "X-Next-Cursor" in response.headers
+
+
+@pytest.mark.parametrize("url", LISTINGS)
+def test_accepting_ndjson_streams_every_expense(client, auth_headers, listed, url):
+    page = client.get(url, params={"limit": 50}, headers=auth_headers).json()
+
+    # limit does not apply to the stream
+    streamed = client.get(url, params={"limit": 3}, headers={**auth_headers, "Accept": NDJSON_MEDIA_TYPE})
+
+    assert streamed.headers["content-type"] == NDJSON_MEDIA_TYPE
+    assert [line["id"] for line in lines(streamed)] == [item["id"] for item in page]
+    assert {line["description"] for line in lines(streamed)} == {f"Expense {n}" for n in range(1, 8)}
+
+
+def test_ndjson_is_picked_out_of_an_accept_list(client, auth_headers, listed):
+    response = client.get("/expenses/", headers={**auth_headers, "Accept": f"application/json;q=0.5, {NDJSON_MEDIA_TYPE}"})
+    assert response.headers["content-type"] == NDJSON_MEDIA_TYPE
+
+
+@pytest.mark.parametrize("media_type", NDJSON_MEDIA_TYPES)
+def test_bulk_reads_ndjson_under_each_media_type(client, users, media_type):
+    body = "\n".join(json.dumps(expense(n)) for n in range(1, 4))
+
+    response = client.post("/expenses/bulk", content=body, headers={"Content-Type": f"{media_type}; charset=utf-8"})
+
+    assert response.json() == {"created": 3, "errors": []}
+
+
+def test_bulk_reports_bad_ndjson_lines_by_index(client, users):
+    body = "\n".join([json.dumps(expense(1)), "{not json", "", "[1, 2]", json.dumps(expense(2))]) + "\n"
+
+    response = client.post("/expenses/bulk", content=body, headers={"Content-Type": NDJSON_MEDIA_TYPE})
+
+    result = response.json()
+    assert result["created"] == 2
+    # Blank lines are skipped and do not count towards the index
+    assert [error["index"] for error in result["errors"]] == [1, 2]
+    assert result["errors"][0]["detail"].startswith("Invalid JSON")
+
+
+def test_bulk_rejects_an_ndjson_body_sent_as_json(client, users):
+    body = "\n".join(json.dumps(expense(n)) for n in range(1, 3))
+    response = client.post("/expenses/bulk", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (NDJSON_MEDIA_TYPE, True),
+    (f"{NDJSON_MEDIA_TYPE}; charset=utf-8", True),
+    (f"application/json;q=0.5, {NDJSON_MEDIA_TYPE}", True),
+    (f"application/json, {NDJSON_MEDIA_TYPE};q=0", False),
+    (f"application/json, {NDJSON_MEDIA_TYPE};q=0.5", False),
+    (f"{NDJSON_MEDIA_TYPE}-extended", False),
+    (f"text/{NDJSON_MEDIA_TYPE}", False),
+    ("*/*", False),
+    (None, False),
+])
+def test_accept_header_negotiation(accept, expected):
+    assert wants_ndjson(accept) is expected
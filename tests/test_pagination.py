@@ -0,0 +1,91 @@
+"""Keyset pagination of the expense listings."""
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app import crud, database, models, response_cache
+
+LISTINGS = ["/expenses/", "/expenses/user/1", "/expenses/detailed"]
+
+
+def b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def expense(n: int) -> dict:
+    return {"user_id": 1, "amount": f"{n}.00", "method": "equal", "description": f"Expense {n}",
+            "details": [{"user_id": 1}, {"user_id": 2}]}
+
+
+def page_through(client, url: str, headers: dict, limit: int, between_pages=None) -> list:
+    ids, cursor = [], None
+    while True:
+        response = client.get(url, params={"limit": limit, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert response.status_code == 200, response.text
+        ids += [item["id"] for item in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids
+        if between_pages is not None:
+            between_pages()
+
+
+@pytest.fixture(scope="module")
+def newest_first(client, users) -> list:
+    """Ids of user 1's expenses, newest first; groups of three share a date, so ties are broken by id."""
+    ids = [client.post("/expenses/", json=expense(n)).json()["id"] for n in range(1, 12)]
+    start = datetime(2024, 5, 1, 12, 0)
+    db = database.SessionLocal()
+    try:
+        for n, expense_id in enumerate(ids):
+            db.execute(update(models.Expense).where(models.Expense.id == expense_id)
+                       .values(date=start + timedelta(hours=n // 3)))
+        db.commit()
+    finally:
+        db.close()
+    response_cache.backend.clear()
+    return sorted(ids, key=lambda expense_id: (ids.index(expense_id) // 3, expense_id), reverse=True)
+
+
+def test_a_cursor_decodes_to_the_date_and_id_it_encodes():
+    expense = models.Expense(id=42, date=datetime(2024, 5, 1, 12, 30, 15, 123456))
+    assert crud.decode_cursor(crud.encode_cursor(expense)) == (expense.date, 42)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    b64("[]"),
+    b64('{"date": "2024-05-01", "id": 1}'),
+    b64('["yesterday", 1]'),
+    b64('["2024-05-01T00:00:00", "one"]'),
+    b64('["2024-05-01T00:00:00", 1, 2]'),
+])
+def test_a_garbage_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        crud.decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("url", LISTINGS)
+def test_a_garbage_cursor_is_a_400(client, auth_headers, users, url):
+    response = client.get(url, params={"cursor": b64('["yesterday", 1]')}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor."
+
+
+@pytest.mark.parametrize("url", LISTINGS)
+@pytest.mark.parametrize("limit", [1, 3, 4, 50])
+def test_pages_follow_date_then_id_order(client, auth_headers, newest_first, url, limit):
+    assert page_through(client, url, auth_headers, limit) == newest_first
+
+
+@pytest.mark.parametrize("url", LISTINGS)
+def test_pages_do_not_shift_when_an_expense_is_added_between_them(client, auth_headers, newest_first, url):
+    before = page_through(client, url, auth_headers, 500)
+
+    def add_newer_expense():
+        client.post("/expenses/", json=expense(99)).raise_for_status()
+
+    # Each new expense sorts before the cursor, so no page repeats or skips a row
+    assert page_through(client, url, auth_headers, 4, between_pages=add_newer_expense) == before
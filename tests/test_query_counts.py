@@ -0,0 +1,35 @@
+"""Expense reads issue a fixed number of SELECTs, however many rows they return.
+
+Each endpoint runs against a small and a large database; needing more SELECTs
+than the budget on the large one is what an N+1 lazy load looks like.
+"""
+import pytest
+
+from app import response_cache
+from tests.helpers import seed
+
+# (path, SELECTs allowed); the user is authenticated from the user cache
+ENDPOINTS = [
+    ("/expenses/detailed?limit=500", 2),
+    ("/expenses/1", 1),
+    ("/expenses/?limit=500", 1),
+    ("/expenses/user/1?limit=500", 1),
+    ("/balance_sheet/", 2),
+]
+
+
+@pytest.fixture(scope="module", params=[(5, 2), (200, 5)], ids=lambda p: f"{p[0]}-per-user-{p[1]}-participants")
+def seeded(request, client, auth_headers):
+    expenses_per_user, participants = request.param
+    seed(20, expenses_per_user, participants=participants)
+    # Warm the user cache so authentication does not count against the endpoints
+    client.get("/expenses/1", headers=auth_headers).raise_for_status()
+
+
+@pytest.mark.parametrize("path, budget", ENDPOINTS)
+def test_expense_reads_run_a_fixed_number_of_selects(seeded, client, auth_headers, assert_selects, path, budget):
+    # A response cached from another seed would need no SELECT at all
+    response_cache.backend.clear()
+    with assert_selects(budget):
+        response = client.get(path, headers=auth_headers)
+    assert response.status_code == 200, response.text
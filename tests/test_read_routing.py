@@ -0,0 +1,125 @@
+"""Read-replica routing, against two SQLite files as primary and replica.
+
+The replica is a copy of the primary taken before the last write, which is
+what a lagging replica looks like. The first entry of READ_REPLICA_URLS cannot
+be opened, so routing also has to skip an unreachable replica.
+
+The replicas are configured when ``app`` is imported, so the test session runs
+this module again in a fresh interpreter with READ_REPLICA_URLS set.
+"""
+import os
+import shutil
+import time
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from app import database
+from app.consistency import CONSISTENCY_TOKEN_HEADER
+
+UNREACHABLE_URL = "sqlite:////nonexistent-directory/replica.db"
+LAG_SECONDS = 1.0
+EXPENSE = {"user_id": 1, "amount": "90", "method": "equal", "description": "Dinner",
+           "details": [{"user_id": 1}, {"user_id": 2}]}
+
+pytestmark = pytest.mark.isolated(
+    READ_REPLICA_URLS=f"{UNREACHABLE_URL},sqlite:///{{tmp_path}}/replica.db",
+    REPLICA_MAX_LAG_SECONDS=str(LAG_SECONDS),
+)
+
+
+def balance_sheet_total(client, headers=None, query: str = "") -> str:
+    # A distinct query string is a distinct response cache entry
+    response = client.get(f"/balance_sheet/?{query}", headers=headers)
+    response.raise_for_status()
+    return response.json()[0]["total_expense"]
+
+
+@pytest.fixture(scope="module")
+def token(client) -> str:
+    """The consistency token of the one write the replica has not seen."""
+    primary_path = make_url(database.SQLALCHEMY_DATABASE_URL).database
+    replica_path = make_url(database.READ_REPLICA_URLS[1]).database
+    database.Base.metadata.create_all(database.engine)
+    for name in ("A", "B"):
+        client.post("/users/", json={"email": f"{name}@example.com", "name": name,
+                                     "mobile_number": "0", "password": "pw"}).raise_for_status()
+    client.post("/expenses/", json=EXPENSE).raise_for_status()
+    shutil.copy(primary_path, replica_path)  # The replica stops here
+
+    response = client.post("/expenses/", json=EXPENSE)
+    response.raise_for_status()
+    return response.headers.get(CONSISTENCY_TOKEN_HEADER)
+
+
+def test_a_write_returns_a_consistency_token(token):
+    assert token
+
+
+def test_a_read_without_a_token_is_served_by_the_replica(client, token):
+    assert balance_sheet_total(client) == "90.00"
+
+
+def test_an_unreachable_replica_is_skipped(client, token):
+    balance_sheet_total(client, query="skip")
+    assert database._replica_down_until.get(0, 0) > time.monotonic()
+
+
+def test_replica_responses_are_never_answered_with_304(client, token):
+    etag = client.get("/balance_sheet/", params={"etag": 1}).headers["ETag"]
+    assert etag.endswith('-replica"')
+    assert client.get("/balance_sheet/", params={"etag": 1}, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_a_read_with_a_fresh_token_is_served_by_the_primary(client, token):
+    assert balance_sheet_total(client, {CONSISTENCY_TOKEN_HEADER: token}) == "180.00"
+
+
+def test_a_token_expires_after_replica_max_lag_seconds(client, token):
+    time.sleep(LAG_SECONDS)
+    assert balance_sheet_total(client, {CONSISTENCY_TOKEN_HEADER: token}, query="expired") == "90.00"
+
+
+def test_a_malformed_token_is_ignored(client, auth_headers, token):
+    response = client.get("/settlements/", headers={**auth_headers, CONSISTENCY_TOKEN_HEADER: "not-a-token"})
+    assert response.status_code == 200
+
+
+def test_reads_fall_back_to_the_primary_when_every_replica_is_down(client, token):
+    replica_path = make_url(database.READ_REPLICA_URLS[1]).database
+    fallbacks = database.read_sessions.value(target="fallback")
+    # Take the remaining replica down too
+    database._replicas[1].dispose()
+    os.replace(replica_path, replica_path + ".down")
+    os.mkdir(replica_path)
+    try:
+        total = balance_sheet_total(client, query="fallback")
+    finally:
+        os.rmdir(replica_path)
+        os.replace(replica_path + ".down", replica_path)
+    assert total == "180.00"
+    assert database.read_sessions.value(target="fallback") == fallbacks + 1
+
+
+def test_a_cached_response_checks_out_no_connection(client, token, monkeypatch):
+    # Only the unreachable replica is down, whatever earlier tests took down
+    monkeypatch.setattr(database, "_replica_down_until", {0: float("inf")})
+    checkouts = []
+
+    def count(*args):
+        checkouts.append(1)
+
+    engines = [database.engine, *database._replicas]
+    for engine in engines:
+        event.listen(engine, "checkout", count)
+    try:
+        miss = client.get("/balance_sheet/?pooled")
+        assert miss.headers["ETag"].endswith('-replica"') and checkouts
+        checkouts.clear()
+        hit = client.get("/balance_sheet/?pooled")
+    finally:
+        for engine in engines:
+            event.remove(engine, "checkout", count)
+    assert hit.status_code == 200
+    assert checkouts == []
@@ -0,0 +1,53 @@
+"""ETags and If-None-Match on the cached listings."""
+from app import response_cache
+from app.config.security import create_access_token
+
+EXPENSE = {"user_id": 1, "amount": "12", "method": "equal", "description": "Lunch",
+           "details": [{"user_id": 1}, {"user_id": 2}]}
+
+
+def test_a_matching_if_none_match_is_a_304(client, users):
+    first = client.get("/balance_sheet/")
+    etag = first.headers["ETag"]
+
+    not_modified = client.get("/balance_sheet/", headers={"If-None-Match": f'"other", {etag}'})
+
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == etag
+
+
+def test_a_repeated_request_is_served_from_the_cache(client, users):
+    first = client.get("/balance_sheet/")
+    hits = response_cache.cache_requests.value(result="hit")
+
+    again = client.get("/balance_sheet/")
+
+    assert response_cache.cache_requests.value(result="hit") == hits + 1
+    assert (again.content, again.headers["ETag"]) == (first.content, first.headers["ETag"])
+
+
+def test_a_write_changes_the_etag(client, auth_headers, users):
+    before = client.get("/balance_sheet/")
+    listing = client.get("/expenses/user/1", headers=auth_headers)
+
+    client.post("/expenses/", json=EXPENSE).raise_for_status()
+
+    after = client.get("/balance_sheet/", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert after.json() != before.json()
+    relisted = client.get("/expenses/user/1", headers={**auth_headers, "If-None-Match": listing.headers["ETag"]})
+    assert relisted.status_code == 200
+    assert len(relisted.json()) == len(listing.json()) + 1
+
+
+def test_a_write_keeps_the_etags_of_other_payers(client, users):
+    # The payer's listing changes; user 2 only owes a share, and lists the expenses they paid
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': '2'})}"}
+    listing = client.get("/expenses/user/2", headers=headers)
+
+    client.post("/expenses/", json=EXPENSE).raise_for_status()
+
+    relisted = client.get("/expenses/user/2", headers={**headers, "If-None-Match": listing.headers["ETag"]})
+    assert relisted.status_code == 304
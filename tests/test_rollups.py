@@ -0,0 +1,79 @@
+"""The daily spend rollups hold the totals recomputed from ``expenses`` and ``expense_details``."""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import update
+
+from app import models
+from app.services import rollup_service
+
+EXPENSES = [
+    {"user_id": 1, "amount": "30", "method": "equal", "details": [{"user_id": 1}, {"user_id": 2}, {"user_id": 3}]},
+    {"user_id": 2, "amount": "10.01", "method": "shares",
+     "details": [{"user_id": 1, "shares": 2}, {"user_id": 3, "shares": 1}]},
+    {"user_id": 3, "amount": "80", "method": "percentage",
+     "details": [{"user_id": 1, "percentage": "25"}, {"user_id": 3, "percentage": "75"}]},
+    {"user_id": 1, "amount": "7.50", "method": "exact",
+     "details": [{"user_id": 2, "amount_owed": "5"}, {"user_id": 3, "amount_owed": "2.50"}]},
+]
+
+
+@pytest.fixture(scope="module")
+def recorded(client, users):
+    for expense in EXPENSES[:2]:
+        client.post("/expenses/", json={**expense, "description": "Rollup"}).raise_for_status()
+    bulk = client.post("/expenses/bulk", json=[{**expense, "description": "Rollup"} for expense in EXPENSES[2:]])
+    assert bulk.json() == {"created": 2, "errors": []}
+
+
+def recomputed(db) -> tuple:
+    """Per-user and per-method daily totals, summed straight from the expense tables."""
+    users = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+    methods = defaultdict(lambda: [Decimal(0), 0])
+    for expense in db.query(models.Expense):
+        day = expense.date.date()
+        users[day, expense.user_id][0] += expense.amount
+        users[day, expense.user_id][2] += 1
+        methods[day, expense.method][0] += expense.amount
+        methods[day, expense.method][1] += 1
+        for detail in db.query(models.ExpenseDetail).filter_by(expense_id=expense.id):
+            users[day, detail.user_id][1] += detail.amount_owed
+    return ({key: tuple(totals) for key, totals in users.items()},
+            {key: tuple(totals) for key, totals in methods.items()})
+
+
+def stored(db) -> tuple:
+    return ({(row.day, row.user_id): (row.paid, row.owed, row.expense_count) for row in db.query(models.DailyUserSpend)},
+            {(row.day, row.method): (row.amount, row.expense_count) for row in db.query(models.DailyMethodSpend)})
+
+
+def test_rollups_written_with_each_expense_match_a_recomputation(recorded, db):
+    assert stored(db) == recomputed(db)
+
+
+def test_backfill_rebuilds_the_rollups_across_days(recorded, db):
+    # Spread the expenses over four days, behind the rollups' back
+    today = datetime.utcnow().replace(hour=12)
+    for n, (expense_id,) in enumerate(db.query(models.Expense.id).order_by(models.Expense.id)):
+        db.execute(update(models.Expense).where(models.Expense.id == expense_id).values(date=today - timedelta(days=n)))
+    db.commit()
+    assert stored(db) != recomputed(db)
+
+    assert rollup_service.backfill_rollups(db, chunk_size=3) == len(EXPENSES)
+
+    assert stored(db) == recomputed(db)
+
+
+def test_spend_sums_the_days_of_each_period(recorded, db):
+    _, methods = recomputed(db)
+    first, last = min(day for day, _ in methods), max(day for day, _ in methods)
+
+    buckets = rollup_service.spend(db, group_by="method", interval="day", date_from=first, date_to=last)
+    assert {(bucket["period_start"], bucket["method"]): (bucket["amount"], bucket["expense_count"])
+            for bucket in buckets} == methods
+
+    total = rollup_service.spend(db, group_by="user", interval="month", date_from=first, date_to=last, user_id=1)
+    assert sum(bucket["paid"] for bucket in total) == Decimal("37.50")
+    assert sum(bucket["expense_count"] for bucket in total) == 2
@@ -0,0 +1,65 @@
+"""Debt simplification settles every balance in at most n - 1 transfers."""
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+import pytest
+
+from app.services.settlement_service import net_from_details, simplify_debts
+
+
+def settle(balances: dict, transfers) -> dict:
+    """What each balance is once ``transfers`` are paid."""
+    left = defaultdict(int, balances)
+    for transfer in transfers:
+        assert transfer.amount_cents > 0
+        left[transfer.from_user_id] += transfer.amount_cents
+        left[transfer.to_user_id] -= transfer.amount_cents
+    return left
+
+
+def random_balances(rng: random.Random, users: int) -> dict:
+    rows = [(rng.randrange(users), rng.randrange(users), rng.randrange(1, 100_000)) for _ in range(users * 5)]
+    return net_from_details(rows)
+
+
+def test_net_from_details_ignores_what_payers_owe_themselves():
+    assert dict(net_from_details([(1, 1, 500), (1, 2, 300), (2, 1, 100)])) == {1: 200, 2: -200}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_transfers_settle_every_balance_in_at_most_n_minus_1(seed):
+    balances = random_balances(random.Random(seed), users=2 + seed)
+    transfers = simplify_debts(balances)
+
+    assert all(cents == 0 for cents in settle(balances, transfers).values())
+    assert len(transfers) <= max(0, sum(1 for cents in balances.values() if cents) - 1)
+
+
+def test_transfers_only_go_from_debtors_to_creditors():
+    balances = {1: 700, 2: -300, 3: -400, 4: 0}
+    transfers = simplify_debts(balances)
+    assert {transfer.from_user_id for transfer in transfers} == {2, 3}
+    assert {transfer.to_user_id for transfer in transfers} == {1}
+
+
+def test_settled_balances_need_no_transfers():
+    assert simplify_debts({1: 0, 2: 0}) == []
+    assert simplify_debts({}) == []
+
+
+def test_settlements_endpoint_settles_the_recorded_expenses(client, users, auth_headers):
+    # User 1 pays 30 for 1, 2 and 3; user 2 pays 10 for 2 and 3
+    for payer, amount, participants in ((1, "30", [1, 2, 3]), (2, "10", [2, 3])):
+        client.post("/expenses/", json={"user_id": payer, "amount": amount, "method": "equal", "description": "Split",
+                                        "details": [{"user_id": user_id} for user_id in participants]}).raise_for_status()
+
+    response = client.get("/settlements/", headers=auth_headers)
+
+    assert response.status_code == 200
+    received = defaultdict(Decimal)
+    for transfer in response.json():
+        received[transfer["from_user_id"]] -= Decimal(transfer["amount"])
+        received[transfer["to_user_id"]] += Decimal(transfer["amount"])
+    # Balances: user 1 is owed 20, user 2 owes 10 - 5 = 5, user 3 owes 10 + 5 = 15
+    assert dict(received) == {1: Decimal("20.00"), 2: Decimal("-5.00"), 3: Decimal("-15.00")}
@@ -0,0 +1,255 @@
+"""Expense sharding, against a SQLite primary and three SQLite shards.
+
+Expenses are written through the API to a ring of two shards, then the third
+shard is brought in with an online rebalance while a writer keeps adding
+expenses and a reader keeps listing them. Each payer's expenses must sit on
+exactly the shard that owns them, the balance sheet and listings over all
+shards must match what was written, and the move must lose, duplicate or
+double-count nothing.
+
+The shards are configured when ``app`` is imported, so the test session runs
+this module again in a fresh interpreter with SHARD_URLS set.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from app import crud, database, models, response_cache, schemas, sharding
+from app.money import to_cents
+from app.services import ledger_service, settlement_service
+
+SHARDS = ("s0", "s1", "s2")
+USERS = 12
+
+pytestmark = pytest.mark.isolated(
+    SHARD_URLS=",".join(f"{name}=sqlite:///{{tmp_path}}/{name}.db" for name in SHARDS),
+    SHARD_RING="s0,s1",
+    SHARD_MAP_REFRESH_SECONDS="0.2",
+    SHARD_ID_BLOCK="50",
+)
+
+
+def expense(user_id: int, amount: str) -> dict:
+    partner = user_id % USERS + 1
+    return {"user_id": user_id, "amount": amount, "method": "equal", "description": f"Paid by {user_id}",
+            "details": [{"user_id": user_id}, {"user_id": partner}]}
+
+
+def placement() -> dict:
+    """``{expense_id: [shards holding it]}``, read from every shard directly."""
+    shards = defaultdict(list)
+    for name, shard_engine in database.shard_engines().items():
+        with shard_engine.connect() as conn:
+            for expense_id in conn.execute(select(models.Expense.id)).scalars():
+                shards[expense_id].append(name)
+    return shards
+
+
+def payers() -> dict:
+    expenses = {}
+    for shard_engine in database.shard_engines().values():
+        with shard_engine.connect() as conn:
+            expenses.update(conn.execute(select(models.Expense.id, models.Expense.user_id)).all())
+    return expenses
+
+
+def on_owner() -> bool:
+    shard_map = sharding.current_map()
+    where = placement()
+    return all(where[expense_id] == [shard_map.owner(sharding.shard_key(payer))]
+               for expense_id, payer in payers().items())
+
+
+def assert_balance_sheet_matches(client, written: dict):
+    response_cache.backend.clear()
+    sheet = {entry["user_id"]: entry for entry in client.get("/balance_sheet/").json()}
+    expected = defaultdict(list)
+    for expense_id, (user_id, amount) in written.items():
+        expected[user_id].append((expense_id, amount))
+    assert sheet.keys() == expected.keys()
+    for user_id, rows in expected.items():
+        assert Decimal(sheet[user_id]["total_expense"]) == sum(amount for _, amount in rows)
+        assert [row["id"] for row in sheet[user_id]["individual_expenses"]] == sorted(expense_id for expense_id, _ in rows)
+
+
+@pytest.fixture(scope="module")
+def written(client) -> dict:
+    """``{expense id: (payer, amount)}`` for every expense written; later fixtures add to it."""
+    sharding.create_tables()
+    for user_id in range(1, USERS + 1):
+        client.post("/users/", json={"email": f"user{user_id}@example.com", "name": f"User {user_id}",
+                                     "mobile_number": "0", "password": "pw"}).raise_for_status()
+    written = {}
+    for user_id in range(1, USERS + 1):
+        for amount in ("10.00", "25.50"):
+            created = client.post("/expenses/", json=expense(user_id, amount)).json()
+            written[created["id"]] = (user_id, Decimal(amount))
+
+    bulk = client.post("/expenses/bulk", json=[expense(user_id, "7.00") for user_id in range(1, USERS + 1)]).json()
+    assert bulk == {"created": USERS, "errors": []}
+    db = database.SessionLocal()
+    try:
+        for item in crud.get_all_expenses(db):
+            written.setdefault(item.id, (item.user_id, Decimal("7.00")))
+    finally:
+        db.close()
+    return written
+
+
+@pytest.fixture(scope="module")
+def key_reuse(client, written):
+    """Responses to one Idempotency-Key used for a payer, then for a payer on another shard, then retried."""
+    ring = sharding.current_map()
+    first = 1
+    other = next(user_id for user_id in range(2, USERS + 1)
+                 if ring.owner(sharding.shard_key(user_id)) != ring.owner(sharding.shard_key(first)))
+    key = {"Idempotency-Key": "test-sharding-1"}
+    created = client.post("/expenses/", json=expense(first, "3.00"), headers=key).json()
+    written[created["id"]] = (first, Decimal("3.00"))
+    reused = client.post("/expenses/", json=expense(other, "3.00"), headers=key)
+    retried = client.post("/expenses/", json=expense(first, "3.00"), headers=key).json()
+    return created, reused, retried
+
+
+@pytest.fixture(scope="module")
+def moved(written, key_reuse) -> Counter:
+    """Rebalance onto all three shards while a writer and a reader run; returns what they saw."""
+    stop = threading.Event()
+    written_lock = threading.Lock()
+    stats = Counter()
+
+    def writer():
+        db = database.SessionLocal()
+        user_id = 0
+        try:
+            while not stop.is_set():
+                user_id = user_id % USERS + 1
+                try:
+                    created = crud.add_expense(db, schemas.ExpenseCreate(**expense(user_id, "1.00")))
+                except sharding.ShardMoving:
+                    stats["rejected while frozen"] += 1
+                    time.sleep(0.05)
+                    continue
+                with written_lock:
+                    written[created.id] = (user_id, Decimal("1.00"))
+                stats["written during move"] += 1
+        finally:
+            db.close()
+
+    def reader():
+        while not stop.is_set():
+            seen = Counter(item.id for item in crud.get_all_expenses(None))
+            stats["reads during move"] += 1
+            stats["duplicates seen"] += sum(count - 1 for count in seen.values())
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=writer), threading.Thread(target=reader)]
+    for thread in threads:
+        thread.start()
+    try:
+        sharding.move_ranges(sharding.plan_ring(list(SHARDS)), chunk_size=20, log=lambda message: None)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    # What an operator does once the moves are done
+    sharding.SHARD_RING = list(SHARDS)
+    sharding._map = None
+    return stats
+
+
+def test_ids_are_unique_across_shards(written):
+    assert all(len(shards) == 1 for shards in placement().values())
+
+
+def test_each_payers_expenses_are_on_the_shard_that_owns_them(written):
+    assert on_owner()
+
+
+def test_the_ring_spreads_payers_over_both_shards(written):
+    assert set(Counter(name for shards in placement().values() for name in shards)) == {"s0", "s1"}
+
+
+def test_bulk_insert_spans_shards(written):
+    where = placement()
+    bulk_ids = [expense_id for expense_id, (_, amount) in written.items() if amount == Decimal("7.00")]
+    assert len(bulk_ids) == USERS
+    assert {where[expense_id][0] for expense_id in bulk_ids} == {"s0", "s1"}
+
+
+def test_a_key_reused_for_a_payer_on_another_shard_is_rejected(key_reuse):
+    created, reused, retried = key_reuse
+    assert reused.status_code == 422, reused.text
+    assert retried["id"] == created["id"]
+
+
+def test_balance_sheet_over_all_shards_matches_what_was_written(client, written, key_reuse):
+    assert_balance_sheet_matches(client, written)
+
+
+def test_paged_listing_over_all_shards_returns_every_expense_once(written, key_reuse):
+    ids, cursor = [], None
+    db = database.SessionLocal()
+    try:
+        while True:
+            page, cursor = crud.list_expenses(db, schemas.ExpenseQuery(limit=7, cursor=cursor))
+            ids += [item.id for item in page]
+            if cursor is None:
+                break
+    finally:
+        db.close()
+    assert sorted(ids) == sorted(written)
+
+
+def test_settlement_balances_over_all_shards_match_the_ledger(written, key_reuse):
+    db = database.SessionLocal()
+    try:
+        netted = {user_id: cents for user_id, cents in settlement_service.net_balances(db).items() if cents}
+        ledger = {row.user_id: to_cents(row.net) for row in db.query(models.UserBalance) if row.net}
+    finally:
+        db.close()
+    assert netted == ledger
+
+
+def test_fan_out_reads_never_saw_an_expense_twice_during_the_move(moved):
+    assert moved["reads during move"] > 0
+    assert moved["duplicates seen"] == 0
+
+
+def test_writes_continued_during_the_move(moved):
+    assert moved["written during move"] > 0
+
+
+def test_every_move_is_done(moved):
+    assert all(move.state == sharding.DONE for move in sharding.load_moves())
+
+
+def test_no_expense_is_lost_or_duplicated_by_the_move(moved, written):
+    where = placement()
+    assert sorted(where) == sorted(written)
+    assert all(len(shards) == 1 for shards in where.values())
+
+
+def test_each_payers_expenses_are_on_their_new_shard(moved):
+    assert on_owner()
+
+
+def test_the_new_shard_took_over_part_of_the_ring(moved):
+    assert any(shards == ["s2"] for shards in placement().values())
+
+
+def test_balance_sheet_still_matches_after_the_move(client, moved, written):
+    assert_balance_sheet_matches(client, written)
+
+
+def test_ledger_matches_the_expenses_on_the_shards(moved):
+    db = database.SessionLocal()
+    try:
+        assert ledger_service.verify_ledger(db) == []
+    finally:
+        db.close()
@@ -0,0 +1,100 @@
+"""The largest-remainder split engine, on its pure Python and NumPy paths."""
+import random
+from array import array
+from decimal import Decimal
+
+import pytest
+
+from app.schemas import ExpenseCreate
+from app.services import split_engine
+
+PATHS = ["python", "numpy"]
+
+
+def split(path: str, amounts, weights, offsets) -> list:
+    if path == "python":
+        return list(split_engine._split_batch_python(amounts, weights, offsets))
+    pytest.importorskip("numpy")
+    return list(split_engine._split_batch_numpy(amounts, weights, offsets))
+
+
+def expense(method: str, amount: str, details: list) -> ExpenseCreate:
+    return ExpenseCreate(user_id=1, amount=amount, method=method, description="Test", details=details)
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_leftover_cents_go_to_the_earlier_participants_on_ties(path):
+    # 100.00 three ways: 3333 cents each and one left over, for the first participant
+    assert split(path, [10000], [1, 1, 1], [0, 3]) == [3334, 3333, 3333]
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_leftover_cents_go_to_the_largest_remainders(path):
+    # 1.00 by weights 1, 2, 3: exact shares 16.67, 33.33, 50 cents
+    assert split(path, [100], [1, 2, 3], [0, 3]) == [17, 33, 50]
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_a_batch_is_split_per_expense(path):
+    amounts, weights, offsets = [10000, 1, 700], [1, 1, 1, 5, 5, 0, 7], [0, 3, 5, 7]
+    assert split(path, amounts, weights, offsets) == [3334, 3333, 3333, 1, 0, 0, 700]
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_an_expense_without_weights_is_rejected(path):
+    with pytest.raises(ValueError):
+        split(path, [100], [0, 0], [0, 2])
+
+
+def test_numpy_and_python_give_identical_splits():
+    pytest.importorskip("numpy")
+    rng = random.Random(20)
+    amounts, weights, offsets = array("q"), array("q"), array("q", [0])
+    for _ in range(500):
+        amounts.append(rng.randrange(0, 10_000_000))
+        weights.extend(rng.randrange(0, 5) or 1 for _ in range(rng.randrange(1, 12)))
+        offsets.append(len(weights))
+    assert split("numpy", amounts, weights, offsets) == split("python", amounts, weights, offsets)
+
+
+def test_numpy_path_declines_products_that_could_overflow():
+    pytest.importorskip("numpy")
+    assert split_engine._split_batch_numpy([2**40], [2**30], [0, 1]) is None
+
+
+@pytest.mark.parametrize("method, details, weights", [
+    ("equal", [{"user_id": 1}, {"user_id": 2}, {"user_id": 3}], [1, 1, 1]),
+    ("shares", [{"user_id": 1, "shares": 2}, {"user_id": 2, "shares": 1}], [2, 1]),
+    ("percentage", [{"user_id": 1, "percentage": "33.33"}, {"user_id": 2, "percentage": "66.67"}], [3333, 6667]),
+    ("exact", [{"user_id": 1, "amount_owed": "40.00"}, {"user_id": 2, "amount_owed": "60.00"}], [4000, 6000]),
+])
+def test_expense_weights_per_method(method, details, weights):
+    assert split_engine.expense_weights(expense(method, "100", details)) == (10000, weights)
+
+
+@pytest.mark.parametrize("method, details", [
+    ("exact", [{"user_id": 1, "amount_owed": "40.00"}, {"user_id": 2, "amount_owed": "59.99"}]),
+    ("percentage", [{"user_id": 1, "percentage": "50"}, {"user_id": 2, "percentage": "49.99"}]),
+    ("percentage", [{"user_id": 1, "percentage": "50.0000000000001"}, {"user_id": 2, "percentage": "49.9999999999999"}]),
+    ("percentage", [{"user_id": 1, "percentage": "NaN"}, {"user_id": 2, "percentage": "100"}]),
+    ("shares", [{"user_id": 1, "shares": 0}]),
+    ("shares", [{"user_id": 1}]),
+    ("equal", []),
+])
+def test_expense_weights_rejects_splits_that_do_not_add_up(method, details):
+    with pytest.raises(ValueError):
+        split_engine.expense_weights(expense(method, "100", details))
+
+
+def test_split_expense_amounts_add_up_to_the_expense():
+    details = split_engine.split_expense(expense("equal", "100", [{"user_id": 1}, {"user_id": 2}, {"user_id": 3}]))
+    assert [detail["amount_owed"] for detail in details] == [Decimal("33.34"), Decimal("33.33"), Decimal("33.33")]
+    assert [detail["percentage"] for detail in details] == [Decimal("33.33")] * 3
+
+
+def test_percentages_finer_than_a_basis_point_are_split_exactly():
+    details = [{"user_id": 1, "percentage": "33.333"}, {"user_id": 2, "percentage": "33.333"},
+               {"user_id": 3, "percentage": "33.334"}]
+    assert split_engine.expense_weights(expense("percentage", "100", details)) == (10000, [33333, 33333, 33334])
+    split = split_engine.split_expense(expense("percentage", "100", details))
+    assert [detail["amount_owed"] for detail in split] == [Decimal("33.33"), Decimal("33.33"), Decimal("33.34")]